@@ -11,12 +11,16 @@ Check out the 'helptext' folder for more information about this project.
 #region Imports
 
 from debugwrapper import *
+import debugwrapper
 from extensions import *
 from structs import *
-from globalvars import *
-from reduction import *
-import primitiveActions
-import primitiveExpressions
+from interpreter import Interpreter
+import engines
+import stats
+import limits
+import defcache
+import watch
+import daemon
 
 #endregion
 #region Command-Line Arguments
@@ -26,6 +30,148 @@ clarg_filepath = None
 
 def programCanStart(): return clarg_filepath != None #
 
+"""Selects the reduction engine (see engines.names).
+	-engine <name>
+"""
+clargname_engine = '-engine'
+
+"""str - the name of the reduction engine to use"""
+clarg_engine = engines.current
+
+"""Stores definition bodies as packed expressions (see packedSubs.py).
+	-packDefinitions
+"""
+clargname_packDefinitions = '-packDefinitions'
+
+"""bool - whether DoDef should pack definition bodies"""
+clarg_packDefinitions = False
+
+"""Stores definition bodies in a term arena of typed arrays (see arena.py).
+	-arenaDefinitions
+"""
+clargname_arenaDefinitions = '-arenaDefinitions'
+
+"""bool - whether DoDef should store definition bodies in a term arena"""
+clarg_arenaDefinitions = False
+
+"""Runs 'do' statements in several processes at once (see interpreter.Interpreter._LoadParallel).
+	-jobs <number>
+"""
+clargname_jobs = '-jobs'
+
+"""int - how many processes may run 'do' statements (str or 'None' if no valid number was given)"""
+clarg_jobs = 1
+
+"""Prints the time and counters of each statement when the program finishes (see stats.PrintProfile).
+	-profile
+"""
+clargname_profile = '-profile'
+
+"""Writes the profile of each statement to a JSON file (implies -profile).
+	-profileJSON <filepath>
+"""
+clargname_profileJSON = '-profileJSON'
+
+"""bool - whether each statement is profiled"""
+clarg_profile = False
+
+"""str - the file to write the profile to ('None' to not write it)"""
+clarg_profileJSON = None
+
+"""Prints the peak memory and expression nodes of each statement when the program finishes (see stats.PrintMemory).
+Memory is traced by tracemalloc, which makes the program slower (see stats.MeasureMemory).
+	-profileMemory
+"""
+clargname_profileMemory = '-profileMemory'
+
+"""bool - whether the memory of each statement is measured"""
+clarg_profileMemory = False
+
+"""Limits the work done by each statement (see limits.py).
+	-maxSteps <number>		function applications
+	-maxNodes <number>		nodes created by copying expressions
+	-timeout <seconds>		time taken
+	-maxMemory <megabytes>	memory allocated by the whole program, traced by tracemalloc (see stats.TraceMemory)
+"""
+clargname_maxSteps = '-maxSteps'
+clargname_maxNodes = '-maxNodes'
+clargname_timeout = '-timeout'
+clargname_maxMemory = '-maxMemory'
+
+"""int, float, or str (not a valid number) - each limit ('None' for no limit)"""
+clarg_maxSteps = None
+clarg_maxNodes = None
+clarg_timeout = None
+clarg_maxMemory = None
+
+"""Keeps simplified definitions in a file next to the source file, so that they are not
+simplified again the next time the file is run (see defcache.py).
+	-cache
+"""
+clargname_cache = '-cache'
+
+"""bool - whether definitions are kept in a cache file"""
+clarg_cache = False
+
+"""Only simplifies the body of a 'def' when it is first referenced (see reduction.NormalizeDefinition).
+	-lazyDefinitions
+"""
+clargname_lazyDefinitions = '-lazyDefinitions'
+
+"""bool - whether 'def' bodies are simplified when they are first referenced"""
+clarg_lazyDefinitions = False
+
+"""The most characters of each expression written by 'print'. Longer expressions are cut short and end with '...'.
+	-printLength <number>
+"""
+clargname_printLength = '-printLength'
+
+"""int, or str (not a valid number) - the most characters printed ('None' for no limit)"""
+clarg_printLength = None
+
+"""Rewrites eta-expansions, identity applications and known combinators before each statement is simplified (see rewrite.py).
+	-rewrite
+"""
+clargname_rewrite = '-rewrite'
+
+"""bool - whether statements are rewritten before they are simplified"""
+clarg_rewrite = False
+
+"""Runs the file again whenever it changes, only redoing the statements affected by the change (see watch.py).
+	-watch
+"""
+clargname_watch = '-watch'
+
+"""bool - whether the file is watched for changes"""
+clarg_watch = False
+
+"""Runs the file as a prelude, then answers requests to define and evaluate expressions on a Unix socket
+until stopped (see daemon.py).
+	-daemon <socketpath>
+"""
+clargname_daemon = '-daemon'
+
+"""str - the socket to listen on ('None' to not run as a daemon)"""
+clarg_daemon = None
+
+valid_clargnames.append(clargname_engine)
+valid_clargnames.append(clargname_packDefinitions)
+valid_clargnames.append(clargname_arenaDefinitions)
+valid_clargnames.append(clargname_jobs)
+valid_clargnames.append(clargname_profile)
+valid_clargnames.append(clargname_profileJSON)
+valid_clargnames.append(clargname_profileMemory)
+valid_clargnames.append(clargname_maxSteps)
+valid_clargnames.append(clargname_maxNodes)
+valid_clargnames.append(clargname_timeout)
+valid_clargnames.append(clargname_maxMemory)
+valid_clargnames.append(clargname_cache)
+valid_clargnames.append(clargname_lazyDefinitions)
+valid_clargnames.append(clargname_printLength)
+valid_clargnames.append(clargname_rewrite)
+valid_clargnames.append(clargname_watch)
+valid_clargnames.append(clargname_daemon)
+
 #region Help
 
 help_folder = "helptext"
@@ -66,6 +212,23 @@ def PrintHelp():
 def HandleCLArguments():
 	"""Reads and handles the command-line arguments."""
 	global clarg_filepath
+	global clarg_engine
+	global clarg_packDefinitions
+	global clarg_arenaDefinitions
+	global clarg_jobs
+	global clarg_profile
+	global clarg_profileJSON
+	global clarg_profileMemory
+	global clarg_maxSteps
+	global clarg_maxNodes
+	global clarg_timeout
+	global clarg_maxMemory
+	global clarg_cache
+	global clarg_lazyDefinitions
+	global clarg_printLength
+	global clarg_rewrite
+	global clarg_watch
+	global clarg_daemon
 
 	# filepath
 	try:
@@ -76,549 +239,323 @@ def HandleCLArguments():
 	except:
 		pass
 
-	# handle core command-line arguments, or print help text
-	if programCanStart():
-		HandleCoreCLArguments()
-	else:
-		PrintHelp()
-#
-
-#endregion
-#region Keywords
-
-"""Create a Definition.
-	def <name> <body>
-"""
-keyword_Define = 'def'
-
-"""Create an unsimplified Definition.
-	def_u <name> <body>
-"""
-keyword_DefineUnsimplified = 'def_u'
-
-"""Simplify an expression and execute all primitive functions
-	do <expression>
-"""
-keyword_Execute = 'do'
-
-
-"""List of all valid Entry-level keywords"""
-Keywords = [keyword_Define, keyword_DefineUnsimplified, keyword_Execute]
-
-#endregion
-#region Interpreter
-"""Note: Most functions within this #region use the variable 'char'. Some use 'file' and 'location'."""
-
-"""The file to read input from"""
-file = None
-
-"""The current character being read from the file"""
-char = ''
-
-"""The location of the current character in the file.
-Tuple of (int, int): (line number, column number)
-"""
-location = (1,1)
-
-
-def getchar():
-	"""Gets the next character from the input file and stores it in 'char'."""
-	global char
-	global location
-
-	char = file.read(1)
-
-	if char == '\n':
-		location = (location[0] + 1, 1)
-	else:
-		location = (location[0], location[1] + 1)
-#
-
-#region Character Recognition
-"""Functions and variables for recognising what kind of character/token is being read at the moment."""
+	# engine
+	if clargname_engine in sys.argv:
+		try:
+			clarg_engine = sys.argv[sys.argv.index(clargname_engine) + 1]
+		except IndexError:
+			clarg_engine = None
+	#
 
-chars_whitespace = ' \t\r\n'
+	# packDefinitions
+	clarg_packDefinitions = clargname_packDefinitions in sys.argv
 
-char_CommentStart = '/'
-char_CommentSingle = '/'
-char_CommentMultiline = '*'
+	# arenaDefinitions
+	clarg_arenaDefinitions = clargname_arenaDefinitions in sys.argv
 
-char_BracketStart = '('
-char_BracketEnd = ')'
+	# jobs
+	if clargname_jobs in sys.argv:
+		try:
+			clarg_jobs = sys.argv[sys.argv.index(clargname_jobs) + 1]
+			clarg_jobs = int(clarg_jobs)
+		except IndexError:
+			clarg_jobs = None
+		except ValueError:
+			pass # Interpreter will report the text which is not a number
+	#
 
-char_FuncStart = '['
-char_FuncEnd = ']'
-char_FuncArgumentEnd = '.'
+	# profile
+	if clargname_profileJSON in sys.argv:
+		try:
+			clarg_profileJSON = sys.argv[sys.argv.index(clargname_profileJSON) + 1]
+		except IndexError:
+			pass # no file path: the profile is only printed
+	#
+	clarg_profile = clargname_profile in sys.argv or clarg_profileJSON != None
+	clarg_profileMemory = clargname_profileMemory in sys.argv
 
-char_Recursive = '$'
+	# limits
+	def number(clargname, convert):
+		if clargname not in sys.argv:
+			return None
+		try:
+			text = sys.argv[sys.argv.index(clargname) + 1]
+		except IndexError:
+			return ''
+		try:
+			return convert(text)
+		except ValueError:
+			return text # limits.Limits will report the text which is not a number
+	#
+	clarg_maxSteps = number(clargname_maxSteps, int)
+	clarg_maxNodes = number(clargname_maxNodes, int)
+	clarg_timeout = number(clargname_timeout, float)
+	clarg_maxMemory = number(clargname_maxMemory, float)
 
-chars_NotIdentifier = (
-	chars_whitespace
-	+ char_BracketStart + char_BracketEnd
-	+ char_FuncStart + char_FuncEnd + char_FuncArgumentEnd
-	)
+	# cache
+	clarg_cache = clargname_cache in sys.argv
 
-"""Functions that return bool - whether current character is a certain type of character"""
-def ischar_whitespace(char):		return char  and  char in chars_whitespace #
-def ischar_CommentStart(char):		return char == char_CommentStart #
-def ischar_BracketStart(char):		return char == char_BracketStart #
-def ischar_BracketEnd(char):		return not char  or  char == char_BracketEnd  or  char == char_FuncEnd #
-def ischar_FuncStart(char):			return char == char_FuncStart #
-def ischar_FuncEnd(char):			return not char  or  char == char_FuncEnd #
-def ischar_FuncArgumentEnd(char):	return char == char_FuncArgumentEnd #
-def ischar_Identifier(char):		return char  and  char not in chars_NotIdentifier #
+	# lazyDefinitions
+	clarg_lazyDefinitions = clargname_lazyDefinitions in sys.argv
 
-#endregion
-#region Do... Functions
+	# printLength
+	clarg_printLength = number(clargname_printLength, int)
 
-#region DoComments
+	# rewrite
+	clarg_rewrite = clargname_rewrite in sys.argv
 
-def DoCommentSingle():
-	"""Single-line comment. Reads all characters until endline '\n' is found.
-	Returns:
-		str - the comment's content
-	Input Example:
-		//comment
-	"""
-	retval = ''
-	while char and char != '\n':
-		retval += char
-		getchar()
-	return retval
-#
+	# watch
+	clarg_watch = clargname_watch in sys.argv
 
-def DoCommentMultiline():
-	"""Multiline comment. Reads all characters until character sequence '*/' is found.
-	Returns:
-		str - the comment's content
-	Input Example:
-		/*comment*/
-	"""
-	retval = ''
-	while char:
-		if char == char_CommentMultiline:
-			getchar()
-			if char == char_CommentStart:
-				getchar()
-				return retval
-			else:
-				retval += char
-				getchar()
-		#
-		else:
-			retval += char
-			getchar()
+	# daemon
+	if clargname_daemon in sys.argv:
+		try:
+			clarg_daemon = sys.argv[sys.argv.index(clargname_daemon) + 1]
+		except IndexError:
+			clarg_daemon = ''
 	#
-	return retval
-#
 
-def DoComment():
-	"""Checks if a comment is starting, and retrieves the comment. If no comment is starting, restore current location in file.
-	Assumes:
-		char == char_CommentStart
-	Returns:
-		str  - the comment
-		None - no comment was starting
-	Input Examples:
-		//comment
-		/*comment*/
-	"""
-	global location
-
-	# store location
-	oldposition = file.tell()
-	oldlocation = location
-
-	getchar()
-	if char == char_CommentSingle:
-		getchar()
-		return DoCommentSingle()
-	#
-	elif char == char_CommentMultiline:
-		getchar()
-		return DoCommentMultiline()
-	#
+	# handle core command-line arguments, or print help text
+	if programCanStart():
+		HandleCoreCLArguments()
 	else:
-		#restore location
-		file.seek(oldposition)
-		location = oldlocation
-		#return None
+		PrintHelp()
 #
 
 #endregion
-#region Cradle
-
-def skipwhite():
-	"""Skips characters until a non-whitespace character is found. Retrieves any comments along the way.
-	Returns:
-		list(str) - list of comments
-	"""
-	comments = []
-	if ischar_CommentStart(char):
-		appendIfTruthy(comments, DoComment())
-	#
-	while ischar_whitespace(char):
-		getchar()
-		if ischar_CommentStart(char):
-			appendIfTruthy(comments, DoComment())
-		#
-	#
-	return comments
-#
+#region Entry
 
-def match(s):
-	"""Matches the next string of characters (throws an error if string was not correct), then skips whitespace.
+def ReportProfile(records):
+	"""Prints the profile of each statement, and writes it to a file if '-profileJSON' was given.
 	Arguments:
-		s: str - the expected string of characters
-	Returns:
-		list(str) - list of comments
-	Exceptions:
-		DefunctInputError - the sequence of characters was not expected.
+		records: list of dictionary - see interpreter.Interpreter.profile
 	"""
-	for c in s:
-		if char != c:
-			raise DefunctError_InputError("Expected '{0}', got '{1}'.".format(s, char), location)
-		getchar()
+	print()
+	stats.PrintProfile(records)
+	if clarg_profileJSON != None:
+		stats.WriteProfile(records, clarg_profileJSON)
+		printinfo ('Profile written to "{0}".'.format(clarg_profileJSON))
 	#
-	return skipwhite()
 #
 
-#endregion
-#region DoIdentifiers
-
-def DoIdentifier():
-	"""Does an identifier name (e.g. argument name, definition name, reference name)
-	Returns:
-		str - the identifier/name
+def ReportMemory(records):
+	"""Prints the peak memory of each statement, if '-profileMemory' was given.
+	Arguments:
+		records: list of dictionary - see interpreter.Interpreter.profile
 	"""
-	if not ischar_Identifier(char):
-		raise DefunctError_InputError("Expected identifier, got '{0}'.".format(char), location)
-
-	retval = char
-	getchar()
-	while ischar_Identifier(char):
-		if ischar_CommentStart(char):
-			DoComment()
-			break
-		#else
-		retval += char
-		getchar()
+	if clarg_profileMemory:
+		print()
+		stats.PrintMemory(records)
 	#
-	skipwhite()
-	return retval
-#
-
-def DoKeyword():
-	name = DoIdentifier()
-	if name not in Keywords:
-		raise DefunctError_InputError("Expected keyword, got '{0}'".format(name), location)
-	return name
-#
-def DoName():
-	name = DoIdentifier()
-	if name in Keywords and not name in primitiveActions.names:
-		raise DefunctError_InputError("Expected identifier, got keyword '{0}'".format(name), location)
-	return name
-#
-def DoFuncArgname():
-	name = DoName()
-	if name in primitiveActions.names:
-		raise DefunctError_InputError("Function Argument cannot have primitive name '{0}'".format(name), location)
-	return name
-#
-def DoDefName():
-	name = DoIdentifier()
-	if name in Keywords:
-		raise DefunctError_InputError("Expected identifier, got keyword '{0}'".format(name), location)
-	elif name in primitiveActions.names:
-		raise DefunctError_InputError("Expected identifier, got primitive '{0}'".format(name), location)
-	return name
 #
 
-#endregion
-
-def DoRef():
-	"""Does an argument/definition reference by name.
-	Returns:
-		ArgRef
-	"""
-	return ArgRef(argname=DoName())
-#
-
-#region DoFunc
-
-def LinkArgRefs(sub, func):
-	"""Makes sure local ArgRefs with same name as func.argname are linked to that Func.
+def SaveCache(cache):
+	"""Writes the definition cache if anything changed. A cache which cannot be written is only reported.
 	Arguments:
-		sub: Sub - the current expression node
-		func: Func - the function to link references to
+		cache: defcache.DefinitionCache
 	"""
-	if sub == None or func == None:
+	try:
+		cache.Save()
+	except OSError as e:
+		printinfo ('Could not write the definition cache "{0}": {1}'.format(cache.filepath, e))
 		return
-
-	if type(sub) == ArgRef:
-		if sub.func == None and sub.argname == func.argname:
-			sub.func = func
-
-	elif type(sub) == Func:
-		LinkArgRefs(sub.body, func)
-
-	elif type(sub) == Bracket:
-		LinkArgRefs(sub.left, func)
-		LinkArgRefs(sub.right, func)
-#
-
-def DoFuncArg():
-	"""Creates a new function with its argname and recursiveness, but not its body.
-	Returns:
-		Func - the newly created function
-	"""
-	func = Func()
-
-	if char == char_Recursive:
-		match(char_Recursive)
-		func.recursive = True
 	#
-
-	func.argname = DoFuncArgname()
-
-	return func
-#
-
-def DoFuncSeries():
-	"""Does a series of functions inside a function definition bracket set (like a function with multiple arguments).
-	Returns:
-		Func - the top Func, possibly the start of many Funcs
-	Input Examples:
-		[x. (...) ]
-		[x y z. (...) ]
-	"""
-	match(char_FuncStart)
-
-	# creating Funcs
-	topfunc = DoFuncArg()
-	funcs = [ topfunc ]
-	endfunc = topfunc
-
-	while not ischar_FuncArgumentEnd(char):
-		func = DoFuncArg()
-		endfunc.body = func
-
-		funcs.append(func)
-		endfunc = func
-	#
-	if char:
-		match(char_FuncArgumentEnd)
-
-	# getting body
-	endfunc.body = DoSeries()
-	
-	# linking ArgRefs
-	for func in reversed(funcs):
-		LinkArgRefs(func.body, func)
-	#
-
-	if char:
-		match(char_FuncEnd)
-
-	return topfunc
-#
-
-#endregion
-#region DoSeries
-
-def DoSeries():
-	"""Does a series of expressions
-	Returns:
-		Sub - a single expression (there were no further expressions)
-		Bracket - top of series of expressions
-	Input Examples:
-		x				-> x
-		x y z			-> ((x y)z)
-		x(y z)			-> (x(y z))
-		()				-> [x.x]
-	"""
-	if ischar_BracketEnd(char):
-		return primitiveExpressions.identity()
-
-	retval = DoSub()
-	while not ischar_BracketEnd(char):
-		retval = Bracket(
-			left=retval,
-			right=DoSub()
-			)
-	#
-	return retval
+	printinfo ('Definition cache "{0}": {1} found, {2} simplified.'.format(cache.filepath, cache.hits, cache.misses))
 #
 
-def DoBracketedSeries():
-	"""Does a series of expressions contained within parentheses.
+def InterpreterOptions():
+	"""Gets the arguments of an Interpreter from the command-line arguments, except 'cache' and 'output'.
 	Returns:
-		Sub - a single expression
-		Brackte - top of series of expressions
-	Input Examples:
-		x				-> x
-		x y z			-> ((x y)z)
-		x(y z)			-> (x(y z))
-		()				-> [x.x]
+		dictionary
+	Exceptions:
+		DefunctError - a limit is not a positive number
 	"""
-	match(char_BracketStart)
-	retval = DoSeries()
-	if char:
-		match(char_BracketEnd)
-	return retval
+	return {
+		'engine': clarg_engine,
+		'packDefinitions': clarg_packDefinitions,
+		'jobs': clarg_jobs,
+		'profile': clarg_profile or clarg_profileMemory,
+		'limits': limits.Limits(steps=clarg_maxSteps, nodes=clarg_maxNodes, seconds=clarg_timeout, memory=clarg_maxMemory),
+		'lazyDefinitions': clarg_lazyDefinitions,
+		'printLength': clarg_printLength,
+		'arenaDefinitions': clarg_arenaDefinitions,
+		'rewrite': clarg_rewrite,
+		}
 #
 
-#endregion
-
-def DoSub():
-	"""Does an expression and any sub-expressions.
+def OpenCache(filepath):
+	"""Loads the definition cache of a file, if '-cache' was given.
+	Arguments:
+		filepath: str - the file being interpreted
 	Returns:
-		Sub - an expression node
+		defcache.DefinitionCache ('None' if not caching)
 	"""
-
-	if ischar_BracketStart(char):
-		return DoBracketedSeries()
-
-	elif ischar_FuncStart(char):
-		return DoFuncSeries()
-
-	elif ischar_Identifier(char):
-		return DoRef()
+	if not clarg_cache:
+		return None
+	cache = defcache.DefinitionCache(filepath + defcache.extension)
+	cache.Load()
+	return cache
 #
 
-#region DoDef
-
-def DoDef(simplify = True):
-	"""Does a definition with an expression bound to a name which can later be referenced.
+def InterpretFile(filepath):
+	"""Opens a file and begins interpretation.
 	Arguments:
-		simplify: bool - should the retrieved input expression be simplified before storing?
-	Changes:
-		definitions
-	Returns:
-		None
-	Input Examples:
-		def   myFunc ([a.a][x y.y x])			// [x y. y x] is bound to myFunc
-		def_u myExpr ([a.a][a b.b a])			// ([a.a][a b.b a]) is bound to myExpr
-		def   myRef myFunc						// [x y. y x]
-		def_u myRefu myFunc						// ?myFunc
-		def   myUnknown unknown					// ?unknown
-		def myExpr [a.a[x.x]]					// myExpr is now [a.a[x.x]], no longer ([a.a][a b.b a])
+		filepath: str - the file to open
+	Exceptions:
+		DefunctError:FileNotFoundError - no file was found at <filepath>
 	"""
-	global definitions
-	
-	name = DoDefName()
-
-	#if name in definitions:
-	#	raise DefunctError("Def with name '{0}' already exists.".format(name))
-
-	dfn = Def(
-		name=name,
-		body=DoSub()
-		)
-
-	definitions[name] = dfn
-	
-	#dprint ("{0}   initially  {1}".format(name, SubToString(dfn.body, dfn.body)))
-
-	if simplify:
-		dfn.body = Simplify(dfn.body, execute=False)
-		#dprint ("{0}   finally    {1}".format(dfn.name, SubToString(dfn.body, dfn.body)))
-
-		#for d in FindIdenticalDefs(dfn.body):
-		#	if d.name != dfn.name:
-		#		dprint("\tIdentical to '{0}'".format(d.name))
+	try:
+		cache = OpenCache(filepath)
+		interpreter = Interpreter(cache=cache, **InterpreterOptions())
+		printinfo ('Interpreting file at "{0}"...'.format(filepath))
+		with open(filepath, 'r') as file:
+			text = file.read()
+		#
+		try:
+			interpreter.load(text)
+		finally:
+			if clarg_profile:
+				ReportProfile(interpreter.profile)
+			ReportMemory(interpreter.profile)
+			if cache != None:
+				SaveCache(cache)
 		#
+		printinfo ('Finished interpreting file at "{0}".'.format(filepath))
+	except FileNotFoundError as e:
+		raise DefunctError('File not found at "{0}"'.format(filepath)) from e
 	#
 #
 
-#endregion
-
-def DoEntry():
-	"""Does a series of definitions and executions."""
-	while char:
-		key = DoKeyword()
-
-		if key == keyword_Define:
-			DoDef()
-		#
-		elif key == keyword_DefineUnsimplified:
-			DoDef(simplify=False)
-		#
-		elif key == keyword_Execute:
-			sub = DoSub()
-			dprint ('EXECUTE    ' + SubToString(sub, sub), flush=True)
-			sub = Simplify(sub, execute=True)
-			dprint ('Finally    ' + SubToString(sub, sub), flush=True)
+def WatchFile(filepath):
+	"""Interprets a file, then interprets it again whenever it changes until the user stops the program (Ctrl+C).
+	Errors in the program are reported, and the file is still watched.
+	Arguments:
+		filepath: str - the file to watch
+	Exceptions:
+		DefunctError - the command-line arguments are not valid
+	"""
+	cache = OpenCache(filepath)
+	watcher = watch.Watcher(filepath, cache=cache, **InterpreterOptions())
+	try:
+		while True:
+			printinfo ('Interpreting file at "{0}"...'.format(filepath))
+			try:
+				watcher.Run()
+			except FileNotFoundError:
+				print ('\nFile not found at "{0}"'.format(filepath))
+			except DefunctError as e:
+				ReportError(e)
+			finally:
+				if watcher.interpreter != None:
+					if clarg_profile:
+						ReportProfile(watcher.interpreter.profile)
+					ReportMemory(watcher.interpreter.profile)
+				#
+				if cache != None:
+					SaveCache(cache)
+			#
+			print ('\n--- {0} statements run, {1} unchanged. Watching "{2}" for changes (Ctrl+C to stop)...'.format(
+				watcher.ran, watcher.reused, filepath), flush=True)
+			watcher.Wait()
 		#
+	except KeyboardInterrupt:
+		printinfo ('Stopped watching "{0}".'.format(filepath))
 	#
 #
 
-#endregion
-#region Entry
-
-def InterpretFile(filepath):
-	"""Opens a file and begins interpretation.
+def ServeFile(filepath):
+	"""Interprets a file as a prelude, then runs a daemon which answers requests against its definitions.
 	Arguments:
-		filepath: str - the file to open
+		filepath: str - the prelude
 	Exceptions:
-		DefunctError:FileNotFoundError - no file was found at <filepath>
+		DefunctError - the prelude could not be run, or the daemon could not listen on the socket
 	"""
-	global file
+	if not clarg_daemon:
+		raise DefunctError('Expected a socket path after {0}.'.format(clargname_daemon))
 
 	try:
-		printinfo ('Interpreting file at "{0}"...'.format(filepath))
+		cache = OpenCache(filepath)
+		interpreter = Interpreter(cache=cache, **InterpreterOptions())
+		printinfo ('Interpreting prelude at "{0}"...'.format(filepath))
 		with open(filepath, 'r') as file:
-			getchar()
-			skipwhite()
-			DoEntry()
+			text = file.read()
+		#
+		try:
+			interpreter.load(text)
+		finally:
+			if cache != None:
+				SaveCache(cache)
 		#
-		printinfo ('Finished interpreting file at "{0}".'.format(filepath))
 	except FileNotFoundError as e:
 		raise DefunctError('File not found at "{0}"'.format(filepath)) from e
 	#
-#
 
-#endregion
+	printinfo ('Listening on "{0}" (Ctrl+C to stop)...'.format(clarg_daemon))
+	server = daemon.Daemon(interpreter, clarg_daemon)
+	server.Run()
+	printinfo ('Stopped after {0} requests.'.format(server.requests))
+#
 
 #endregion
 #region MAIN
 
+def ReportError(e):
+	"""Prints an error which stopped the program.
+	Arguments:
+		e: DefunctError
+	Exceptions:
+		DefunctError - the error is raised again if debugging ('-debugInternal')
+	"""
+	if type(e) == DefunctError_InputError:
+		print("\n{0} (line {2}): {1}\n(line {2}, column {3})".format(
+			'InputError',
+			e,
+			e.location[0],
+			e.location[1]
+		))
+		if cl_printdebug:
+			raise e
+	#
+	else:
+		print("\n{0}: {1}\n{2}".format(
+			'Error',
+			e,
+			type(e).__name__
+		))
+		print (cl_printdebug)
+		if cl_printdebug:
+			raise e
+	#
+#
+
 def main():
 	"""The main entry point for the Defunct Interpreter."""
 
 	HandleCLArguments()
 
 	if programCanStart():
+		if clarg_profileMemory:
+			stats.MeasureMemory()
+		elif clarg_maxMemory != None:
+			stats.TraceMemory() # so that -maxMemory counts the memory of the whole program
 		try:
-			InterpretFile(clarg_filepath)
-			printinfo('No errors encountered.')
-		#
-		except DefunctError_InputError as e:
-			print("\n{0} (line {2}): {1}\n(line {2}, column {3})".format(
-				'InputError',
-				e,
-				e.location[0],
-				e.location[1]
-			))
-			if cl_printdebug:
-				raise e
+			if clarg_daemon != None:
+				ServeFile(clarg_filepath)
+			elif clarg_watch:
+				WatchFile(clarg_filepath)
+			else:
+				InterpretFile(clarg_filepath)
+				printinfo('No errors encountered.')
 		#
 		except DefunctError as e:
-			print("\n{0}: {1}\n{2}".format(
-				'Error',
-				e,
-				type(e).__name__
-			))
-			print (cl_printdebug)
-			if cl_printdebug:
-				raise e
+			ReportError(e)
 		#
 	#
 #
 
 """Call the program while wrapped in debug helpers"""
-doMain(main)
+if __name__ == '__main__':
+	doMain(main)
 
 #endregion
 
@@ -0,0 +1,381 @@
+#region imports
+
+from array import array
+
+from structs import *
+import stats
+import limits
+
+#endregion
+#region Term Arena
+
+"""NOTE:
+A term arena keeps expressions in three parallel arrays instead of one Python object per node,
+which takes a fraction of the memory for large expressions (9 bytes per node, see TermArena.Bytes).
+
+Each expression is stored in one run of consecutive positions, node by node in prefix order:
+	tag				a							b
+	node_Bracket	offset of 'right' from it	-
+	node_Func		<argname>					-
+	node_Bound		de Bruijn index				<argname>
+	node_Unbound	<name>						-
+	node_Numeral	<the Numeral>				-
+	node_Foreign	<the ArgRef>				-
+	node_None		-							-
+where <...> is a position in the arena's table of values. 'left' and 'body' always directly follow their node.
+
+Every position within a run is relative to the start of the run, so a run can be copied with a single
+slice of each array (see TermArena.Copy). A run is freed when its ArenaTerm is no longer used,
+and is reused by the next expression of the same size (see TermArena.Allocate).
+Each value counts the nodes which refer to it, and is dropped when the last of them is freed,
+so that the table does not keep the names, Numerals and ArgRefs (and their Funcs) of freed expressions.
+"""
+
+"""Node tags (int) of stored expressions"""
+node_Bracket = 0
+node_Func = 1
+node_RecursiveFunc = 2
+node_Bound = 3
+node_Unbound = 4
+node_Numeral = 5
+node_Foreign = 6
+node_None = 7
+
+class ArenaTerm:
+	"""Refers to an expression stored in a TermArena. Frees the expression's run when it is deleted.
+	Like a PackedSub, it is never changed, so it can be shared but must be loaded (see Load) to be simplified.
+	"""
+	__slots__ = ('arena', 'start', 'size')
+
+	def __init__(this, arena, start, size):
+		"""
+		Arguments:
+			arena : TermArena - where the expression is stored
+			start : int - the position of its first node
+			size  : int - how many nodes it has
+		"""
+		this.arena = arena
+		this.start = start
+		this.size = size
+	#
+
+	def __del__(this):
+		this.arena.Free(this.start, this.size)
+	#
+#
+
+def IsArena(sub):
+	"""Whether an expression is an ArenaTerm."""
+	return type(sub) == ArenaTerm
+#
+
+class TermArena:
+	"""Stores expressions in parallel typed arrays (see the NOTE above)."""
+
+	def __init__(this):
+		"""array of int - the tag, and the 'a' and 'b' fields of each node"""
+		this.tags = array('B')
+		this.a = array('i')
+		this.b = array('i')
+
+		"""list - values which nodes refer to by position: names, Numerals and ArgRefs ('None' once dropped)"""
+		this.values = []
+
+		"""list - the key of each value in 'valueIndices'"""
+		this.valueKeys = []
+
+		"""list of int - how many stored nodes refer to each value"""
+		this.valueCounts = []
+
+		"""dictionary of
+			key: str, (int, str, str) or ArgRef - a name, the value and names of a Numeral, or an ArgRef
+			value: int - its position in 'values'
+		"""
+		this.valueIndices = {}
+
+		"""list of int - positions in 'values' which were dropped, to be reused"""
+		this.freeValues = []
+
+		"""dictionary of
+			key: int - a size
+			value: list of int - the start of each freed run of that size
+		"""
+		this.free = {}
+
+		"""int - how many nodes are in use"""
+		this.nodes = 0
+	#
+
+	def Value(this, key, value):
+		"""Finds the position of a value in 'values', adding it if it is not there yet, for one more node which refers to it.
+		Arguments:
+			key: hashable - identifies the value
+			value: the value
+		Returns:
+			int
+		Changes:
+			valueCounts - the value's count is increased (see ReleaseValues)
+		"""
+		i = this.valueIndices.get(key)
+		if i == None:
+			if this.freeValues:
+				i = this.freeValues.pop()
+				this.values[i] = value
+				this.valueKeys[i] = key
+			else:
+				i = len(this.values)
+				this.values.append(value)
+				this.valueKeys.append(key)
+				this.valueCounts.append(0)
+			this.valueIndices[key] = i
+		#
+		this.valueCounts[i] += 1
+		return i
+	#
+
+	def _ValueFields(this, tags, a, b):
+		"""Yields the position in 'values' of each value which some nodes refer to.
+		Arguments:
+			tags, a, b: array of int - the nodes
+		"""
+		for i, tag in enumerate(tags):
+			if tag == node_Bound:
+				yield b[i]
+			elif tag != node_Bracket and tag != node_None:
+				yield a[i]
+		#
+	#
+
+	def ReleaseValues(this, tags, a, b):
+		"""Counts the values which some nodes refer to one less time each, and drops those which are no longer referred to.
+		Arguments:
+			tags, a, b: array of int - the nodes, which are being freed
+		"""
+		counts = this.valueCounts
+		for i in this._ValueFields(tags, a, b):
+			counts[i] -= 1
+			if counts[i] == 0:
+				del this.valueIndices[this.valueKeys[i]]
+				this.values[i] = None
+				this.valueKeys[i] = None
+				this.freeValues.append(i)
+		#
+	#
+
+	def Allocate(this, tags, a, b):
+		"""Puts the nodes of an expression into a freed run of the same size, or at the end of the arrays.
+		Arguments:
+			tags, a, b: array of int - the nodes
+		Returns:
+			ArenaTerm
+		"""
+		size = len(tags)
+		runs = this.free.get(size)
+		if runs:
+			start = runs.pop()
+			if not runs:
+				del this.free[size]
+			this.tags[start:start + size] = tags
+			this.a[start:start + size] = a
+			this.b[start:start + size] = b
+		else:
+			start = len(this.tags)
+			this.tags.extend(tags)
+			this.a.extend(a)
+			this.b.extend(b)
+		#
+		this.nodes += size
+		return ArenaTerm(this, start, size)
+	#
+
+	def Free(this, start, size):
+		"""Makes a run available to later expressions (called when its ArenaTerm is deleted).
+		Arguments:
+			start: int - the position of its first node
+			size: int - how many nodes it has
+		"""
+		this.nodes -= size
+		end = start + size
+		this.ReleaseValues(this.tags[start:end], this.a[start:end], this.b[start:end])
+		if end == len(this.tags):
+			# the last run: give the space back instead
+			del this.tags[start:]
+			del this.a[start:]
+			del this.b[start:]
+		else:
+			this.free.setdefault(size, []).append(start)
+	#
+
+	def Store(this, sub):
+		"""Stores an expression in this arena, without using the Python call stack.
+		Arguments:
+			sub: Sub - the expression
+			     ArenaTerm - an expression in this or another arena (copied, see Copy)
+		Returns:
+			ArenaTerm
+		"""
+		if IsArena(sub):
+			if sub.arena is this:
+				return this.Copy(sub)
+			sub = Load(sub, counted=False)
+		#
+
+		tags = array('B')
+		a = array('i')
+		b = array('i')
+
+		"""dictionary of
+		key		: Func - a function enclosing the current node
+		value	: int - how many functions enclose that function
+		"""
+		depths = {}
+
+		"""stack of
+			Sub - a node to store
+			(Func) - a Func which is being left
+			int - the position of a Bracket whose 'right' is stored next
+		"""
+		todo = [sub]
+
+		while todo:
+			node = todo.pop()
+			T = type(node)
+
+			if T == int:
+				a[node] = len(tags) - node
+				continue
+			elif T == tuple:
+				del depths[node[0]]
+				continue
+			#
+
+			if T == Bracket:
+				todo.append(node.right)
+				todo.append(len(tags))
+				todo.append(node.left)
+				fields = (node_Bracket, 0, 0)
+			#
+			elif T == Func:
+				depths[node] = len(depths)
+				todo.append((node,))
+				todo.append(node.body)
+				fields = (node_RecursiveFunc if node.recursive else node_Func, this.Value(node.argname, node.argname), 0)
+			#
+			elif T == ArgRef:
+				if node.func == None:
+					fields = (node_Unbound, this.Value(node.argname, node.argname), 0)
+				elif node.func in depths:
+					fields = (node_Bound, len(depths) - 1 - depths[node.func], this.Value(node.argname, node.argname))
+				else:
+					fields = (node_Foreign, this.Value(node, node), 0)
+			#
+			elif T == Numeral:
+				fields = (node_Numeral, this.Value((node.value, node.fname, node.xname), node), 0)
+			else:
+				fields = (node_None, 0, 0)
+			#
+			tags.append(fields[0])
+			a.append(fields[1])
+			b.append(fields[2])
+		#
+		return this.Allocate(tags, a, b)
+	#
+
+	def Copy(this, term):
+		"""Copies an expression in this arena, one slice of each array.
+		Arguments:
+			term: ArenaTerm - an expression in this arena
+		Returns:
+			ArenaTerm - the copy
+		"""
+		end = term.start + term.size
+		tags, a, b = this.tags[term.start:end], this.a[term.start:end], this.b[term.start:end]
+		for i in this._ValueFields(tags, a, b):
+			this.valueCounts[i] += 1
+		return this.Allocate(tags, a, b)
+	#
+
+	def Bytes(this):
+		"""How much memory the arrays take up, including freed runs.
+		Returns:
+			int
+		"""
+		return sum(x.buffer_info()[1] * x.itemsize for x in (this.tags, this.a, this.b))
+	#
+#
+
+#endregion
+#region Load
+
+def Load(term, counted=True):
+	"""Creates a new Sub from an expression in an arena, without using the Python call stack.
+	Every call returns a separate copy.
+	Arguments:
+		term: ArenaTerm
+		counted: bool - whether the created nodes are counted in stats.copiedNodes (and limits are checked)
+	Returns:
+		Sub
+	"""
+	arena = term.arena
+	tags = arena.tags
+	a = arena.a
+	b = arena.b
+	values = arena.values
+
+	"""list of Func - the functions enclosing the current node, nearest last"""
+	funcs = []
+
+	"""stack of (Sub, str, int) - where each node still to be read goes: the parent node, its attribute,
+	and how many functions enclose it (the nodes are read in prefix order)
+	"""
+	holder = Bracket()
+	slots = [(holder, 'left', 0)]
+	"""list of Bracket and Func - the nodes created, whose stored flags are computed once their children are read"""
+	built = []
+
+	i = term.start
+	while slots:
+		parent, attr, depth = slots.pop()
+		del funcs[depth:]
+		tag = tags[i]
+
+		if tag == node_Bracket:
+			node = Bracket()
+			built.append(node)
+			slots.append((node, 'right', depth))
+			slots.append((node, 'left', depth))
+		#
+		elif tag == node_Func or tag == node_RecursiveFunc:
+			node = Func(argname=values[a[i]], recursive=(tag == node_RecursiveFunc))
+			built.append(node)
+			funcs.append(node)
+			slots.append((node, 'body', depth + 1))
+		#
+		elif tag == node_Bound:
+			node = ArgRef(argname=values[b[i]], func=funcs[-1 - a[i]])
+		elif tag == node_Unbound:
+			node = ArgRef(argname=values[a[i]])
+		elif tag == node_Numeral:
+			node = values[a[i]]
+		elif tag == node_Foreign:
+			ref = values[a[i]]
+			node = ArgRef(argname=ref.argname, func=ref.func)
+		else:
+			node = None
+		#
+		setattr(parent, attr, node)
+		i += 1
+	#
+	# in prefix order every node comes after its parent, so the children are updated first
+	for node in reversed(built):
+		node.Update()
+
+	if counted:
+		stats.copiedNodes += term.size
+		if stats.copiedNodes > limits.nodeCheckpoint:
+			limits.Check()
+	#
+	return holder.left
+#
+
+#endregion
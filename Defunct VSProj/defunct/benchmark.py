@@ -0,0 +1,348 @@
+"""
+Defunct Benchmark
+Runs Defunct programs several times, and measures the time, work (see stats.py) and memory
+taken by each file and by each statement in it.
+
+Usage:
+	benchmark.py [<filepath> ...] [options]
+
+		-repeat <number>		How many times each file is run (default 5).
+		-engine <name>			Selects the reduction engine (see engines.names).
+		-packDefinitions		Stores definition bodies as packed expressions.
+		-output <filepath>		Writes the results to a JSON file.
+		-baseline <filepath>	Compares the results with a JSON file written by '-output'.
+		-threshold <fraction>	How much slower than the baseline counts as a regression (default 0.1).
+"""
+#region Imports
+
+import sys
+import io
+import json
+import time
+import statistics
+import tracemalloc
+
+from structs import *
+from interpreter import *
+import engines
+import stats
+
+#endregion
+#region Command-Line Arguments
+
+"""list of str - the files which are run when none are given (relative to the working directory)"""
+default_filepaths = (
+	['examples/example01.txt', 'examples/example02.txt']
+	+ ['examples/_internal/testing{0:02}.txt'.format(i) for i in range(1, 11)]
+	)
+
+clargname_repeat = '-repeat'
+clargname_engine = '-engine'
+clargname_packDefinitions = '-packDefinitions'
+clargname_output = '-output'
+clargname_baseline = '-baseline'
+clargname_threshold = '-threshold'
+
+"""list of str - the files to run"""
+clarg_filepaths = []
+
+"""int - how many times each file is run"""
+clarg_repeat = 5
+
+"""str - the name of the reduction engine"""
+clarg_engine = engines.current
+
+"""bool - whether definition bodies are packed"""
+clarg_packDefinitions = False
+
+"""str - the file to write the results to ('None' to not write them)"""
+clarg_output = None
+
+"""str - the file with the results to compare with ('None' to not compare)"""
+clarg_baseline = None
+
+"""float - how much slower than the baseline counts as a regression (0.1 is 10% slower)"""
+clarg_threshold = 0.1
+
+def HandleCLArguments():
+	"""Reads the command-line arguments.
+	Exceptions:
+		DefunctError - an argument was not valid
+	"""
+	global clarg_filepaths
+	global clarg_repeat
+	global clarg_engine
+	global clarg_packDefinitions
+	global clarg_output
+	global clarg_baseline
+	global clarg_threshold
+
+	args = sys.argv[1:]
+	i = 0
+	def value(name, convert=str):
+		nonlocal i
+		i += 1
+		try:
+			return convert(args[i])
+		except (IndexError, ValueError):
+			raise DefunctError("Expected a value after '{0}'.".format(name))
+	#
+
+	while i < len(args):
+		arg = args[i]
+		if arg == clargname_repeat:				clarg_repeat = value(arg, int)
+		elif arg == clargname_engine:			clarg_engine = value(arg)
+		elif arg == clargname_packDefinitions:	clarg_packDefinitions = True
+		elif arg == clargname_output:			clarg_output = value(arg)
+		elif arg == clargname_baseline:			clarg_baseline = value(arg)
+		elif arg == clargname_threshold:		clarg_threshold = value(arg, float)
+		elif arg.startswith('-'):
+			raise DefunctError("Unknown option '{0}'.".format(arg))
+		else:
+			clarg_filepaths.append(arg)
+		i += 1
+	#
+
+	if clarg_repeat < 1:
+		raise DefunctError("Number of repeats must be at least 1, got '{0}'.".format(clarg_repeat))
+	engines.Validate(clarg_engine)
+
+	if not clarg_filepaths:
+		clarg_filepaths = default_filepaths
+#
+
+#endregion
+#region Measuring
+
+def RunOnce(text, measureMemory=False):
+	"""Runs a program once, in a new Interpreter, and measures each statement.
+	Arguments:
+		text: str - the source code
+		measureMemory: bool - if true, measures memory with tracemalloc (which makes the program slower)
+	Returns:
+		(float, list of dictionary) - the time taken by the whole program in seconds, and a record for each statement:
+			'statement'	: str - its description (see interpreter.DescribeStatement)
+			'time'		: float - seconds
+			the value of each counter in stats.names
+			'peakMemory': int - bytes (only if measureMemory)
+	Exceptions:
+		DefunctError - the program stopped with an error
+	"""
+	interpreter = Interpreter(engine=clarg_engine, packDefinitions=clarg_packDefinitions, output=io.StringIO())
+	records = []
+
+	start = time.perf_counter()
+	parser = Parser(text)
+	with interpreter.activated():
+		for key, name, sub in parser.DoEntry():
+			record = { 'statement': DescribeStatement(key, name, sub) if measureMemory else None }
+			stats.Reset()
+			if measureMemory:
+				tracemalloc.reset_peak()
+				before = tracemalloc.get_traced_memory()[0]
+			#
+
+			t = time.perf_counter()
+			if key == keyword_Execute:
+				interpreter.DoExecute(sub)
+			else:
+				interpreter.DoDef(name, sub, simplify=(key == keyword_Define))
+			record['time'] = time.perf_counter() - t
+
+			record.update(stats.Snapshot())
+			if measureMemory:
+				record['peakMemory'] = tracemalloc.get_traced_memory()[1] - before
+			records.append(record)
+		#
+	#
+	return (time.perf_counter() - start, records)
+#
+
+def Timing(times):
+	"""Summarises several measurements of the same thing.
+	Arguments:
+		times: list of float - seconds
+	Returns:
+		dictionary of 'min' and 'median' (seconds)
+	"""
+	return { 'min': min(times), 'median': statistics.median(times) }
+#
+
+def BenchmarkFile(filepath):
+	"""Runs a file 'clarg_repeat' times, then once more to measure memory.
+	Arguments:
+		filepath: str
+	Returns:
+		dictionary - the results of the file (see 'Results' in main)
+	Exceptions:
+		DefunctError - the file was not found, or the program stopped with an error
+	"""
+	try:
+		with open(filepath, 'r') as file:
+			text = file.read()
+		#
+	except FileNotFoundError as e:
+		raise DefunctError('File not found at "{0}"'.format(filepath)) from e
+	#
+
+	runs = [RunOnce(text) for i in range(clarg_repeat)]
+
+	tracemalloc.start()
+	try:
+		memoryTime, records = RunOnce(text, measureMemory=True)
+		peakMemory = tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+	#
+
+	for i, record in enumerate(records):
+		record['time'] = Timing([run[1][i]['time'] for run in runs])
+	#
+
+	result = { 'time': Timing([run[0] for run in runs]) }
+	result.update(stats.Combine(records))
+	result['peakMemory'] = peakMemory
+	result['statements'] = records
+	return result
+#
+
+#endregion
+#region Comparing
+
+"""float - statements faster than this (in seconds) are not compared by time, because the measurement is too noisy"""
+minimumComparedTime = 0.001
+
+def Change(old, new):
+	"""Formats a change in a measurement.
+	Returns:
+		str - e.g. '120 -> 90 (-25.0%)'
+	"""
+	if isinstance(new, float):
+		text = '{0:.4f}s -> {1:.4f}s'.format(old, new)
+	else:
+		text = '{0} -> {1}'.format(old, new)
+	if old:
+		text += ' ({0:+.1%})'.format((new - old) / old)
+	return text
+#
+
+def CompareResults(old, new, threshold):
+	"""Prints how each file and statement changed since the baseline.
+	Arguments:
+		old: dictionary - the results of the baseline (see 'Results' in main)
+		new: dictionary - the current results
+		threshold: float - how much slower counts as a regression
+	Returns:
+		int - the number of regressions (slower by more than 'threshold', or more work done)
+	"""
+	regressions = 0
+
+	def Compare(label, a, b):
+		"""Prints the changes between two records. Returns the number of regressions."""
+		changes = []
+		found = 0
+		ta, tb = a['time']['min'], b['time']['min']
+		if max(ta, tb) >= minimumComparedTime and abs(tb - ta) > threshold * ta:
+			changes.append('time ' + Change(ta, tb))
+			found += tb > ta
+		#
+		for name in stats.names + ('peakMemory',):
+			if name in a and name in b and a[name] != b[name]:
+				changes.append(name + ' ' + Change(a[name], b[name]))
+				found += name != 'peakMemory' and b[name] > a[name]
+		#
+		if changes:
+			print('{0}{1}\n\t{2}'.format('REGRESSION  ' if found else '', label, '\n\t'.join(changes)))
+		return found
+	#
+
+	for filepath, b in new['files'].items():
+		a = old['files'].get(filepath)
+		if a == None or 'error' in a or 'error' in b:
+			continue
+		regressions += Compare(filepath, a, b)
+
+		if len(a['statements']) == len(b['statements']):
+			for i, (sa, sb) in enumerate(zip(a['statements'], b['statements'])):
+				regressions += Compare('{0} #{1} {2}'.format(filepath, i + 1, sb['statement']), sa, sb)
+		#
+	#
+	print('{0} regression(s) compared with the baseline.'.format(regressions))
+	return regressions
+#
+
+#endregion
+#region MAIN
+
+def main():
+	"""The main entry point for the benchmark.
+	Returns:
+		int - exit status (0 no regressions, 1 regressions found, 2 invalid arguments)
+
+	Results (written by '-output'):
+		'engine', 'packDefinitions', 'repeat', 'python'
+		'files': dictionary of
+			key: str - the file path
+			value: dictionary of
+				'time': {'min', 'median'} - seconds taken by the whole file
+				each counter in stats.names (see stats.Combine)
+				'peakMemory': int - bytes
+				'statements': list of dictionary - each statement in order, with the same measurements
+				'error': str - (only if the program stopped with an error, instead of the measurements)
+	"""
+	try:
+		HandleCLArguments()
+	except DefunctError as e:
+		print('Error: {0}'.format(e))
+		return 2
+	#
+
+	results = {
+		'engine': clarg_engine,
+		'packDefinitions': clarg_packDefinitions,
+		'repeat': clarg_repeat,
+		'python': sys.version.split()[0],
+		'files': {},
+		}
+
+	print('{0:<40} {1:>10} {2:>10} {3:>14} {4:>14} {5:>12}'.format(
+		'file', 'min (s)', 'median (s)', 'beta', 'copied nodes', 'peak (KiB)'))
+	for filepath in clarg_filepaths:
+		try:
+			result = BenchmarkFile(filepath)
+		except DefunctError as e:
+			results['files'][filepath] = { 'error': str(e) }
+			print('{0:<40} error: {1}'.format(filepath, e))
+			continue
+		#
+		results['files'][filepath] = result
+		print('{0:<40} {1:>10.4f} {2:>10.4f} {3:>14} {4:>14} {5:>12.1f}'.format(
+			filepath,
+			result['time']['min'],
+			result['time']['median'],
+			result['betaReductions'],
+			result['copiedNodes'],
+			result['peakMemory'] / 1024))
+	#
+
+	if clarg_output != None:
+		with open(clarg_output, 'w') as file:
+			json.dump(results, file, indent='\t')
+		#
+	#
+
+	if clarg_baseline != None:
+		with open(clarg_baseline, 'r') as file:
+			baseline = json.load(file)
+		#
+		print()
+		if CompareResults(baseline, results, clarg_threshold) > 0:
+			return 1
+	#
+	return 0
+#
+
+if __name__ == '__main__':
+	sys.exit(main())
+
+#endregion
@@ -3,7 +3,13 @@
 from enum import Enum, Flag
 
 from structs import *
-from globalvars import *
+import globalvars
+from packedSubs import *
+import arena
+from arena import IsArena
+from numerals import Expand
+import stats
+import limits
 
 #endregion
 #region Comparing Expressions
@@ -11,14 +17,23 @@ from globalvars import *
 def Identical(subA, subB):
 	"""Compares two expressions to see if they are identical in value.
 	Arguments:
-		subA: Sub
-		subB: Sub
+		subA: Sub or PackedSub
+		subB: Sub or PackedSub
 	Returns:
 		bool - true if subA is identical in value to subB
 	"""
+	if IsPacked(subA) or IsPacked(subB):
+		subA = Pack(subA)
+		subB = Pack(subB)
+		# compare cached hashes first
+		if (type(subA) in (PackedFunc, PackedBracket) and type(subB) in (PackedFunc, PackedBracket)
+		  and StructuralHash(subA) != StructuralHash(subB)):
+			return False
+		return IdenticalPacked(subA, subB)
+
 	#region private
 
-	"""set of frozenset(Func, Func) - unique pairs of Funcs"""
+	"""set of (Func, Func) - unique pairs of Funcs"""
 	identicalFuncs = set()
 
 	def Identical1(subA, subB):
@@ -34,6 +49,11 @@ def Identical(subA, subB):
 		T = type(subA)
 
 		if T != type(subB):
+			# a Numeral is identical to the function it represents
+			if T == Numeral:
+				return Identical1(Expand(subA), subB)
+			elif type(subB) == Numeral:
+				return Identical1(subA, Expand(subB))
 			return False
 		#
 
@@ -43,16 +63,16 @@ def Identical(subA, subB):
 		#
 		elif T == ArgRef:
 			# if Func pair exists, they are identical
-			for pair in identicalFuncs:
-				if (pair == (subA.func, subB.func)) or (pair == (subB.func, subA.func)):
-					return True
-			#
-			return False
+			return ((subA.func, subB.func) in identicalFuncs
+			  or (subB.func, subA.func) in identicalFuncs)
 		#
 		elif T == Bracket:
 			return (Identical1(subA.left, subB.left)
 			  and Identical1(subA.right, subB.right))
 		#
+		elif T == Numeral:
+			return subA.value == subB.value
+		#
 
 		elif subA == None and subB == None:
 			return True
@@ -70,18 +90,266 @@ def Identical(subA, subB):
 	#endregion
 #
 
+#region Structural Hashing
+
+"""Hash of every reference which is not to an argument of an enclosing function.
+Such references are never identical to anything (see Identical), so they do not need to be told apart.
+"""
+_unboundHash = hash((tag_ArgRef, None))
+
+"""NOTE:
+The hash of a Bracket or Func is an affine function of its children's hashes, modulo a prime,
+so that the hash of the chain of Brackets inside a Numeral has a closed form (see NumeralHash).
+"""
+_hashPrime = (1 << 61) - 1
+_leftFactor = 0x0f3a8c2d51e7b69
+_rightFactor = 0x1b95e4c70d2a3f1
+_bracketTerm = 0x06d1f7a3e58c2b4
+_bodyFactor = 0x13c6e9b0f47a25d
+_funcTerm = 0x0a2e5d8c7b1f369
+
+def _BracketHash(left, right):
+	"""Combines the hashes of a Bracket's 'left' and 'right'."""
+	return (left * _leftFactor + right * _rightFactor + _bracketTerm) % _hashPrime
+#
+
+def _FuncHash(body):
+	"""Combines the hash of a Func's body."""
+	return (body * _bodyFactor + _funcTerm) % _hashPrime
+#
+
+def StructuralHash(sub):
+	"""Computes a hash of an expression which does not depend on argument names.
+	Expressions which are Identical always have the same hash.
+	Hashes of PackedSubs are cached on the packed nodes.
+	Arguments:
+		sub: Sub, PackedSub or arena.ArenaTerm
+	Returns:
+		int
+	"""
+	if IsArena(sub):
+		return ArenaHash(sub)
+
+	"""dictionary of
+	key		: Func - a function enclosing the current node
+	value	: int - how many functions enclose that function
+	"""
+	depths = {}
+	todo = [(sub, False)]
+	done = []
+
+	while todo:
+		node, visited = todo.pop()
+		T = type(node)
+
+		if T == Func or T == PackedFunc:
+			if T == PackedFunc and node.hash != None:
+				done.append(node.hash)
+			elif not visited:
+				if T == Func:
+					depths[node] = len(depths)
+				todo.append((node, True))
+				todo.append((node.body, False))
+			else:
+				h = _FuncHash(done.pop())
+				if T == Func:
+					del depths[node]
+				else:
+					node.hash = h
+				done.append(h)
+		#
+		elif T == Bracket or T == PackedBracket:
+			if T == PackedBracket and node.hash != None:
+				done.append(node.hash)
+			elif not visited:
+				todo.append((node, True))
+				todo.append((node.right, False))
+				todo.append((node.left, False))
+			else:
+				right = done.pop()
+				h = _BracketHash(done.pop(), right)
+				if T == PackedBracket:
+					node.hash = h
+				done.append(h)
+		#
+		elif T == ArgRef and node.func in depths:
+			done.append(hash((tag_ArgRef, len(depths) - 1 - depths[node.func])))
+		elif T == PackedArgRef and node.index != None:
+			done.append(hash((tag_ArgRef, node.index)))
+		elif T == Numeral:
+			done.append(NumeralHash(node.value))
+		else:
+			done.append(_unboundHash)
+	#
+	return done.pop()
+#
+
+def ArenaHash(term):
+	"""Computes the StructuralHash of an expression in a term arena, without loading it.
+	Arguments:
+		term: arena.ArenaTerm
+	Returns:
+		int
+	"""
+	tags = term.arena.tags
+	a = term.arena.a
+	values = term.arena.values
+	done = []
+
+	# in reverse prefix order, the hashes of a node's children are on top of 'done' ('left' last)
+	for i in range(term.start + term.size - 1, term.start - 1, -1):
+		tag = tags[i]
+		if tag == arena.node_Bracket:
+			left = done.pop()
+			done.append(_BracketHash(left, done.pop()))
+		elif tag == arena.node_Func or tag == arena.node_RecursiveFunc:
+			done.append(_FuncHash(done.pop()))
+		elif tag == arena.node_Bound:
+			done.append(hash((tag_ArgRef, a[i])))
+		elif tag == arena.node_Numeral:
+			done.append(NumeralHash(values[a[i]].value))
+		else:
+			done.append(_unboundHash)
+	#
+	return done.pop()
+#
+
+"""int - the inverse of (_rightFactor - 1) modulo _hashPrime"""
+_chainInverse = pow(_rightFactor - 1, _hashPrime - 2, _hashPrime)
+
+def NumeralHash(value):
+	"""Computes the StructuralHash of a Numeral without expanding it, in O(log value) steps.
+	Its body (f(f(...f(x)))) hashes to R**n * x + k * (R**n - 1) / (R - 1), where R is _rightFactor
+	and k is what _BracketHash adds for 'f' on the left.
+	Arguments:
+		value: int - the value of the Numeral
+	Returns:
+		int
+	"""
+	f = hash((tag_ArgRef, 1))
+	x = hash((tag_ArgRef, 0))
+	k = (f * _leftFactor + _bracketTerm) % _hashPrime
+	r = pow(_rightFactor, value, _hashPrime)
+	h = (r * x + k * (r - 1) * _chainInverse) % _hashPrime
+	return _FuncHash(_FuncHash(h))
+#
+
+def FreeNames(sub):
+	"""Finds the names of all references in an expression which are not linked to a function argument.
+	Arguments:
+		sub: Sub, PackedSub or arena.ArenaTerm
+	Returns:
+		frozenset of str
+	"""
+	if IsArena(sub):
+		tags = sub.arena.tags
+		a = sub.arena.a
+		values = sub.arena.values
+		return frozenset(values[a[i]] for i in range(sub.start, sub.start + sub.size) if tags[i] == arena.node_Unbound)
+	#
+
+	names = set()
+	todo = [sub]
+	while todo:
+		node = todo.pop()
+		T = type(node)
+
+		if T == Func or T == PackedFunc:
+			todo.append(node.body)
+		elif T == Bracket or T == PackedBracket:
+			todo.append(node.right)
+			todo.append(node.left)
+		elif (T == ArgRef and node.func == None) or (T == PackedArgRef and node.index == None):
+			names.add(node.argname)
+	#
+	return frozenset(names)
+#
+
+def CountNodes(sub):
+	"""Counts the nodes of an expression, without using the Python call stack. A Numeral is one node.
+	Arguments:
+		sub: Sub, PackedSub or arena.ArenaTerm
+	Returns:
+		int
+	"""
+	if IsArena(sub):
+		return sub.size
+
+	count = 0
+	todo = [sub]
+	while todo:
+		node = todo.pop()
+		count += 1
+		T = type(node)
+
+		if T == Func or T == PackedFunc:
+			todo.append(node.body)
+		elif T == Bracket or T == PackedBracket:
+			todo.append(node.right)
+			todo.append(node.left)
+	#
+	return count
+#
+
+#endregion
 #region global Definitions
 
+def IndexDefinition(dfn):
+	"""Adds a definition to the alias index, replacing any previous definition with the same name.
+	Must be called whenever a definition's body is set.
+	Arguments:
+		dfn: Def - the definition, which is already in 'definitions'
+	Changes:
+		dfn.hash, dfn.references, definitionsByHash, indexedDefinitions
+	"""
+	dfn.references = FreeNames(dfn.body)
+
+	if dfn.name in globalvars.indexedDefinitions:
+		order, oldHash = globalvars.indexedDefinitions[dfn.name]
+		globalvars.definitionsByHash[oldHash].remove(dfn.name)
+	else:
+		order = len(globalvars.indexedDefinitions)
+	#
+
+	dfn.hash = StructuralHash(dfn.body)
+	globalvars.indexedDefinitions[dfn.name] = (order, dfn.hash)
+
+	# keep each bucket in the same order as 'definitions'
+	bucket = globalvars.definitionsByHash.setdefault(dfn.hash, [])
+	i = len(bucket)
+	while i > 0 and globalvars.indexedDefinitions[bucket[i - 1]][0] > order:
+		i -= 1
+	bucket.insert(i, dfn.name)
+#
+
 def FindIdenticalDefs(sub):
 	"""Finds definitions whose bodies are identical in value to this expression.
+	Only the definitions with the same StructuralHash are compared.
 	Arguments:
 		sub: Sub - the expression to compare with
 	Returns:
 		list(Def) - all definitions which are identical to this expression
 	"""
+	h = StructuralHash(sub)
+	if h == _unboundHash:
+		return []
+
+	packed = None
 	defs = []
-	for dfn in definitions.values():
-		if Identical(sub, dfn.body):
+	for name in globalvars.definitionsByHash.get(h, ()):
+		dfn = globalvars.definitions[name]
+		stats.identicalComparisons += 1
+		if IsArena(dfn.body):
+			if Identical(sub, arena.Load(dfn.body, counted=False)):
+				defs.append(dfn)
+		#
+		elif IsPacked(dfn.body):
+			if packed == None:
+				packed = Pack(sub)
+			if IdenticalPacked(packed, dfn.body):
+				defs.append(dfn)
+		#
+		elif Identical(sub, dfn.body):
 			defs.append(dfn)
 	#
 	return defs
@@ -95,12 +363,20 @@ def FindIdenticalDefs(sub):
 def CopySub(originalSub):
 	"""Creates a deep copy of a Sub (used during substitution of references).
 	Arguments:
-		originalSub : Sub ref
+		originalSub : Sub ref, PackedSub or arena.ArenaTerm
 	Returns:
 		Sub - a deep copy of originalSub
 	"""
+	if IsPacked(originalSub):
+		return Unpack(originalSub)
+	if IsArena(originalSub):
+		return arena.Load(originalSub)
+
 	#region private
 
+	"""int - how many nodes have been copied (added to stats.copiedNodes at the end)"""
+	count = 0
+
 	"""dictionary of
 	key		: Func ref - the original Func
 	value	: Func ref - the new/copied Func
@@ -115,7 +391,9 @@ def CopySub(originalSub):
 			Sub - a deep copy of originalSub
 		"""
 		nonlocal newFuncs
+		nonlocal count
 
+		count += 1
 		if type(originalSub) == Func:
 			new = Func(
 				argname=originalSub.argname,
@@ -123,6 +401,7 @@ def CopySub(originalSub):
 				)
 			newFuncs[originalSub] = new
 			new.body = CopySub1(originalSub.body)
+			new.Update()
 			del newFuncs[originalSub]
 			return new
 		#
@@ -147,10 +426,35 @@ def CopySub(originalSub):
 	newFuncs.clear()
 	sub = CopySub1(originalSub)
 	newFuncs.clear()
+	stats.copiedNodes += count
+	if stats.copiedNodes > limits.nodeCheckpoint:
+		limits.Check()
 	return sub
 	#endregion
 #
 
+def ExpandNumerals(originalSub):
+	"""Creates a copy of an expression where every Numeral is replaced by the function it represents.
+	Arguments:
+		originalSub : Sub
+	Returns:
+		Sub
+	"""
+	def ExpandNumerals1(sub):
+		if type(sub) == Numeral:
+			return Expand(sub)
+		elif type(sub) == Func:
+			sub.body = ExpandNumerals1(sub.body)
+			sub.Update()
+		elif type(sub) == Bracket:
+			sub.left = ExpandNumerals1(sub.left)
+			sub.right = ExpandNumerals1(sub.right)
+			sub.Update()
+		return sub
+	#
+	return ExpandNumerals1(CopySub(originalSub))
+#
+
 #endregion
 #region SubToString
 
@@ -173,18 +477,37 @@ class ArgnameDisplayMode(Flag):
 argnameDisplayMode = ArgnameDisplayMode.ArgName | ArgnameDisplayMode.Recursiveness
 
 
-def SubToString(sub, top=None):
-	"""Return a formatted string representation of an expression.
+"""int - how many characters WriteSub collects before writing them to the file"""
+writeSize = 1 << 16
+
+def SubPieces(sub, top=None):
+	"""Formats an expression in pieces, which joined together are the string returned by SubToString.
+	Walks the expression without recursion, so the time taken is proportional to the length of the string,
+	however long or deeply nested the expression is.
 	Arguments:
 		sub: Sub  - the expression to format
+		     PackedSub or arena.ArenaTerm - formatted as a whole ('top' is ignored)
 		top: Sub  - the most global expression to be considered FuncLoc 0
 		     None - defaults to 'sub' parameter
 	Returns:
-		str
+		generator of str
 	"""
+	if IsPacked(sub):
+		sub = top = Unpack(sub)
+	elif IsArena(sub):
+		sub = top = arena.Load(sub, counted=False)
 	if top == None:
 		top = sub
 
+	showLoc = ArgnameDisplayMode.FuncLoc in argnameDisplayMode
+	showName = ArgnameDisplayMode.ArgName in argnameDisplayMode
+	showRecursive = ArgnameDisplayMode.Recursiveness in argnameDisplayMode
+
+	"""bool - whether the locality of each function is how many functions enclose it within 'sub'
+	(otherwise the localities are found from 'top' first)
+	"""
+	fromDepth = top is sub
+
 	#region private
 
 	"""dictionary of
@@ -193,143 +516,206 @@ def SubToString(sub, top=None):
 					(e.g. 0 for most global, 1 for immediate nested child, 2 for child of child...)
 	"""
 	funcLocs = {}
-	
 
-	def InitFuncLocs(sub, order=0):
-		"""Initializes function locality strings before expression formatting
+	def InitFuncLocs(top):
+		"""Initializes function locality strings before formatting part of an expression.
 		Arguments:
-			sub:   Sub - the 'top'/most global expression node
-			order: int - the locality of the current expression node
+			top: Sub - the 'top'/most global expression node
 		Changes:
 			funcLocs
 		"""
-		if not sub:
-			return
-
-		if type(sub) == Func:
-			funcLocs[sub] = str(order)
-			InitFuncLocs(sub.body, order + 1)
-
-		elif type(sub) == Bracket:
-			InitFuncLocs(sub.left, order)
-			InitFuncLocs(sub.right, order)
-	#
-
-	def GetFuncLoc(func):
-		"""Returns a string representing the locality of a function.
-		Arguments:
-			func: Func - the function to get the locality of
-				  None - just return '?'
-		Returns:
-			str - the locality string of this function (e.g. '0', '1', '2'...)
-			'?' - Func is None
-			''  - flag ArgnameDisplayMode.FuncLoc is not set in argnameDisplayMode
-		"""
-		if func == None:
-			return '?'
-		if ArgnameDisplayMode.FuncLoc not in argnameDisplayMode:
-			return ''
-		try:
-			return funcLocs[func]
-		except:
-			return '?'
+		todo = [(top, 0)]
+		while todo:
+			node, order = todo.pop()
+			if type(node) == Func:
+				funcLocs[node] = str(order)
+				todo.append((node.body, order + 1))
+			elif type(node) == Bracket:
+				todo.append((node.right, order))
+				todo.append((node.left, order))
+		#
 	#
 
 	def ArgnameToString(func, argname):
 		"""Formats an argname based on function locality and argument name.
 		Arguments:
-			func: Func - the function with the referenced argument
+			func: Func - the function with the referenced argument ('None' for a definition or primitive)
 			argname: str - the argument name (input from user code)
 		Returns:
-			str
-		"""
-		return "{0}{1}{2}".format(
-				'$'  if (func != None and func.recursive) and (ArgnameDisplayMode.Recursiveness in argnameDisplayMode)  else '',
-				GetFuncLoc(func),
-				argname  if (ArgnameDisplayMode.ArgName in argnameDisplayMode)  else ''
-			)
-	#
-
-	def FuncArgToString(func):
-		return ArgnameToString(func, func.argname)
-	#
-
-	def FuncSeriesToString(func):
-		"""Formats a series of functions into one function block string.
-		Arguments:
-			func: Func - the top function
-		Returns:
-			str
+			str - e.g. '$0f' ('?' is shown as the locality of a function which is not known)
 		"""
-		argseries = FuncArgToString(func)
-		func = func.body
-		while type(func) == Func:
-			argseries += ' ' + FuncArgToString(func)
-			func = func.body
+		if func == None:
+			loc = '?'
+		elif showLoc:
+			loc = funcLocs.get(func, '?')
+			if showRecursive and func.recursive:
+				loc = '$' + loc
 		#
-		return "[{0}. {1}]".format(
-			argseries,
-			SubToString1(func)
-		)
+		elif showRecursive and func.recursive:
+			loc = '$'
+		else:
+			loc = ''
+		return loc + argname if showName else loc
 	#
 
-	def SeriesToString(sub):
-		"""Formats a series of Brackets into one string block. Removes parentheses as long as sub.left is a Bracket.
+	def NumeralPieces(numeral, order, argseries):
+		"""Formats a Numeral like the function it represents, without expanding it.
+		The body is given in pieces of about 'writeSize' characters, so that a limit on the length
+		(see SubToString) stops formatting a large Numeral early.
 		Arguments:
-			sub: Sub
+			numeral: Numeral
+			order: int - the locality of the Numeral's outer function
+			argseries: list of str - the formatted arguments of the functions directly enclosing it (in the same block)
 		Returns:
-			str
-		e.g.
-			((x y)z) -> 'x y z'
-			(x(y z)) -> 'x(y z)'
+			generator of str - e.g. '[y x. ', 'y(y(', 'y x', '))', ']'
 		"""
-		def LeftToString(sub):
-			if type(sub) == Bracket:
-				return SeriesToString(sub)
-			else:
-				return SubToString1(sub)
+		if showName:
+			f, x = numeral.fname, numeral.xname
+		else:
+			f = x = ''
+		if showLoc and fromDepth:
+			f = str(order) + f
+			x = str(order + 1) + x
 		#
-		def RightToString(sub):
-			if type(sub) == Bracket:
-				return "({0})".format(SubToString1(sub))
-			else:
-				return " {0}".format(SubToString1(sub))
+		yield "[{0}. ".format(' '.join(argseries + [f, x]))
+		n = numeral.value
+		if n == 0:
+			yield x
+		else:
+			for piece, count in ((f + '(', n - 1), (f + ' ' + x, 1), (')', n - 1)):
+				chunk = max(1, writeSize // len(piece))
+				while count > 0:
+					yield piece * min(chunk, count)
+					count -= chunk
+			#
 		#
-		return LeftToString(sub.left) + RightToString(sub.right)
+		yield ']'
 	#
 
-	def SubToString1(sub):
-		if not sub:
-			return '<None>'
-	
-		if type(sub) == ArgRef:
-			return ArgnameToString(sub.func, sub.argname)
-		#
-		elif type(sub) == Bracket:
-			return SeriesToString(sub)
+	#endregion
+	#region body SubPieces
+	if showLoc and not fromDepth:
+		InitFuncLocs(top)
 
-		elif type(sub) == Func:
-			return FuncSeriesToString(sub)
+	"""stack of
+		str - a piece to give as it is
+		(Sub, int) - an expression to format, and the locality of a function directly inside it
+	"""
+	todo = [(sub, 0)]
 
+	while todo:
+		item = todo.pop()
+		if type(item) == str:
+			yield item
+			continue
+		#
+		node, order = item
+		T = type(node)
+
+		if T == ArgRef:
+			yield ArgnameToString(node.func, node.argname)
+		#
+		elif T == Bracket:
+			# a series of Brackets is one block: ((x y)z) -> 'x y z', (x(y z)) -> 'x(y z)'
+			while type(node) == Bracket:
+				if type(node.right) == Bracket:
+					todo.append(')')
+					todo.append((node.right, order))
+					todo.append('(')
+				else:
+					todo.append((node.right, order))
+					todo.append(' ')
+				node = node.left
+			#
+			todo.append((node, order))
+		#
+		elif T == Func:
+			# a series of functions is one block: [a. [b. x]] -> '[a b. x]'
+			argseries = []
+			while type(node) == Func:
+				if fromDepth:
+					funcLocs[node] = str(order)
+				argseries.append(ArgnameToString(node, node.argname))
+				order += 1
+				node = node.body
+			#
+			if type(node) == Numeral:
+				yield from NumeralPieces(node, order, argseries)
+			else:
+				yield "[{0}. ".format(' '.join(argseries))
+				todo.append(']')
+				todo.append((node, order))
+		#
+		elif T == Numeral:
+			yield from NumeralPieces(node, order, [])
+		#
+		elif node == None:
+			yield '<None>'
 		else:
-			return '<Non-Sub>'
+			yield '<Non-Sub>'
 	#
-
 	#endregion
-	#region body SubToString
-	funcLocs.clear()
+#
 
-	if ArgnameDisplayMode.FuncLoc in argnameDisplayMode:
-		InitFuncLocs(top)
-		retval = SubToString1(sub)
-		funcLocs.clear()
-		return retval
+def SubToString(sub, top=None, limit=None):
+	"""Return a formatted string representation of an expression.
+	Arguments:
+		sub: Sub  - the expression to format
+		     PackedSub or arena.ArenaTerm - formatted as a whole ('top' is ignored)
+		top: Sub  - the most global expression to be considered FuncLoc 0
+		     None - defaults to 'sub' parameter
+		limit: int - the most characters to return; a longer string is cut short and ends with '...'
+		       None - no limit
+	Returns:
+		str
+	"""
+	pieces = []
+	length = 0
+	for piece in SubPieces(sub, top):
+		pieces.append(piece)
+		if limit != None:
+			length += len(piece)
+			if length > limit:
+				# the rest of the expression is not formatted
+				return ''.join(pieces)[:limit - 3] + '...'
+		#
 	#
-	else:
-		return SubToString1(sub)
-	#endregion
+	return ''.join(pieces)
 #
 
-#endregion
+def WriteSub(sub, file, top=None, limit=None):
+	"""Writes the formatted string representation of an expression to a file (see SubToString),
+	a block of 'writeSize' characters at a time instead of building the whole string first.
+	Arguments:
+		sub: Sub, PackedSub or arena.ArenaTerm - the expression to format
+		file: file object - where to write to
+		top: Sub - see SubToString
+		limit: int - see SubToString
+	Returns:
+		int - how many characters were written
+	"""
+	pieces = []
+	length = 0 # characters in 'pieces'
+	written = 0
+	for piece in SubPieces(sub, top):
+		pieces.append(piece)
+		length += len(piece)
+		if limit != None and written + length > limit:
+			text = ''.join(pieces)[:limit - 3 - written] + '...'
+			file.write(text)
+			return written + len(text)
+		#
+		# keep the characters which may still be cut short by the limit
+		if length >= writeSize and (limit == None or written + length <= limit - 3):
+			file.write(''.join(pieces))
+			written += length
+			pieces.clear()
+			length = 0
+		#
+	#
+	file.write(''.join(pieces))
+	return written + length
+#
 
+#endregion
 
@@ -0,0 +1,230 @@
+#region imports
+
+import asyncio
+import concurrent.futures
+import io
+import json
+import os
+import stat
+import time
+
+from structs import *
+from compareSubs import SubToString
+import stats
+import limits
+
+#endregion
+#region Daemon
+
+"""NOTE:
+A daemon keeps one Interpreter with a prelude loaded, and answers requests from other processes through
+a Unix socket, so that they do not have to start Python and simplify the prelude themselves.
+
+Each connection is a session with its own Interpreter, forked from the prelude's (see Interpreter.fork),
+so a 'def' made in one session is never seen by another, nor by the prelude.
+
+Requests and responses are JSON objects, one per line. Every request has an 'op':
+	{"op": "evaluate", "text": <expression>}				like 'do <expression>'
+	{"op": "define", "name": <name>, "text": <expression>, "simplify": true}	like 'def' ('def_u' if simplify is false)
+	{"op": "load", "text": <statements>}					runs 'def', 'def_u' and 'do' statements
+	{"op": "reset"}										forgets the session's own definitions
+Every response has:
+	"ok"		: bool - whether the request succeeded
+	"output"	: str - what 'print' wrote while running the request
+	"stats"		: the counters of stats.Measurement, and 'time' in seconds
+	"result"	: str - the simplified expression ('evaluate' and 'define' only)
+	"error", "type", "location"	- the message, error type and (line, column) of a failed request
+Requests are run one at a time, in the order they arrive, by a single worker thread (the interpreter's state is
+global, see globalvars.py), so that the daemon keeps reading and answering connections while a request runs.
+Unless limits were given on the command line, each statement of a request may do at most 'defaultLimits' of work,
+so that one request cannot keep every other client waiting forever.
+"""
+
+"""limits.Limits - the most work each statement of a request may do, when the prelude's interpreter has no limits"""
+defaultLimits = limits.Limits(seconds=30)
+
+"""object - the default of RequestField for a field which must be given"""
+_required = object()
+
+"""dictionary of
+	key: type - a type of value in a request
+	value: str - what it is called in JSON
+"""
+_jsonTypes = { str: 'a string', bool: 'true or false', int: 'a whole number', float: 'a number',
+	list: 'an array', dict: 'an object', type(None): 'null' }
+
+def RequestField(request, name, kind, default=_required):
+	"""Gets a field of a request, checking its type.
+	Arguments:
+		request: dictionary - see the NOTE above
+		name: str - the name of the field
+		kind: type - the type its value must have (a bool is not taken for an int)
+		default: the value of a missing field (if not given, the field must be in the request)
+	Returns:
+		the value of the field
+	Exceptions:
+		DefunctError - the field is missing, or its value has another type
+	"""
+	if name not in request:
+		if default is _required:
+			raise DefunctError("Request is missing '{0}'.".format(name))
+		return default
+	#
+	value = request[name]
+	if type(value) != kind:
+		raise DefunctError("Request field '{0}' must be {1}, got {2}.".format(
+			name, _jsonTypes[kind], _jsonTypes.get(type(value), type(value).__name__)))
+	return value
+#
+
+class Daemon:
+	"""Answers requests to define and evaluate expressions against a prelude (see the NOTE above)."""
+
+	def __init__(this, prelude, socketPath):
+		"""
+		Arguments:
+			prelude: Interpreter - the interpreter which has the prelude loaded (it is not changed by requests)
+			socketPath: str - the path of the Unix socket to listen on
+		"""
+		this.prelude = prelude
+		this.socketPath = socketPath
+
+		"""int - how many requests have been answered"""
+		this.requests = 0
+
+		"""concurrent.futures.ThreadPoolExecutor - the thread which runs every request ('None' when not serving)"""
+		this.executor = None
+	#
+
+	def NewSession(this, output=None):
+		"""Creates the interpreter of a session, forked from the prelude's.
+		It has 'defaultLimits' if the prelude's interpreter has no limits.
+		Arguments:
+			output: io.StringIO - where 'print' writes to ('None' for a new one)
+		Returns:
+			Interpreter
+		"""
+		session = this.prelude.fork(output=output if output != None else io.StringIO())
+		if not session.limits:
+			session.limits = defaultLimits
+		return session
+	#
+
+	def Handle(this, session, request):
+		"""Runs one request.
+		Arguments:
+			session: Interpreter - the session's interpreter (its 'output' must be an io.StringIO)
+			request: dictionary - see the NOTE above
+		Returns:
+			(Interpreter, dictionary) - the session's interpreter (a new one after 'reset') and the response
+		"""
+		response = { 'ok': True }
+		stats.Reset()
+		start = time.perf_counter()
+		try:
+			if type(request) != dict:
+				raise DefunctError('Request must be a JSON object.')
+			op = RequestField(request, 'op', str)
+			if op == 'evaluate':
+				sub = session.evaluate(RequestField(request, 'text', str))
+				response['result'] = SubToString(sub, limit=session.printLength)
+			elif op == 'define':
+				name = RequestField(request, 'name', str)
+				text = RequestField(request, 'text', str)
+				dfn = session.define(name, text, RequestField(request, 'simplify', bool, True))
+				response['result'] = SubToString(dfn.body, limit=session.printLength)
+			elif op == 'load':
+				session.load(RequestField(request, 'text', str))
+			elif op == 'reset':
+				session = this.NewSession(session.output)
+			else:
+				raise DefunctError("Unknown request '{0}'.".format(op))
+		#
+		except DefunctError as e:
+			response.update(ok=False, error=str(e), type=type(e).__name__)
+			if type(e) == DefunctError_InputError:
+				response['location'] = e.location
+			elif type(e) == DefunctError_LimitExceeded:
+				response.update(limit=e.limit, term=e.term)
+		except Exception as e:
+			# e.g. a RecursionError while reading a deeply nested expression, or a MemoryError:
+			# the client is still answered, and the session can go on
+			response.update(ok=False, error=str(e) or type(e).__name__, type=type(e).__name__)
+		#
+		measurement = stats.Measurement()
+		measurement['time'] = time.perf_counter() - start
+		response['stats'] = measurement
+		response['output'] = session.output.getvalue()
+		session.output.seek(0)
+		session.output.truncate()
+		this.requests += 1
+		return (session, response)
+	#
+
+	async def HandleConnection(this, reader, writer):
+		"""Answers the requests of one connection, in a session of its own, until the client disconnects.
+		The requests are run by 'executor'.
+		"""
+		loop = asyncio.get_running_loop()
+		session = await loop.run_in_executor(this.executor, this.NewSession)
+		try:
+			while True:
+				line = await reader.readline()
+				if not line:
+					break
+				try:
+					request = json.loads(line)
+				except ValueError as e:
+					response = { 'ok': False, 'error': 'Request is not valid JSON: {0}'.format(e), 'type': 'DefunctError' }
+				else:
+					session, response = await loop.run_in_executor(this.executor, this.Handle, session, request)
+				#
+				writer.write(json.dumps(response).encode('utf-8') + b'\n')
+				await writer.drain()
+			#
+		except ConnectionError:
+			pass # the client went away
+		finally:
+			writer.close()
+	#
+
+	async def Serve(this):
+		"""Listens on the socket until the task is cancelled. Replaces a socket file left behind by an earlier daemon.
+		Exceptions:
+			DefunctError - Unix sockets are not available, or the path is in use by something other than a socket
+		"""
+		if not hasattr(asyncio, 'start_unix_server'):
+			raise DefunctError('Daemon mode needs Unix sockets, which are not available on this system.')
+		#
+		if os.path.exists(this.socketPath):
+			if not stat.S_ISSOCK(os.stat(this.socketPath).st_mode):
+				raise DefunctError('Cannot listen on "{0}": it is not a socket.'.format(this.socketPath))
+			os.remove(this.socketPath)
+		#
+
+		this.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+		server = await asyncio.start_unix_server(this.HandleConnection, path=this.socketPath)
+		try:
+			async with server:
+				await server.serve_forever()
+			#
+		finally:
+			if os.path.exists(this.socketPath):
+				os.remove(this.socketPath)
+			this.executor.shutdown(wait=False)
+			this.executor = None
+	#
+
+	def Run(this):
+		"""Listens on the socket until the user stops the program (Ctrl+C).
+		Exceptions:
+			DefunctError - see Serve
+		"""
+		try:
+			asyncio.run(this.Serve())
+		except KeyboardInterrupt:
+			pass
+	#
+#
+
+#endregion
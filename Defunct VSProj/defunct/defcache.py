@@ -0,0 +1,415 @@
+#region imports
+
+import os
+import hashlib
+
+from structs import *
+
+#endregion
+#region Encoding
+
+"""NOTE:
+A definition cache keeps the simplified bodies of 'def' statements in a file, so that a program which
+is run again does not have to simplify them again (see Interpreter.DoDef and the '-cache' option).
+
+Each body is stored under a key, which is a hash of the definition's unsimplified body together with
+the keys of the definitions it refers to (see DefinitionCache.Key). Changing a definition changes its key
+and the keys of every definition which depends on it, so only those are simplified again.
+
+Expressions are encoded as bytes, node by node in prefix order (see Encode):
+	node_Bracket				followed by 'left' then 'right'
+	node_Func, node_RecursiveFunc	<argname>, followed by 'body'
+	node_Bound					<de Bruijn index> (0 for the nearest enclosing function)
+	node_Unbound				<name> of a definition or primitive
+	node_Numeral				<value> <fname> <xname>
+	node_None					missing expression node
+Numbers are unsigned LEB128 varints, and names are indices into a table of strings at the start.
+"""
+
+"""Node tags (int) of encoded expressions"""
+node_Bracket = 0
+node_Func = 1
+node_RecursiveFunc = 2
+node_Bound = 3
+node_Unbound = 4
+node_Numeral = 5
+node_None = 6
+
+def WriteVarint(out, n):
+	"""Appends an unsigned number to a bytearray, 7 bits per byte."""
+	while n >= 0x80:
+		out.append((n & 0x7F) | 0x80)
+		n >>= 7
+	out.append(n)
+#
+
+def ReadVarint(data, pos):
+	"""Reads an unsigned number written by WriteVarint.
+	Returns:
+		(int, int) - the number, and the position after it
+	"""
+	n = 0
+	shift = 0
+	while True:
+		byte = data[pos]
+		pos += 1
+		n |= (byte & 0x7F) << shift
+		if byte < 0x80:
+			return (n, pos)
+		shift += 7
+	#
+#
+
+def Encode(sub):
+	"""Encodes an expression as bytes, without using the Python call stack.
+	Arguments:
+		sub: Sub - the expression (must not refer to a Func outside of itself)
+	Returns:
+		(bytes, set of str) - the encoded expression, and the names of the definitions and primitives it refers to
+		None - the expression cannot be encoded
+	"""
+	strings = {}
+	def String(s):
+		if s not in strings:
+			strings[s] = len(strings)
+		return strings[s]
+	#
+
+	nodes = bytearray()
+	names = set()
+
+	"""dictionary of
+	key		: Func - a function enclosing the current node
+	value	: int - how many functions enclose that function
+	"""
+	depths = {}
+
+	"""stack of (Sub, bool) - nodes to encode, and whether the node is a Func which is being left"""
+	todo = [(sub, False)]
+
+	while todo:
+		node, leaving = todo.pop()
+		if leaving:
+			del depths[node]
+			continue
+		#
+		T = type(node)
+
+		if T == Bracket:
+			nodes.append(node_Bracket)
+			todo.append((node.right, False))
+			todo.append((node.left, False))
+		#
+		elif T == Func:
+			nodes.append(node_RecursiveFunc if node.recursive else node_Func)
+			WriteVarint(nodes, String(node.argname))
+			depths[node] = len(depths)
+			todo.append((node, True))
+			todo.append((node.body, False))
+		#
+		elif T == ArgRef:
+			if node.func == None:
+				nodes.append(node_Unbound)
+				WriteVarint(nodes, String(node.argname))
+				names.add(node.argname)
+			elif node.func in depths:
+				nodes.append(node_Bound)
+				WriteVarint(nodes, len(depths) - 1 - depths[node.func])
+			else:
+				return None
+		#
+		elif T == Numeral:
+			nodes.append(node_Numeral)
+			WriteVarint(nodes, node.value)
+			WriteVarint(nodes, String(node.fname))
+			WriteVarint(nodes, String(node.xname))
+		#
+		elif node == None:
+			nodes.append(node_None)
+		#
+		else:
+			return None
+	#
+
+	out = bytearray()
+	WriteVarint(out, len(strings))
+	for s in strings:
+		b = s.encode('utf-8')
+		WriteVarint(out, len(b))
+		out += b
+	#
+	return (bytes(out + nodes), names)
+#
+
+def Decode(data):
+	"""Creates an expression from bytes written by Encode, without using the Python call stack.
+	Arguments:
+		data: bytes
+	Returns:
+		Sub - a new expression
+	Exceptions:
+		IndexError, ValueError, UnicodeDecodeError - the data is not a valid encoded expression
+	"""
+	count, pos = ReadVarint(data, 0)
+	strings = []
+	for i in range(count):
+		length, pos = ReadVarint(data, pos)
+		strings.append(data[pos:pos + length].decode('utf-8'))
+		pos += length
+	#
+
+	"""list of Func - the functions enclosing the current node, nearest last"""
+	funcs = []
+
+	"""stack of (Sub, str, int) - where each node still to be read goes: the parent node, its attribute,
+	and how many functions enclose it
+	"""
+	holder = Bracket()
+	slots = [(holder, 'left', 0)]
+	"""list of Bracket and Func - the nodes created, whose stored flags are computed once their children are read"""
+	built = []
+
+	while slots:
+		parent, attr, depth = slots.pop()
+		del funcs[depth:]
+		tag = data[pos]
+		pos += 1
+
+		if tag == node_Bracket:
+			node = Bracket()
+			built.append(node)
+			slots.append((node, 'right', depth))
+			slots.append((node, 'left', depth))
+		#
+		elif tag == node_Func or tag == node_RecursiveFunc:
+			i, pos = ReadVarint(data, pos)
+			node = Func(argname=strings[i], recursive=(tag == node_RecursiveFunc))
+			built.append(node)
+			funcs.append(node)
+			slots.append((node, 'body', depth + 1))
+		#
+		elif tag == node_Bound:
+			i, pos = ReadVarint(data, pos)
+			func = funcs[-1 - i]
+			node = ArgRef(argname=func.argname, func=func)
+		#
+		elif tag == node_Unbound:
+			i, pos = ReadVarint(data, pos)
+			node = ArgRef(argname=strings[i])
+		#
+		elif tag == node_Numeral:
+			value, pos = ReadVarint(data, pos)
+			fname, pos = ReadVarint(data, pos)
+			xname, pos = ReadVarint(data, pos)
+			node = Numeral(value, strings[fname], strings[xname])
+		#
+		elif tag == node_None:
+			node = None
+		#
+		else:
+			raise ValueError('unknown node tag {0}'.format(tag))
+		setattr(parent, attr, node)
+	#
+	# in prefix order every node comes after its parent, so the children are updated first
+	for node in reversed(built):
+		node.Update()
+	return holder.left
+#
+
+#endregion
+#region Definition Cache
+
+"""str - added to the path of a source file to get the path of its cache file"""
+extension = '.defcache'
+
+"""bytes - the start of every cache file. Must be changed whenever the format or the simplified results change."""
+magic = b'DFC\x01'
+
+"""int - the size of each key in bytes"""
+keySize = 16
+
+class DefinitionCache:
+	"""Simplified definition bodies which are kept in a file between runs (see the NOTE under 'Encoding')."""
+
+	def __init__(this, filepath):
+		"""
+		Arguments:
+			filepath: str - the cache file (see Load and Save) ('None' if the cache is only kept in memory)
+		"""
+		"""str - the cache file"""
+		this.filepath = filepath
+
+		"""dictionary of
+			key: bytes - the key of a definition
+			value: bytes - its encoded simplified body
+		"""
+		this.entries = {}
+
+		"""set of bytes - the keys of the entries which were used or added since the cache was loaded"""
+		this.used = set()
+
+		"""bool - whether an entry was added since the cache was loaded"""
+		this.changed = False
+
+		"""dictionary of
+			key: str - name of a definition
+			value: bytes - the key of its current definition ('None' if it could not be encoded)
+		"""
+		this.keys = {}
+
+		"""int - how many simplified bodies were found in the cache, and how many were not"""
+		this.hits = 0
+		this.misses = 0
+	#
+
+	def Load(this):
+		"""Reads the entries in the cache file. A missing or unreadable file is treated as empty.
+		Changes:
+			entries
+		"""
+		try:
+			with open(this.filepath, 'rb') as file:
+				data = file.read()
+			#
+		except OSError:
+			return
+		#
+		if not data.startswith(magic):
+			return
+
+		pos = len(magic)
+		try:
+			while pos < len(data):
+				key = data[pos:pos + keySize]
+				length, pos = ReadVarint(data, pos + keySize)
+				if pos + length > len(data):
+					break
+				this.entries[key] = data[pos:pos + length]
+				pos += length
+			#
+		except IndexError:
+			pass # a truncated file: keep the complete entries
+	#
+
+	def Save(this):
+		"""Writes the entries which were used or added since the cache was loaded, if anything changed.
+		Exceptions:
+			OSError - the file could not be written
+		"""
+		if not this.changed and this.used == this.entries.keys():
+			return
+
+		out = bytearray(magic)
+		for key in this.used:
+			out += key
+			WriteVarint(out, len(this.entries[key]))
+			out += this.entries[key]
+		#
+		temppath = this.filepath + '.tmp'
+		with open(temppath, 'wb') as file:
+			file.write(out)
+		#
+		os.replace(temppath, this.filepath)
+
+		this.entries = { key: this.entries[key] for key in this.used }
+		this.changed = False
+	#
+
+	def Reset(this):
+		"""Prepares the cache for the program to be run again (see watch.Watcher). Forgets the keys of the
+		definitions and the counts, and drops the entries which were not used since the cache was loaded
+		or last reset. Must be called after Save, if the cache is kept in a file.
+		Changes:
+			entries, used, keys, hits, misses
+		"""
+		this.entries = { key: this.entries[key] for key in this.used }
+		this.used = set()
+		this.keys = {}
+		this.hits = 0
+		this.misses = 0
+	#
+
+	def Key(this, body, simplify, engine, rewrite=False):
+		"""Computes the key of a definition from its unsimplified body and the definitions it refers to.
+		Arguments:
+			body: Sub - the unsimplified body
+			simplify: bool - whether the body will be simplified ('def', not 'def_u')
+			engine: str - the name of the reduction engine
+			rewrite: bool - whether the rewrite pass is applied before the engine (see rewrite.py)
+		Returns:
+			bytes
+			None - the body cannot be cached
+		"""
+		encoded = Encode(body)
+		if encoded == None:
+			return None
+		data, names = encoded
+
+		h = hashlib.blake2b(magic, digest_size=keySize)
+		h.update(b'def' if simplify else b'def_u')
+		h.update(engine.encode('utf-8') + b'\0')
+		if rewrite:
+			h.update(b'rewrite\0')
+		h.update(data)
+		for name in sorted(names):
+			key = this.keys.get(name, b'')
+			if key == None:
+				return None
+			h.update(name.encode('utf-8') + b'\0' + key)
+		#
+		return h.digest()
+	#
+
+	def Get(this, key):
+		"""Finds the simplified body of a definition.
+		Arguments:
+			key: bytes - see Key
+		Returns:
+			Sub - a new copy of the simplified body
+			None - the body is not in the cache
+		Changes:
+			used, hits, misses
+		"""
+		data = this.entries.get(key)
+		if data != None:
+			try:
+				body = Decode(data)
+				this.used.add(key)
+				this.hits += 1
+				return body
+			except (IndexError, ValueError, UnicodeDecodeError):
+				del this.entries[key]
+		#
+		this.misses += 1
+		return None
+	#
+
+	def Put(this, key, body):
+		"""Adds the simplified body of a definition.
+		Arguments:
+			key: bytes - see Key
+			body: Sub - the simplified body
+		Changes:
+			entries, used, changed
+		"""
+		encoded = Encode(body)
+		if encoded == None:
+			return
+		this.entries[key] = encoded[0]
+		this.used.add(key)
+		this.changed = True
+	#
+
+	def Bind(this, name, key):
+		"""Records the key of a definition, which the keys of later definitions referring to it depend on.
+		Arguments:
+			name: str - the name of the definition
+			key: bytes - see Key ('None' if the definition cannot be cached)
+		Changes:
+			keys
+		"""
+		this.keys[name] = key
+	#
+#
+
+#endregion
@@ -0,0 +1,85 @@
+#region imports
+
+from structs import DefunctError
+import reduction
+import machine
+import nbe
+import inet
+import rewrite
+
+#endregion
+#region Reduction Engines
+
+"""List of all valid reduction engine names and their associated functions.
+	function(sub: Sub, execute: bool) -> Sub
+"""
+names = {
+	# Recursive tree rewriting with substitution (reduction.Simplify).
+	'recursive': lambda sub, execute: reduction.Simplify(sub, execute),
+
+	# Recursive tree rewriting in normal order, only simplifying arguments which are needed (reduction.SimplifyNormalOrder).
+	'normal': lambda sub, execute: reduction.SimplifyNormalOrder(sub, execute),
+
+	# Explicit-stack environment machine (machine.Reduce).
+	'machine': lambda sub, execute: machine.Reduce(sub, execute),
+
+	# Environment machine with call-by-need sharing of arguments (machine.Reduce).
+	'need': lambda sub, execute: machine.Reduce(sub, execute, sharing=True),
+
+	# Normalization by evaluation, with function bodies compiled into Python closures (nbe.Reduce).
+	'nbe': lambda sub, execute: nbe.Reduce(sub, execute),
+
+	# Optimal reduction of an interaction net, sharing every copy of an argument (inet.Reduce).
+	'inet': lambda sub, execute: inet.Reduce(sub, execute),
+}
+
+"""str - the name of the engine used by Reduce.
+(Command Line Argument)
+"""
+current = 'recursive'
+
+"""bool - whether Reduce applies the rewrite pass (see rewrite.py) before the engine,
+and the engines drop the identity returned by 'print' instead of applying it (see primitiveActions.DropsIdentity).
+(Command Line Argument)
+"""
+rewriting = False
+
+def Validate(name):
+	"""Checks that a reduction engine exists.
+	Arguments:
+		name: str - the name of the engine
+	Exceptions:
+		DefunctError - there is no engine with that name
+	"""
+	if name not in names:
+		raise DefunctError("Unknown engine '{0}'. Valid engines are: {1}".format(name, ', '.join(names)))
+#
+
+def Select(name):
+	"""Selects the reduction engine used by Reduce.
+	Arguments:
+		name: str - the name of the engine
+	Exceptions:
+		DefunctError - there is no engine with that name
+	"""
+	global current
+
+	Validate(name)
+	current = name
+#
+
+def Reduce(sub, execute=False):
+	"""Simplifies an expression with the selected reduction engine,
+	after the rewrite pass if 'rewriting' is true.
+	Arguments:
+		sub: Sub - the expression to simplify
+		execute: bool - if true, will execute primitive functions like 'print'
+	Returns:
+		Sub - the expression which is as simplified as possible
+	"""
+	if rewriting:
+		sub = rewrite.Rewrite(sub, execute)
+	return names[current](sub, execute)
+#
+
+#endregion
@@ -1,3 +1,19 @@
+#region imports
+
+from collections import OrderedDict
+
+#endregion
+
+"""NOTE:
+These variables belong to the Interpreter which is currently running (see interpreter.Interpreter.activated).
+Each Interpreter replaces them with its own while it runs, so other modules must always
+read them as 'globalvars.name', never import them with 'from globalvars import ...'.
+The values below are used when no Interpreter is running.
+"""
+
+"""Names of all the variables which belong to an Interpreter"""
+interpreterVariables = ('definitions', 'definitionsByHash', 'indexedDefinitions', 'simplifiedDefinitions', 'currentHierarchy', 'output', 'printLength')
+
 #region Definitions
 
 """dictionary of
@@ -6,6 +22,24 @@
 """
 definitions = {}
 
+"""dictionary of
+	key: int - structural hash of a definition body (see compareSubs.StructuralHash)
+	value: list of str - names of the definitions with that hash, in the order of 'definitions'
+"""
+definitionsByHash = {}
+
+"""dictionary of
+	key: str - name of the definition
+	value: (int, int) - position of the name in 'definitions', and the hash the definition is indexed under
+"""
+indexedDefinitions = {}
+
+"""OrderedDict (least recently used first) of
+	key: (str, SimplifyMode) - name of an unsimplified ('def_u') definition, and how it was simplified
+	value: (Def, tuple of (str, Def), PackedSub) - the definition, the definitions it depended on, and its simplified body
+"""
+simplifiedDefinitions = OrderedDict()
+
 #endregion
 #region Reduction
 
@@ -13,4 +47,17 @@ definitions = {}
 currentHierarchy = []
 
 #endregion
+#region Output
 
+"""file object - where primitive actions like 'print' write to ('None' for sys.stdout)"""
+output = None
+
+"""int - the most characters of an expression which 'print' writes ('None' for no limit)"""
+printLength = None
+
+"""list of int - the structural hash of each expression 'print' has written, while they are being recorded
+('None' when they are not; see watch.Watcher.Run)
+"""
+printedHashes = None
+
+#endregion
@@ -0,0 +1,658 @@
+#region imports
+
+from structs import *
+import globalvars
+import primitiveActions
+import numerals
+import reduction
+import stats
+import limits
+import machine
+from machine import DefinitionCode
+from machine import code_Func, code_Bracket, code_Bound, code_Unbound, code_Foreign, code_None
+
+#endregion
+#region Agents
+
+"""NOTE:
+Optimal reduction (Lamping's algorithm). An expression is translated into an interaction net: a graph of
+agents, each with one principal port and a few auxiliary ports. Two agents interact only when their principal
+ports are linked, and each interaction replaces the pair with a few new agents (see Interact).
+
+A function argument which is used more than once is shared by fan agents instead of being copied, so
+an argument is never simplified more than once, even inside a function which is itself copied.
+Every lambda, application and control agent (fan, croissant or bracket) has a level, which tells
+which fans belong together: two fans of the same level annihilate, and a fan passes through an agent
+of a higher level by copying it. Croissants and brackets move the levels of the agents which pass through them.
+
+Only the interactions on the way from the root to the head of the expression are done (normal order),
+so a discarded argument is never simplified. The result is read back into Bracket, Func and ArgRef nodes
+by following paths through the net (see Readback); which way a fan is passed is decided by the context of
+the path, a stack of choices for each level.
+
+The net only covers plain Lambda Calculus. An expression which has a recursive Func, a definition which refers
+to itself, or a primitive which must be executed anywhere but at its head, is simplified by reduction.Simplify
+instead, and so is anything the net or the read back cannot handle (see Unsupported).
+"""
+
+"""Agent kinds"""
+kind_Lambda = 0		# function (body, binder), value is the argname
+kind_Apply = 1		# application (principal is the function, argument, result)
+kind_Fan = 2		# sharing (two auxiliary ports)
+kind_Croissant = 3	# decreases the level of what passes through it
+kind_Bracket = 4	# increases the level of what passes through it
+kind_Eraser = 5		# discards what it is linked to
+kind_Name = 6		# free name or foreign reference, value is the ArgRef
+kind_Root = 7		# where the result is read from (port 1)
+kind_Closed = 8		# expression without free arguments, not translated yet (see _Translate), value is the Code
+
+"""list of int - how many ports each kind of agent has, including the principal port (port 0)"""
+_arity = [3, 3, 3, 2, 2, 1, 1, 2, 1]
+
+"""Kinds of the control agents, which only move levels and share (Lamping's fans, croissants and brackets)"""
+_controls = (kind_Fan, kind_Croissant, kind_Bracket)
+
+class Agent:
+	"""Represents a node of an interaction net.
+	(Internal)
+	"""
+	__slots__ = ('kind', 'level', 'value', 'nodes', 'ports')
+
+	def __init__(this, kind, level=0, value=None):
+		"""
+		Arguments:
+			kind  : int - one of the kind_... constants
+			level : int - which level the agent belongs to (not used by erasers, names and the root)
+			value : str - the argument name (kind_Lambda)
+					ArgRef - the reference which the agent stands for (kind_Name)
+					Code - the expression which the agent stands for (kind_Closed)
+		"""
+		this.kind = kind
+		this.level = level
+		this.value = value
+
+		"""list of Agent, list of int - the agent and port which each port is linked to"""
+		n = _arity[kind]
+		this.nodes = [None] * n
+		this.ports = [0] * n
+	#
+#
+
+def Link(a, i, b, j):
+	"""Links port 'i' of agent 'a' with port 'j' of agent 'b'."""
+	a.nodes[i] = b
+	a.ports[i] = j
+	b.nodes[j] = a
+	b.ports[j] = i
+#
+
+class Unsupported(Exception):
+	"""The expression cannot be simplified with an interaction net (see the NOTE above).
+	(Internal)
+	"""
+	pass
+#
+
+#endregion
+#region Translation
+
+def Translate(code):
+	"""Translates an expression into an interaction net (see _Translate).
+	Arguments:
+		code: Code - the compiled expression (see machine.Compile)
+	Returns:
+		Agent - the root (kind_Root)
+	Exceptions:
+		Unsupported - the expression, or a definition it refers to, has a recursive Func, or a definition refers to itself
+	"""
+	if code.containsRecursive:
+		raise Unsupported()
+	_CheckDefinitions(code)
+	root = Agent(kind_Root)
+	_Translate(code, 0, root, 1)
+	return root
+#
+
+def _CheckDefinitions(code):
+	"""Checks that the definitions which an expression refers to can be expanded into a net:
+	none of them has a recursive Func, and none of them refers to itself (directly or through others).
+	Arguments:
+		code: Code - the compiled expression
+	Exceptions:
+		Unsupported - a definition cannot be expanded
+	"""
+	"""dictionary of
+		key: str - name of a definition
+		value: bool - whether its references are still being checked (False once they have all been checked)
+	"""
+	checking = {}
+	todo = [(name, False) for name in code.names]
+	while todo:
+		name, done = todo.pop()
+		if done:
+			checking[name] = False
+			continue
+		elif name not in globalvars.definitions:
+			continue
+		elif name in checking:
+			if checking[name]:
+				raise Unsupported()
+			continue
+		#
+		body = DefinitionCode(name)
+		if body.containsRecursive:
+			raise Unsupported()
+		checking[name] = True
+		todo.append((name, True))
+		todo.extend((reference, False) for reference in body.names)
+	#
+#
+
+def _Translate(code, level, node, port):
+	"""Translates an expression into agents, and links its result with a port.
+	A reference to a function argument gets a croissant of its level. The argument of an application is
+	one level deeper, and each function argument which is used inside it leaves it through a bracket
+	of the application's level, then is shared with the function side through a fan of the same level.
+	An expression inside it which is closed (a definition, or a part which uses no argument from outside of it)
+	is only translated once it is needed (see kind_Closed).
+	Does not use the Python call stack.
+	Arguments:
+		code: Code - the expression
+		level: int - the level of the expression
+		node: Agent, port: int - where its result goes
+	"""
+	"""stack of
+		(Code, int, env, Agent, int) - an expression to translate at a level, in an environment of lambdas,
+			and the port its result is linked to
+		(Agent,) - a lambda or application whose parts have been translated
+	env: tuple(Agent, env) - linked list of the enclosing lambdas, nearest first
+	"""
+	todo = [(code, level, None, node, port)]
+
+	"""stack of dictionary - for each translated expression
+		key: Agent - a lambda whose argument is used in the expression
+		value: (Agent, int) - the port which leads to every use of it (linked to the lambda's binder in the end)
+	"""
+	uses = []
+	agents = 0
+
+	while todo:
+		task = todo.pop()
+		if len(task) == 1:
+			agent = task[0]
+			if agent.kind == kind_Lambda:
+				use = uses[-1].pop(agent, None)
+				if use == None:
+					use = (Agent(kind_Eraser), 0)
+					agents += 1
+				Link(agent, 2, use[0], use[1])
+				continue
+			#
+
+			right = uses.pop()
+			left = uses[-1]
+			for lam, (node, port) in right.items():
+				bracket = Agent(kind_Bracket, agent.level)
+				Link(bracket, 1, node, port)
+				if lam in left:
+					fan = Agent(kind_Fan, agent.level)
+					Link(fan, 1, *left[lam])
+					Link(fan, 2, bracket, 0)
+					left[lam] = (fan, 0)
+					agents += 1
+				else:
+					left[lam] = (bracket, 0)
+			#
+			agents += len(right)
+			continue
+		#
+
+		code, level, env, node, port = task
+		tag = code.tag
+
+		if (tag == code_Func or tag == code_Bracket) and not code.frees and todo:
+			agent = Agent(kind_Closed, level, code)
+			Link(agent, 0, node, port)
+			uses.append({})
+		#
+		elif tag == code_Func:
+			agent = Agent(kind_Lambda, level, code.argname)
+			Link(agent, 0, node, port)
+			todo.append((agent,))
+			todo.append((code.body, level, (agent, env), agent, 1))
+		#
+		elif tag == code_Bracket:
+			agent = Agent(kind_Apply, level)
+			Link(agent, 2, node, port)
+			# the argument is in a box one level deeper
+			todo.append((agent,))
+			todo.append((code.right, level + 1, env, agent, 1))
+			todo.append((code.left, level, env, agent, 0))
+		#
+		elif tag == code_Bound:
+			agent = Agent(kind_Croissant, level)
+			Link(agent, 1, node, port)
+			uses.append({ machine.Lookup(env, code.index): (agent, 0) })
+		#
+		elif tag == code_Unbound:
+			name = code.argname
+			if name in globalvars.definitions:
+				stats.definitionExpansions += 1
+				stats.expandedDefinitions[name] = stats.expandedDefinitions.get(name, 0) + 1
+				agent = Agent(kind_Closed, level, DefinitionCode(name))
+			else:
+				agent = Agent(kind_Name, value=ArgRef(argname=name))
+			Link(agent, 0, node, port)
+			uses.append({})
+		#
+		elif tag == code_Foreign:
+			agent = Agent(kind_Name, value=code.ref)
+			Link(agent, 0, node, port)
+			uses.append({})
+		else:
+			raise Unsupported()
+		#
+		agents += 1
+	#
+
+	stats.copiedNodes += agents
+	if stats.copiedNodes > limits.nodeCheckpoint:
+		limits.Check()
+#
+
+def _Expand(agent):
+	"""Translates the expression of a kind_Closed agent in its place."""
+	_Translate(agent.value, agent.level, agent.nodes[0], agent.ports[0])
+#
+
+#endregion
+#region Interaction
+
+def Interact(a, b):
+	"""Rewrites a pair of agents whose principal ports are linked.
+	Arguments:
+		a, b: Agent
+	Returns:
+		int - how many agents were created
+	Changes:
+		stats.betaReductions - if a function was applied
+	Exceptions:
+		Unsupported - the agents should never have met (the net is not one which Translate makes)
+	"""
+	ka = a.kind
+	kb = b.kind
+	if ka == kind_Closed or kb == kind_Closed:
+		closed, other = (a, b) if ka == kind_Closed else (b, a)
+		if other.kind == kind_Croissant or other.kind == kind_Bracket:
+			return _Commute(other, closed)
+		# anything else needs the expression itself, so that a fan shares its parts instead of copying it whole
+		_Expand(closed)
+		return 0
+	#
+	if ka == kind_Apply and kb == kind_Lambda:
+		a, b = b, a
+		ka, kb = kb, ka
+	#
+
+	if ka == kind_Lambda and kb == kind_Apply:
+		if a.level != b.level:
+			raise Unsupported()
+		# the argument takes the place of the binder, and the body the place of the result
+		argument = (b.nodes[1], b.ports[1])
+		binder = (a.nodes[2], a.ports[2])
+		body = (a.nodes[1], a.ports[1])
+		result = (b.nodes[2], b.ports[2])
+		Link(argument[0], argument[1], binder[0], binder[1])
+		Link(body[0], body[1], result[0], result[1])
+		stats.betaReductions += 1
+		if stats.betaReductions > limits.checkpoint:
+			limits.Check()
+		return 0
+	#
+
+	if ka in _controls and kb in _controls:
+		if a.level == b.level:
+			if ka != kb:
+				raise Unsupported()
+			for i in range(1, _arity[ka]):
+				Link(a.nodes[i], a.ports[i], b.nodes[i], b.ports[i])
+			return 0
+		#
+		if a.level > b.level:
+			a, b = b, a
+	#
+	elif kb in _controls:
+		a, b = b, a
+	elif ka not in _controls:
+		raise Unsupported()
+	#
+	if b.kind != kind_Name and b.level <= a.level:
+		raise Unsupported()
+	return _Commute(a, b)
+#
+
+def _Commute(control, other):
+	"""Passes a control agent through an agent of a higher level: the other agent is copied for each auxiliary port
+	of the control agent (at a new level), and the control agent for each auxiliary port of the other agent.
+	Arguments:
+		control: Agent - a fan, croissant or bracket
+		other: Agent - the agent it meets
+	Returns:
+		int - how many agents were created
+	"""
+	kind = control.kind
+	level = other.level
+	if kind == kind_Croissant:
+		level -= 1
+	elif kind == kind_Bracket:
+		level += 1
+
+	if kind != kind_Fan:
+		# one auxiliary port: the other agent is moved instead of copied
+		node = control.nodes[1]
+		port = control.ports[1]
+		n = len(other.nodes)
+		peers = [(other.nodes[q], other.ports[q]) for q in range(1, n)]
+		if node is other or any(peer is control or peer is other for peer, p in peers):
+			raise Unsupported()
+		other.level = level
+		Link(other, 0, node, port)
+		for q in range(1, n):
+			copy = control if q == 1 else Agent(kind, control.level)
+			Link(copy, 0, peers[q - 1][0], peers[q - 1][1])
+			Link(other, q, copy, 1)
+		#
+		return n - 2 if n > 2 else 0
+	#
+
+	cs = range(1, _arity[kind])
+	os = range(1, _arity[other.kind])
+	controlPeers = [(control.nodes[p], control.ports[p]) for p in cs]
+	otherPeers = [(other.nodes[q], other.ports[q]) for q in os]
+	for node, port in controlPeers + otherPeers:
+		if node is control or node is other:
+			raise Unsupported()
+	#
+
+	others = [other] + [Agent(other.kind, level, other.value) for p in cs[1:]]
+	other.level = level
+	controls = [control] + [Agent(kind, control.level) for q in os[1:]]
+	for p, (node, port) in zip(cs, controlPeers):
+		Link(others[p - 1], 0, node, port)
+	for q, (node, port) in zip(os, otherPeers):
+		Link(controls[q - 1], 0, node, port)
+	for p in cs:
+		for q in os:
+			Link(others[p - 1], q, controls[q - 1], p)
+	#
+	return len(others) + len(controls) - 2
+#
+
+#endregion
+#region Reading Back
+
+"""NOTE:
+A context is a tuple with a level for each level of the net (missing levels at the end are empty).
+Each level is one of
+	None				- empty
+	(port, level)		- a fan of this level was passed from its auxiliary port 'port' (1 or 2)
+	(0, level, level)	- two levels which a bracket of this level merged
+	_inserted			- a level which a croissant of this level inserted
+Passing a control agent from its principal port to an auxiliary port undoes what passing it the other way did.
+"""
+
+"""A level inserted by a croissant"""
+_inserted = (3,)
+
+def _Enter(agent, port, context):
+	"""Passes a control agent, from the port it is entered at to the port it is left at, changing the context.
+	Arguments:
+		agent: Agent - a fan, croissant or bracket
+		port: int - the port it is entered at
+		context: tuple - see the NOTE above
+	Returns:
+		(int, tuple) - the port it is left at, and the new context
+	Exceptions:
+		Unsupported - the context does not match the agent
+	"""
+	i = agent.level
+	if len(context) <= i + 1:
+		context += (None,) * (i + 2 - len(context))
+	kind = agent.kind
+
+	if port != 0:
+		if kind == kind_Fan:
+			return (0, context[:i] + ((port, context[i]),) + context[i + 1:])
+		elif kind == kind_Croissant:
+			return (0, context[:i] + (_inserted,) + context[i:])
+		else:
+			return (0, context[:i] + ((0, context[i], context[i + 1]),) + context[i + 2:])
+	#
+
+	level = context[i]
+	if kind == kind_Fan:
+		if level == None or level[0] not in (1, 2):
+			raise Unsupported()
+		return (level[0], context[:i] + (level[1],) + context[i + 1:])
+	elif kind == kind_Croissant:
+		return (1, context[:i] + context[i + 1:])
+	elif level == None:
+		return (1, context[:i] + (None, None) + context[i + 1:])
+	elif level[0] != 0:
+		raise Unsupported()
+	return (1, context[:i] + (level[1], level[2]) + context[i + 1:])
+#
+
+def Head(node, port, context):
+	"""Follows a path from a port towards the head of the expression linked to it,
+	doing every interaction found on the way.
+	Arguments:
+		node: Agent, port: int - where the path starts (a port which is not principal)
+		context: tuple - the context at the start (see the NOTE above)
+	Returns:
+		(Agent, int, tuple, list) - the head: a lambda (port 0), the binder of a lambda (port 2) or a name (port 0),
+			the context there, and the applications passed on the way, outermost first, as (Agent, context)
+	Exceptions:
+		Unsupported - the path cannot be followed
+	"""
+	"""list of (Agent, int, tuple, int) - each port left so far, the context there and the length of 'spine'"""
+	trail = []
+	spine = []
+	created = 0
+	while True:
+		target = node.nodes[port]
+		entered = node.ports[port]
+		kind = target.kind
+
+		if port == 0 and entered == 0 and not (kind == kind_Name and node.kind == kind_Apply):
+			created += Interact(node, target)
+			if created > limits.memoryInterval:
+				stats.copiedNodes += created
+				created = 0
+				if stats.copiedNodes > limits.nodeCheckpoint:
+					limits.Check()
+			#
+			# the agent the path came through has been replaced, so go back to before it
+			node, port, context, length = trail.pop()
+			del spine[length:]
+			continue
+		#
+
+		if kind == kind_Lambda:
+			if entered == 1 or (entered == 0 and spine):
+				raise Unsupported()
+			break
+		elif kind == kind_Name:
+			break
+		elif kind == kind_Closed:
+			_Expand(target)
+			continue
+		elif kind == kind_Apply:
+			if entered != 2:
+				raise Unsupported()
+			spine.append((target, context))
+			leave = 0
+		elif kind in _controls:
+			leave, context2 = _Enter(target, entered, context)
+			trail.append((node, port, context, len(spine)))
+			node, port, context = target, leave, context2
+			continue
+		else:
+			raise Unsupported()
+		#
+		trail.append((node, port, context, len(spine) - 1))
+		node, port = target, leave
+	#
+	stats.copiedNodes += created
+	return (target, entered, context, spine)
+#
+
+def _Below(context, level):
+	"""The levels of a context below a level. The fans which share a lambda all have lower levels than it,
+	so these tell apart the functions read back from the same lambda, and are the same at its binder.
+	Arguments:
+		context: tuple - see the NOTE above
+		level: int
+	Returns:
+		tuple - 'level' levels
+	"""
+	if len(context) >= level:
+		return context[:level]
+	return context + (None,) * (level - len(context))
+#
+
+"""Readback frame tags"""
+frame_Func = 0			# (frame_Func, func, agent) - the body of 'func' (read from the lambda 'agent') is being read back
+frame_Series = 1		# [frame_Series, left, arguments] - reading back the arguments of an application
+
+def Readback(root):
+	"""Reads the normal form of a net back into an expression, doing the interactions it needs on the way.
+	Does not use the Python call stack.
+	Arguments:
+		root: Agent - the root of the net (see Translate)
+	Returns:
+		Sub - the simplified expression
+	Exceptions:
+		Unsupported - the net could not be read back
+	"""
+	"""list - frames of the expressions being read back, innermost last"""
+	frames = []
+
+	"""dictionary of
+		key: Agent - a lambda
+		value: list of (Func, tuple) - the functions being read back from it, and the levels of the context
+			below the lambda's level when it was found (see _Below)
+	"""
+	funcs = {}
+
+	"""int - references read back since limits.Check was last called (see nbe.Readback)"""
+	refs = 0
+
+	node, port, context = root, 1, ()
+	while True:
+		#region find the head of the expression
+		head, entered, context, spine = Head(node, port, context)
+
+		if head.kind == kind_Lambda and entered == 0:
+			func = Func(argname=head.value)
+			funcs.setdefault(head, []).append((func, _Below(context, head.level)))
+			frames.append((frame_Func, func, head))
+			node, port = head, 1
+			continue
+		#
+		elif head.kind == kind_Lambda:
+			below = _Below(context, head.level)
+			candidates = [func for func, levels in funcs.get(head, ()) if levels == below]
+			if len(candidates) != 1:
+				raise Unsupported()
+			sub = ArgRef(argname=head.value, func=candidates[0])
+		else:
+			ref = head.value
+			sub = ArgRef(argname=ref.argname, func=ref.func)
+		#
+
+		refs += 1
+		if refs > limits.memoryInterval and limits.current != None:
+			refs = 0
+			limits.Check()
+		#
+		if spine:
+			frames.append([frame_Series, sub, spine])
+			node, context = spine.pop()
+			port = 1
+			continue
+		#
+		#endregion
+		#region deliver the expression to the enclosing frames
+
+		while frames:
+			frame = frames[-1]
+			if frame[0] == frame_Func:
+				frames.pop()
+				func = frame[1]
+				funcs[frame[2]].pop()
+				func.body = sub
+				func.Update()
+				sub = numerals.Recognize(func) or func
+			#
+			else:
+				frame[1] = Bracket(left=frame[1], right=sub)
+				if frame[2]:
+					node, context = frame[2].pop()
+					port = 1
+					break
+				frames.pop()
+				sub = frame[1]
+			#
+		#
+		else:
+			return sub
+		#endregion
+	#
+#
+
+#endregion
+#region Reduce
+
+def Reduce(sub, execute=False):
+	"""Simplifies an expression by optimal reduction of an interaction net (see the NOTE above).
+	Produces the same result as reduction.Simplify whenever that finishes (and finishes on more expressions,
+	since a discarded argument is never simplified).
+	A primitive at the head of the expression, like 'print' in (print x y), is executed once its first parameter
+	has been simplified; an expression which would execute a primitive anywhere else is simplified by reduction.Simplify.
+	Arguments:
+		sub: Sub - the expression to simplify
+		execute: bool - if true, will execute primitive functions like 'print'
+	Returns:
+		Sub - the expression which is as simplified as possible
+	"""
+	args = []
+	head = sub
+	while execute:
+		while type(head) == Bracket:
+			args.append(head.right)
+			head = head.left
+		#
+		if (not args or type(head) != ArgRef or head.func != None
+			or head.argname in globalvars.definitions or head.argname not in primitiveActions.names
+			):
+			break
+		#
+		head = primitiveActions.names[head.argname](Reduce(args.pop(), True))
+		if args and primitiveActions.DropsIdentity(head):
+			head = args.pop()
+	#
+	sub = head
+	while args:
+		sub = Bracket(left=sub, right=args.pop())
+
+	code = machine.Compile(sub)
+	if execute and machine.Executes(code.names):
+		return reduction.Simplify(sub, execute)
+	try:
+		return Readback(Translate(code))
+	except Unsupported:
+		return reduction.Simplify(sub, execute)
+#
+
+#endregion
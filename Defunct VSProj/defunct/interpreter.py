@@ -0,0 +1,1208 @@
+#region imports
+
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+import bisect
+import io
+import time
+
+from debugwrapper import dprint
+from extensions import appendIfTruthy
+from structs import *
+from compareSubs import *
+from packedSubs import Pack
+from arena import TermArena
+from tokenizer import *
+import globalvars
+import primitiveActions
+import primitiveExpressions
+import engines
+import reduction
+import stats
+import limits
+import defcache
+
+#endregion
+#region Keywords
+
+"""Create a Definition.
+	def <name> <body>
+"""
+keyword_Define = 'def'
+
+"""Create an unsimplified Definition.
+	def_u <name> <body>
+"""
+keyword_DefineUnsimplified = 'def_u'
+
+"""Simplify an expression and execute all primitive functions
+	do <expression>
+"""
+keyword_Execute = 'do'
+
+
+"""List of all valid Entry-level keywords"""
+Keywords = [keyword_Define, keyword_DefineUnsimplified, keyword_Execute]
+
+#endregion
+#region Character Recognition
+"""Functions and variables for recognising what kind of character/token is being read at the moment."""
+
+char_BracketStart = '('
+char_BracketEnd = ')'
+
+char_FuncStart = '['
+char_FuncEnd = ']'
+char_FuncArgumentEnd = '.'
+
+char_Recursive = '$'
+
+chars_NotIdentifier = (
+	chars_Whitespace
+	+ char_BracketStart + char_BracketEnd
+	+ char_FuncStart + char_FuncEnd + char_FuncArgumentEnd
+	)
+
+"""Functions that return bool - whether current character is a certain type of character"""
+def ischar_BracketStart(char):		return char == char_BracketStart #
+def ischar_BracketEnd(char):		return not char  or  char == char_BracketEnd  or  char == char_FuncEnd #
+def ischar_FuncStart(char):			return char == char_FuncStart #
+def ischar_FuncEnd(char):			return not char  or  char == char_FuncEnd #
+def ischar_FuncArgumentEnd(char):	return char == char_FuncArgumentEnd #
+def ischar_Identifier(char):		return char  and  char not in chars_NotIdentifier #
+
+#endregion
+#region Parser
+
+def LinkArgRefs(sub, func):
+	"""Makes sure local ArgRefs with same name as func.argname are linked to that Func,
+	and updates the stored flags of the nodes above them.
+	Arguments:
+		sub: Sub - the current expression node
+		func: Func - the function to link references to
+	"""
+	if sub == None or func == None:
+		return
+
+	if type(sub) == ArgRef:
+		if sub.func == None and sub.argname == func.argname:
+			sub.Link(func)
+
+	elif type(sub) == Func:
+		LinkArgRefs(sub.body, func)
+		sub.Update()
+
+	elif type(sub) == Bracket:
+		LinkArgRefs(sub.left, func)
+		LinkArgRefs(sub.right, func)
+		sub.Update()
+#
+
+class Parser:
+	"""Reads Defunct source code, one statement or expression at a time.
+	Note: Most methods use 'this.token' and 'this.char'. Some use 'this.tokens' and 'this.location'.
+	"""
+
+	def __init__(this, text):
+		"""
+		Arguments:
+			text: str - the source code
+		"""
+		"""Iterator of Token - the rest of the source code (see tokenizer.Tokenize)"""
+		this.tokens = Tokenize(text)
+
+		"""Token - the current token being read"""
+		this.token = None
+
+		"""The first character of the current token ('' at the end of the source code)"""
+		this.char = ''
+
+		"""The location of the current token in the source code.
+		Tuple of (int, int): (line number, column number)
+		"""
+		this.location = (1,1)
+
+		"""The location of the keyword of the statement being read by DoEntry"""
+		this.statementLocation = (1,1)
+
+		this.nexttoken()
+		this.skipwhite()
+	#
+
+	#region Cradle
+
+	def nexttoken(this):
+		"""Gets the next token from the source code and stores it in 'token', 'char' and 'location'."""
+		this.token = next(this.tokens)
+		this.char = this.token.char
+		this.location = this.token.location
+	#
+
+	def skipwhite(this):
+		"""Skips comment tokens until another kind of token is found. Retrieves the comments along the way.
+		(Whitespace is never a token.)
+		Returns:
+			list(str) - list of comments
+		"""
+		comments = []
+		while this.token.kind == token_Comment:
+			appendIfTruthy(comments, this.token.text)
+			this.nexttoken()
+		#
+		return comments
+	#
+
+	def match(this, s):
+		"""Matches the next symbol token (throws an error if it was not correct), then skips comments.
+		Arguments:
+			s: str - the expected symbol
+		Returns:
+			list(str) - list of comments
+		Exceptions:
+			DefunctInputError - the symbol was not expected.
+		"""
+		if this.token.kind != token_Symbol or this.token.text != s:
+			raise DefunctError_InputError("Expected '{0}', got '{1}'.".format(s, this.char), this.location)
+		this.nexttoken()
+		return this.skipwhite()
+	#
+
+	def Parse(this, function):
+		"""Reads something which must take up the rest of the source code.
+		Arguments:
+			function: callable() - the Do... method which reads it
+		Returns:
+			the value returned by 'function'
+		Exceptions:
+			DefunctInputError - there was more source code afterwards.
+		"""
+		retval = function()
+		if this.token.kind != token_End:
+			raise DefunctError_InputError("Expected end of input, got '{0}'.".format(this.char), this.location)
+		return retval
+	#
+
+	#endregion
+	#region DoIdentifiers
+
+	def DoIdentifier(this):
+		"""Does an identifier name (e.g. argument name, definition name, reference name)
+		Returns:
+			str - the identifier/name
+		"""
+		if this.token.kind != token_Identifier:
+			raise DefunctError_InputError("Expected identifier, got '{0}'.".format(this.char), this.location)
+
+		retval = this.token.text
+		this.nexttoken()
+		this.skipwhite()
+		return retval
+	#
+
+	def DoKeyword(this):
+		name = this.DoIdentifier()
+		if name not in Keywords:
+			raise DefunctError_InputError("Expected keyword, got '{0}'".format(name), this.location)
+		return name
+	#
+	def DoName(this):
+		name = this.DoIdentifier()
+		if name in Keywords and not name in primitiveActions.names:
+			raise DefunctError_InputError("Expected identifier, got keyword '{0}'".format(name), this.location)
+		return name
+	#
+	def DoFuncArgname(this):
+		name = this.DoName()
+		if name in primitiveActions.names:
+			raise DefunctError_InputError("Function Argument cannot have primitive name '{0}'".format(name), this.location)
+		return name
+	#
+	def DoDefName(this):
+		name = this.DoIdentifier()
+		if name in Keywords:
+			raise DefunctError_InputError("Expected identifier, got keyword '{0}'".format(name), this.location)
+		elif name in primitiveActions.names:
+			raise DefunctError_InputError("Expected identifier, got primitive '{0}'".format(name), this.location)
+		return name
+	#
+
+	#endregion
+
+	def DoRef(this):
+		"""Does an argument/definition reference by name.
+		Returns:
+			ArgRef
+		"""
+		return ArgRef(argname=this.DoName())
+	#
+
+	#region DoFunc
+
+	def DoFuncArg(this):
+		"""Creates a new function with its argname and recursiveness, but not its body.
+		Returns:
+			Func - the newly created function
+		"""
+		func = Func()
+
+		if this.char == char_Recursive:
+			func.recursive = True
+			if this.token.text == char_Recursive:
+				this.nexttoken()
+				this.skipwhite()
+			else:
+				# the argument name is written directly after '$'
+				this.location = (this.location[0], this.location[1] + 1)
+				this.token = Token(token_Identifier, this.token.text[1:], this.location)
+				this.char = this.token.char
+		#
+
+		func.argname = this.DoFuncArgname()
+
+		return func
+	#
+
+	def DoFuncSeries(this):
+		"""Does a series of functions inside a function definition bracket set (like a function with multiple arguments).
+		Returns:
+			Func - the top Func, possibly the start of many Funcs
+		Input Examples:
+			[x. (...) ]
+			[x y z. (...) ]
+		"""
+		this.match(char_FuncStart)
+
+		# creating Funcs
+		topfunc = this.DoFuncArg()
+		funcs = [ topfunc ]
+		endfunc = topfunc
+
+		while not ischar_FuncArgumentEnd(this.char):
+			func = this.DoFuncArg()
+			endfunc.body = func
+
+			funcs.append(func)
+			endfunc = func
+		#
+		if this.char:
+			this.match(char_FuncArgumentEnd)
+
+		# getting body
+		endfunc.body = this.DoSeries()
+
+		# linking ArgRefs
+		for func in reversed(funcs):
+			LinkArgRefs(func.body, func)
+			func.Update()
+		#
+
+		if this.char:
+			this.match(char_FuncEnd)
+
+		return topfunc
+	#
+
+	#endregion
+	#region DoSeries
+
+	def DoSeries(this):
+		"""Does a series of expressions
+		Returns:
+			Sub - a single expression (there were no further expressions)
+			Bracket - top of series of expressions
+		Input Examples:
+			x				-> x
+			x y z			-> ((x y)z)
+			x(y z)			-> (x(y z))
+			()				-> [x.x]
+		"""
+		if ischar_BracketEnd(this.char):
+			return primitiveExpressions.identity()
+
+		retval = this.DoSub()
+		while not ischar_BracketEnd(this.char):
+			right = this.DoSub()
+			if right == None:
+				raise DefunctError_InputError("Unexpected '{0}'.".format(this.char), this.location)
+			retval = Bracket(
+				left=retval,
+				right=right
+				)
+		#
+		return retval
+	#
+
+	def DoBracketedSeries(this):
+		"""Does a series of expressions contained within parentheses.
+		Returns:
+			Sub - a single expression
+			Brackte - top of series of expressions
+		Input Examples:
+			x				-> x
+			x y z			-> ((x y)z)
+			x(y z)			-> (x(y z))
+			()				-> [x.x]
+		"""
+		this.match(char_BracketStart)
+		retval = this.DoSeries()
+		if this.char:
+			this.match(char_BracketEnd)
+		return retval
+	#
+
+	#endregion
+
+	def DoSub(this):
+		"""Does an expression and any sub-expressions.
+		Returns:
+			Sub - an expression node
+		"""
+
+		if ischar_BracketStart(this.char):
+			return this.DoBracketedSeries()
+
+		elif ischar_FuncStart(this.char):
+			return this.DoFuncSeries()
+
+		elif ischar_Identifier(this.char):
+			return this.DoRef()
+	#
+
+	def DoEntry(this):
+		"""Does a series of definitions and executions.
+		Each statement is read only when the previous one has been used.
+		Returns:
+			generator of (str, str, Sub) - the keyword, the definition name ('None' for 'do'), and the expression
+		Input Examples:
+			def   myFunc ([a.a][x y.y x])
+			def_u myExpr ([a.a][a b.b a])
+			do (print myFunc)
+		"""
+		while this.char:
+			this.statementLocation = this.location
+			key = this.DoKeyword()
+
+			if key == keyword_Define or key == keyword_DefineUnsimplified:
+				name = this.DoDefName()
+				yield (key, name, this.DoSub())
+			#
+			elif key == keyword_Execute:
+				yield (key, None, this.DoSub())
+			#
+		#
+	#
+#
+
+#endregion
+#region Interpreter
+
+"""int - how many characters of a 'do' statement's expression are shown in its description"""
+descriptionLength = 60
+
+def DescribeStatement(key, name, sub):
+	"""Creates a short description of a statement, e.g. for profiles.
+	Arguments:
+		key: str - the keyword of the statement
+		name: str - the definition name ('None' for 'do')
+		sub: Sub - the expression, before it is simplified
+	Returns:
+		str
+	"""
+	if key != keyword_Execute:
+		return '{0} {1}'.format(key, name)
+	return '{0} {1}'.format(key, SubToString(sub, limit=descriptionLength))
+#
+
+class Interpreter:
+	"""Runs Defunct programs. Each Interpreter has its own definitions, reduction stack and output,
+	so several can be used in one process, one after another or nested.
+	"""
+
+	def __init__(this, engine='recursive', packDefinitions=False, output=None, jobs=1, profile=False, limits=None, cache=None,
+			lazyDefinitions=False, printLength=None, arenaDefinitions=False, rewrite=False):
+		"""
+		Arguments:
+			engine			: str - the name of the reduction engine (see engines.names)
+			packDefinitions	: bool - whether definition bodies are stored as packed expressions (see packedSubs.py)
+			output			: file object - where primitive actions like 'print' write to ('None' for sys.stdout)
+			jobs			: int - how many processes 'load' may use to simplify 'def' statements and run 'do' statements
+			profile			: bool - whether 'load' measures each statement (see 'profile' below)
+			limits			: limits.Limits - the most work each statement may do ('None' for no limits)
+			cache			: defcache.DefinitionCache - where simplified definitions are kept between runs ('None' for no cache)
+			lazyDefinitions	: bool - whether 'def' bodies are only simplified when they are first referenced
+			printLength		: int - the most characters of an expression which 'print' writes ('None' for no limit)
+			arenaDefinitions: bool - whether definition bodies are stored in a term arena (see arena.py)
+			rewrite			: bool - whether each statement is rewritten before it is simplified (see rewrite.py)
+		Exceptions:
+			DefunctError - there is no engine with that name, 'jobs' or 'printLength' is not a valid number,
+				or both packDefinitions and arenaDefinitions are true
+		"""
+		engines.Validate(engine)
+		if type(jobs) != int or jobs < 1:
+			raise DefunctError("Number of jobs must be a positive whole number, got '{0}'.".format(jobs))
+		if printLength != None and (type(printLength) != int or printLength < 4):
+			raise DefunctError("Print length must be a whole number of at least 4, got '{0}'.".format(printLength))
+		if packDefinitions and arenaDefinitions:
+			raise DefunctError("Definitions cannot be both packed and stored in a term arena.")
+
+		"""str - the name of the reduction engine"""
+		this.engine = engine
+
+		"""bool - whether engines.Reduce applies the rewrite pass first (see rewrite.py)"""
+		this.rewrite = rewrite
+
+		"""bool - whether DoDef packs definition bodies"""
+		this.packDefinitions = packDefinitions
+
+		"""arena.TermArena - where DoDef stores definition bodies ('None' to keep them as they are)"""
+		this.arena = TermArena() if arenaDefinitions else None
+
+		"""int - how many processes 'load' may use to run 'do' statements (1 runs them in this process)"""
+		this.jobs = jobs
+
+		"""list of dictionary - the profile of each statement run by 'load' ('None' if not profiling):
+			'line'		: int - where the statement starts
+			'statement'	: str - its description (see DescribeStatement)
+			'time'		: float - seconds (missing if the statement did not run)
+			the counters of stats.Measurement
+			'nodes'		: int - how many nodes the result has (only while measuring memory, see stats.MeasureMemory)
+		"""
+		this.profile = [] if profile else None
+
+		"""limits.Limits - the most work each statement may do ('None' for no limits)"""
+		this.limits = limits
+
+		"""defcache.DefinitionCache - where DoDef finds and keeps simplified definition bodies ('None' for no cache)"""
+		this.cache = cache
+
+		"""bool - whether DoDef leaves 'def' bodies to be simplified when they are first referenced (see reduction.NormalizeDefinition)"""
+		this.lazyDefinitions = lazyDefinitions
+
+		"""deque of Def - the lazy definitions made by DoDef, oldest first (some may have been simplified since)"""
+		this.lazyQueue = deque()
+
+		# the variables which replace those in globalvars while this Interpreter runs (see globalvars.interpreterVariables)
+		this.definitions = {}
+		this.definitionsByHash = {}
+		this.indexedDefinitions = {}
+		this.simplifiedDefinitions = OrderedDict()
+		this.currentHierarchy = []
+		this.output = output
+		this.printLength = printLength
+	#
+
+	@contextmanager
+	def activated(this):
+		"""Makes this Interpreter the one which is currently running, until the 'with' block ends.
+		Example:
+			with interpreter.activated():
+				engines.Reduce(sub)
+		Changes:
+			globalvars (see globalvars.interpreterVariables), engines.current, engines.rewriting
+			(the previous values are restored afterwards)
+		"""
+		previous = [getattr(globalvars, name) for name in globalvars.interpreterVariables]
+		previousEngine = engines.current
+		previousRewriting = engines.rewriting
+		for name in globalvars.interpreterVariables:
+			setattr(globalvars, name, getattr(this, name))
+		engines.current = this.engine
+		engines.rewriting = this.rewrite
+		try:
+			yield this
+		finally:
+			# an error may have left functions on the reduction stack
+			reduction.UnwindHierarchy()
+
+			for name, value in zip(globalvars.interpreterVariables, previous):
+				setattr(globalvars, name, value)
+			engines.current = previousEngine
+			engines.rewriting = previousRewriting
+	#
+
+	#region Statements
+
+	def DoDef(this, name, body, simplify=True, simplified=None):
+		"""Binds an expression to a name which can later be referenced.
+		Must be called while this Interpreter is activated.
+		Arguments:
+			name: str - the name of the definition
+			body: Sub - the expression
+			simplify: bool - should the expression be simplified before storing?
+				(if lazyDefinitions, it is simplified when it is first referenced instead)
+			simplified: Sub - the expression, already simplified against the current definitions
+				(see _SimplifyDefinitions; 'None' to simplify it here)
+		Returns:
+			Def - the new definition
+		Changes:
+			definitions, definitionsByHash, lazyQueue
+			simplifiedDefinitions (entries depending on this name are no longer used)
+			cache (the simplified body is found in it, or added to it)
+		Exceptions:
+			DefunctError_LimitExceeded - simplifying took too much work (the previous definition is kept)
+		"""
+		previous = this.definitions.get(name)
+		dfn = Def(
+			name=name,
+			body=body,
+			previous=previous if this._TrimPrevious(previous) else None
+			)
+
+		key = this.cache.Key(body, simplify, this.engine, this.rewrite) if this.cache != None else None
+		cached = this.cache.Get(key) if simplify and key != None else None
+
+		this.definitions[name] = dfn
+
+		if cached != None:
+			dfn.body = cached
+			dfn.normalized = True
+		#
+		elif simplify and simplified != None:
+			dfn.body = simplified
+			dfn.normalized = True
+			if key != None:
+				this.cache.Put(key, dfn.body)
+		#
+		elif simplify and this.lazyDefinitions:
+			dfn.lazy = True
+			this.lazyQueue.append(dfn)
+		#
+		elif simplify:
+			try:
+				with this.limited(dfn.body):
+					dfn.body = engines.Reduce(dfn.body, execute=False)
+				#
+			except DefunctError_LimitExceeded:
+				if previous == None:
+					del this.definitions[name]
+				else:
+					this.definitions[name] = previous
+				raise
+			#
+			dfn.normalized = True
+			if key != None:
+				this.cache.Put(key, dfn.body)
+		#
+		if this.cache != None:
+			this.cache.Bind(name, key)
+
+		if this.packDefinitions:
+			dfn.body = Pack(dfn.body)
+		elif this.arena != None:
+			dfn.body = this.arena.Store(dfn.body)
+
+		IndexDefinition(dfn)
+		return dfn
+	#
+
+	def _TrimPrevious(this, previous):
+		"""Drops the definitions replaced by 'previous' which no lazy definition can still look up.
+		A lazy definition looks up what each name meant when it was defined (see reduction.NormalizeDefinition),
+		so the definitions replaced after the oldest lazy one are kept, and older ones are left to be freed.
+		Arguments:
+			previous: Def - the definition about to be replaced ('None' if there is none)
+		Returns:
+			bool - whether the new definition should link to 'previous' (there is a lazy definition left)
+		Changes:
+			lazyQueue (the definitions which have been simplified are dropped from the front)
+			the 'previous' of the newest definition replaced before the oldest lazy one (set to 'None')
+		"""
+		while this.lazyQueue and not this.lazyQueue[0].lazy:
+			this.lazyQueue.popleft()
+		if not this.lazyQueue:
+			return False
+
+		oldest = this.lazyQueue[0].order
+		while previous != None and previous.order > oldest:
+			previous = previous.previous
+		if previous != None:
+			previous.previous = None
+		return True
+	#
+
+	def DoExecute(this, sub, statementLimits=None):
+		"""Simplifies an expression and executes all primitive functions.
+		Must be called while this Interpreter is activated.
+		Arguments:
+			sub: Sub - the expression
+			statementLimits: limits.Limits - the most work it may do ('None' for this.limits)
+		Returns:
+			Sub - the simplified expression
+		Exceptions:
+			DefunctError_LimitExceeded - simplifying took too much work
+		"""
+		dprint ('EXECUTE    ' + SubToString(sub, sub), flush=True)
+		with this.limited(sub, statementLimits):
+			sub = engines.Reduce(sub, execute=True)
+		#
+		dprint ('Finally    ' + SubToString(sub, sub), flush=True)
+		return sub
+	#
+
+	def RunStatement(this, key, name, sub, location=(0,0), simplified=None):
+		"""Runs a statement read by Parser.DoEntry, and adds its profile to 'this.profile' if profiling.
+		Must be called while this Interpreter is activated.
+		Arguments:
+			key: str - the keyword of the statement
+			name: str - the definition name ('None' for 'do')
+			sub: Sub - the expression
+			location: (int, int) - where the statement starts
+			simplified: Sub - the expression of a 'def', already simplified (see DoDef)
+		"""
+		if this.profile == None:
+			this._RunStatement(key, name, sub, simplified)
+			return
+		#
+
+		record = { 'line': location[0], 'statement': DescribeStatement(key, name, sub) }
+		this.profile.append(record)
+		stats.Reset()
+		start = time.perf_counter()
+		try:
+			result = this._RunStatement(key, name, sub, simplified)
+		finally:
+			record['time'] = time.perf_counter() - start
+			record.update(stats.Measurement())
+		#
+		if 'peakMemory' in record:
+			record['nodes'] = CountNodes(result)
+	#
+
+	def _RunStatement(this, key, name, sub, simplified=None):
+		"""Runs a statement read by Parser.DoEntry (see RunStatement).
+		Returns:
+			Sub - the simplified expression ('do'), or the body of the new definition
+		"""
+		if key == keyword_Execute:
+			return this.DoExecute(sub)
+		else:
+			return this.DoDef(name, sub, simplify=(key == keyword_Define), simplified=simplified).body
+	#
+
+	#endregion
+	#region Limits
+
+	"""int - how many characters of a partially reduced expression are kept by 'limited'"""
+	limitedTermLength = 200
+
+	@contextmanager
+	def limited(this, sub, statementLimits=None):
+		"""Applies limits to simplifying an expression inside the 'with' block (see limits.Enforced).
+		Arguments:
+			sub: Sub - the expression being simplified (which the engine may change in place)
+			statementLimits: limits.Limits - 'None' for this.limits
+		Exceptions:
+			DefunctError_LimitExceeded - a limit was exceeded (its 'term' is the expression as far as it was simplified)
+		"""
+		depth = len(this.currentHierarchy)
+		try:
+			with limits.Enforced(statementLimits if statementLimits != None else this.limits):
+				yield
+			#
+		except DefunctError_LimitExceeded as e:
+			reduction.UnwindHierarchy(depth)
+			if e.term == None:
+				e.term = SubToString(sub, limit=this.limitedTermLength)
+			#
+			raise
+	#
+
+	def ReportLimit(this, error):
+		"""Writes the message of a statement which was stopped by a limit to the output.
+		Arguments:
+			error: DefunctError_LimitExceeded
+		"""
+		counts = error.counts
+		print ('\nLimitExceeded (line {0}): {1}\n(after {2} function applications, {3} copied nodes, {4:.3f} seconds)\nPartially reduced: {5}'.format(
+			error.location[0] if error.location != None else '?',
+			error,
+			counts['steps'],
+			counts['nodes'],
+			counts['seconds'],
+			error.term
+			), file=this.output, flush=True)
+	#
+
+	#endregion
+	#region Parallel Execution
+
+	def _LoadParallel(this, parser):
+		"""Runs every statement like 'load', but simplifies the 'def' statements and runs the 'do' statements in a pool of 'this.jobs' processes.
+		Every statement is read first, and the 'def' statements are simplified in a pool (see _SimplifyDefinitions).
+		The definitions are then made in order, in this process, as if the statements were run one after another.
+		Each 'do' statement remembers which definitions existed when it was read, and every worker receives
+		all of the definitions once (see _InitWorker).
+		The output of each 'do' statement is written in the same order as the statements.
+		Arguments:
+			parser: Parser - the source code
+		Exceptions:
+			DefunctError - a statement could not be read or run (the output of earlier statements has been written)
+		"""
+		"""list of Def - every definition which a 'do' statement may use"""
+		defs = list(this.definitions.values())
+		"""dictionary of
+			key: int - id of a Def
+			value: int - its position in 'defs'
+		"""
+		positions = { id(dfn): i for i, dfn in enumerate(defs) }
+		"""list of
+			(Sub, tuple of int, (int, int)) - a 'do' statement, the positions of the definitions it can see, and its location
+			(None, DefunctError, (int, int)) - a definition which failed: a limit is reported in order, any other error
+				is raised in order, once the output of the 'do' statements before it has been written
+		"""
+		tasks = []
+		"""list of dictionary - the profile of each 'do' statement, filled in when it has run ('None' if not profiling)"""
+		records = []
+		inputError = None
+
+		"""list of (str, str, Sub, (int, int)) - every statement: keyword, definition name, expression and location"""
+		statements = []
+		try:
+			for key, name, sub in parser.DoEntry():
+				statements.append((key, name, sub, parser.statementLocation))
+		except DefunctError_InputError as e:
+			inputError = e
+		#
+		simplified = this._SimplifyDefinitions(statements)
+
+		with this.activated():
+			for i, (key, name, sub, location) in enumerate(statements):
+				if key == keyword_Execute:
+					if this.profile != None:
+						record = { 'line': location[0], 'statement': DescribeStatement(key, name, sub) }
+						this.profile.append(record)
+						records.append(record)
+					#
+					tasks.append((sub, tuple(positions[id(dfn)] for dfn in this.definitions.values()), location))
+					continue
+				#
+
+				body, error, measurement = simplified.get(i, (None, None, None))
+				if error != None:
+					if this.profile != None:
+						this.profile.append(dict(measurement, line=location[0], statement=DescribeStatement(key, name, sub)))
+					tasks.append((None, error, location))
+					if type(error) != DefunctError_LimitExceeded:
+						break
+					continue
+				#
+				try:
+					this.RunStatement(key, name, sub, location, simplified=body)
+				except DefunctError_LimitExceeded as e:
+					# without the traceback, which keeps the expression which was being simplified
+					tasks.append((None, e.with_traceback(None), location))
+					continue
+				except DefunctError as e:
+					tasks.append((None, e, location))
+					break
+				#
+				if measurement != None and this.profile != None:
+					this.profile[-1].update(measurement)
+				dfn = this.definitions[name]
+				positions[id(dfn)] = len(defs)
+				defs.append(dfn)
+			#
+		#
+
+		if tasks:
+			with ProcessPoolExecutor(
+				max_workers=min(this.jobs, len(tasks)),
+				initializer=_InitWorker,
+				initargs=(defs, this.engine, this.packDefinitions, this.limits, this.printLength,
+					stats.measuringMemory, this.rewrite)
+			) as pool:
+				futures = [
+					pool.submit(_RunWorker, sub, defPositions) if sub != None else None
+					for sub, defPositions, location in tasks
+					]
+				for (sub, item, location), future in zip(tasks, futures):
+					if future == None:
+						error = item
+					else:
+						text, error, measurement = future.result()
+						if records:
+							records.pop(0).update(measurement)
+						print (text, end='', file=this.output, flush=True)
+					#
+					if type(error) == DefunctError_LimitExceeded:
+						error.location = location
+						this.ReportLimit(error)
+					elif error != None:
+						for f in futures:
+							if f != None:
+								f.cancel()
+						raise error
+				#
+			#
+		#
+
+		if inputError != None:
+			raise inputError
+	#
+
+	def _SimplifyDefinitions(this, statements):
+		"""Simplifies the bodies of the 'def' statements of a program in a pool of 'this.jobs' processes, in waves.
+		Each wave has every 'def' whose dependencies are finished: the definitions its body refers to by the names
+		of unbound ArgRefs, as they are bound at that statement, and the definitions their bodies refer to in turn.
+		Each body is simplified against exactly those definitions, so the results are the same as simplifying the
+		statements one after another (see DoDef).
+		Arguments:
+			statements: list of (str, str, Sub, (int, int)) - every statement (see _LoadParallel)
+		Returns:
+			dictionary of
+				key: int - the position of a 'def' statement in 'statements'
+				value: (Sub, DefunctError, dictionary) - the simplified body ('None' if it was stopped by the error),
+					the error ('None' if it finished), and its 'time' and counters (see Interpreter.profile)
+		"""
+		if this.lazyDefinitions:
+			return {}
+
+		"""dictionary of
+			key: str - a name
+			value: list of int - the positions of the 'def' and 'def_u' statements of that name, in order
+		"""
+		positions = {}
+		"""dictionary of
+			key: int - the position of a finished statement
+			value: Sub - its simplified body ('def'), or its body ('def_u')
+		"""
+		bodies = {}
+		"""set of int - the positions of the 'def' statements which are not finished yet, or which were stopped"""
+		pending = set()
+		failed = set()
+		results = {}
+
+		# bodies which can be found in the cache do not need to be simplified (see DoDef, which finds them again)
+		keys = dict(this.cache.keys) if this.cache != None else None
+		for i, (key, name, sub, location) in enumerate(statements):
+			if key == keyword_Execute:
+				continue
+			positions.setdefault(name, []).append(i)
+			if key != keyword_Define:
+				bodies[i] = sub
+				continue
+			#
+			if this.cache != None:
+				cacheKey = this.cache.Key(sub, True, this.engine, this.rewrite)
+				this.cache.Bind(name, cacheKey)
+				if cacheKey in this.cache.entries:
+					try:
+						bodies[i] = defcache.Decode(this.cache.entries[cacheKey])
+						continue
+					except (IndexError, ValueError, UnicodeDecodeError):
+						pass
+			#
+			pending.add(i)
+		#
+		if this.cache != None:
+			this.cache.keys = keys
+
+		def Binding(name, i):
+			"""Finds what a name refers to at a statement.
+			Returns:
+				int - the position of the statement which defines it
+				str - the name, if it refers to a definition made before the program
+				None - the name is not defined (a primitive, or an unbound name)
+			"""
+			names = positions.get(name, ())
+			j = bisect.bisect_left(names, i) - 1
+			while j >= 0:
+				if names[j] not in failed:
+					return names[j]
+				j -= 1
+			#
+			return name if name in this.definitions else None
+		#
+
+		"""dictionary of
+			key: int or str - see Binding
+			value: bytes or Sub - the body to send to a worker process (see _EncodeBody)
+		"""
+		encoded = {}
+
+		def Body(binding):
+			return bodies[binding] if type(binding) == int else CopySub(this.definitions[binding].body)
+		#
+
+		def Dependencies(i):
+			"""Finds the definitions which the body of a statement can reach.
+			Returns:
+				list of (str, bytes or Sub, bool) - the name, body, and whether it is simplified (see _SimplifyWorker)
+				None - one of them is not finished yet
+			"""
+			found = {}
+			todo = list(FreeNames(statements[i][2]))
+			while todo:
+				name = todo.pop()
+				if name in found:
+					continue
+				binding = found[name] = Binding(name, i)
+				if binding == None:
+					continue
+				if binding in pending:
+					return None
+				if binding not in encoded:
+					encoded[binding] = _EncodeBody(Body(binding))
+				todo.extend(FreeNames(bodies[binding] if type(binding) == int else this.definitions[binding].body))
+			#
+			return [
+				(name, encoded[binding],
+				  statements[binding][0] == keyword_Define if type(binding) == int else this.definitions[binding].normalized)
+				for name, binding in found.items() if binding != None
+				]
+		#
+
+		if not pending:
+			return results
+		with ProcessPoolExecutor(
+			max_workers=min(this.jobs, len(pending)),
+			initializer=_InitWorker,
+			initargs=([], this.engine, this.packDefinitions, this.limits, this.printLength,
+					stats.measuringMemory, this.rewrite)
+		) as pool:
+			while pending:
+				wave = []
+				for i in sorted(pending):
+					dependencies = Dependencies(i)
+					if dependencies != None:
+						wave.append((i, pool.submit(_SimplifyWorker, _EncodeBody(statements[i][2]), dependencies)))
+				#
+				for i, future in wave:
+					body, error, measurement = future.result()
+					pending.discard(i)
+					if error != None:
+						failed.add(i)
+						results[i] = (None, error, measurement)
+					else:
+						bodies[i] = _DecodeBody(body)
+						results[i] = (bodies[i], None, measurement)
+				#
+			#
+		#
+		return results
+	#
+
+	#endregion
+	#region Public
+
+	def load(this, source):
+		"""Runs a program: every 'def', 'def_u' and 'do' statement in it, in order.
+		Arguments:
+			source: str - the source code
+		Exceptions:
+			DefunctError_InputError - the source code could not be read (earlier statements have already run)
+		"""
+		parser = Parser(source)
+		if this.jobs > 1:
+			this._LoadParallel(parser)
+			return
+
+		with this.activated():
+			for key, name, sub in parser.DoEntry():
+				try:
+					this.RunStatement(key, name, sub, parser.statementLocation)
+				except DefunctError_LimitExceeded as e:
+					# the statement is abandoned, and the program continues with the next one
+					e.location = parser.statementLocation
+					this.ReportLimit(e)
+			#
+		#
+	#
+
+	def define(this, name, text, simplify=True):
+		"""Binds an expression to a name, like the 'def' statement (or 'def_u' if simplify is false).
+		Arguments:
+			name: str - the name of the definition
+			text: str - the source code of the expression
+			simplify: bool - should the expression be simplified before storing?
+		Returns:
+			Def - the new definition
+		Exceptions:
+			DefunctError_InputError - the name or the expression could not be read
+		"""
+		parser = Parser(name)
+		name = parser.Parse(parser.DoDefName)
+		parser = Parser(text)
+		body = parser.Parse(parser.DoSeries)
+		with this.activated():
+			return this.DoDef(name, body, simplify)
+	#
+
+	def evaluate(this, text, limits=None):
+		"""Simplifies an expression and executes all primitive functions, like the 'do' statement.
+		Arguments:
+			text: str - the source code of the expression
+			limits: limits.Limits - the most work it may do ('None' for this.limits)
+		Returns:
+			Sub - the simplified expression
+		Exceptions:
+			DefunctError_InputError - the expression could not be read
+			DefunctError_LimitExceeded - simplifying took too much work
+		"""
+		parser = Parser(text)
+		sub = parser.Parse(parser.DoSeries)
+		with this.activated():
+			return this.DoExecute(sub, limits)
+	#
+
+	def fork(this, output=None):
+		"""Creates an Interpreter which starts with this Interpreter's definitions and options.
+		Definitions made in either one afterwards are not seen by the other.
+		Arguments:
+			output: file object - where primitive actions like 'print' write to in the new Interpreter ('None' for sys.stdout)
+		Returns:
+			Interpreter - the new Interpreter (it does not use 'jobs', 'profile' or 'cache')
+		"""
+		child = Interpreter(
+			engine=this.engine,
+			packDefinitions=this.packDefinitions,
+			output=output,
+			limits=this.limits,
+			lazyDefinitions=this.lazyDefinitions,
+			printLength=this.printLength,
+			rewrite=this.rewrite
+			)
+		# the child stores its definitions in an arena of its own, which is freed with it, so that releasing it
+		# never changes an arena which another Interpreter is using (a daemon releases its sessions on another
+		# thread than the one running requests, see daemon.py), and the values it adds do not outlive it
+		child.arena = TermArena() if this.arena != None else None
+
+		# the Defs are shared, but never changed once they are defined (except by reduction.NormalizeDefinition, and
+		# _TrimPrevious, which only drops what no lazy definition of either Interpreter can look up)
+		child.definitions = dict(this.definitions)
+		child.lazyQueue = deque(this.lazyQueue)
+		child.indexedDefinitions = dict(this.indexedDefinitions)
+		child.definitionsByHash = { h: list(names) for h, names in this.definitionsByHash.items() }
+		child.simplifiedDefinitions = OrderedDict(this.simplifiedDefinitions)
+		return child
+	#
+
+	#endregion
+#
+
+#endregion
+#region Workers
+
+def _EncodeBody(sub):
+	"""Prepares an expression to be sent to or from a worker process, without using the Python call stack
+	where it can (see defcache.Encode).
+	Returns:
+		bytes, or Sub - the expression, if it cannot be encoded
+	"""
+	encoded = defcache.Encode(sub)
+	return encoded[0] if encoded != None else sub
+#
+
+def _DecodeBody(data):
+	"""Creates an expression sent by _EncodeBody."""
+	return defcache.Decode(data) if type(data) == bytes else data
+#
+
+"""Interpreter - the interpreter of this worker process (see Interpreter._LoadParallel)"""
+_worker = None
+
+"""list of Def - every definition sent to this worker process"""
+_workerDefs = None
+
+def _InitWorker(defs, engine, packDefinitions, limits, printLength, measureMemory=False, rewrite=False):
+	"""Prepares a worker process. Called once in each worker process.
+	Arguments:
+		defs: list of Def - every definition which a 'do' statement may use
+		engine: str - the name of the reduction engine
+		packDefinitions: bool - whether definition bodies are packed
+		limits: limits.Limits - the most work each statement may do
+		printLength: int - the most characters of an expression which 'print' writes
+		measureMemory: bool - whether the peak memory of each statement is measured (see stats.MeasureMemory)
+		rewrite: bool - whether statements are rewritten before they are simplified (see rewrite.py)
+	"""
+	global _worker
+	global _workerDefs
+
+	if measureMemory:
+		stats.MeasureMemory()
+
+	_worker = Interpreter(engine=engine, packDefinitions=packDefinitions, limits=limits, printLength=printLength,
+		rewrite=rewrite)
+	_workerDefs = defs
+#
+
+def _RunWorker(sub, defPositions):
+	"""Runs a 'do' statement in a worker process.
+	Arguments:
+		sub: Sub - the expression
+		defPositions: tuple of int - positions in '_workerDefs' of the definitions the statement can see, in order
+	Returns:
+		(str, DefunctError, dictionary) - the output of the statement, the error which stopped it ('None' if it finished),
+			and its 'time' and counters (see Interpreter.profile)
+	"""
+	# rebuild the definition tables without recomputing the hashes (see compareSubs.IndexDefinition)
+	_worker.definitions = {}
+	_worker.indexedDefinitions = {}
+	_worker.definitionsByHash = {}
+	for order, i in enumerate(defPositions):
+		dfn = _workerDefs[i]
+		_worker.definitions[dfn.name] = dfn
+		_worker.indexedDefinitions[dfn.name] = (order, dfn.hash)
+		_worker.definitionsByHash.setdefault(dfn.hash, []).append(dfn.name)
+	#
+
+	_worker.output = io.StringIO()
+	error = None
+	stats.Reset()
+	start = time.perf_counter()
+	try:
+		with _worker.activated():
+			sub = _worker.DoExecute(sub)
+		#
+	except DefunctError as e:
+		error = e
+	#
+	measurement = stats.Measurement()
+	measurement['time'] = time.perf_counter() - start
+	if error == None and 'peakMemory' in measurement:
+		measurement['nodes'] = CountNodes(sub)
+	return (_worker.output.getvalue(), error, measurement)
+#
+
+def _SimplifyWorker(body, dependencies):
+	"""Simplifies the body of a 'def' statement in a worker process (see Interpreter._SimplifyDefinitions).
+	Arguments:
+		body: bytes or Sub - the body (see _EncodeBody)
+		dependencies: list of (str, bytes or Sub, bool) - every definition the body can reach:
+			its name, its body, and whether the body was simplified when it was defined ('def', not 'def_u')
+	Returns:
+		(bytes or Sub, DefunctError, dictionary) - the simplified body ('None' if it was stopped by the error),
+			the error ('None' if it finished), and its 'time' and counters (see Interpreter.profile)
+	"""
+	_worker.definitions = {}
+	_worker.indexedDefinitions = {}
+	_worker.definitionsByHash = {}
+	_worker.simplifiedDefinitions = OrderedDict()
+	for name, data, normalized in dependencies:
+		dfn = Def(name=name, body=_DecodeBody(data))
+		dfn.normalized = normalized
+		dfn.references = FreeNames(dfn.body)
+		_worker.definitions[name] = dfn
+	#
+
+	sub = _DecodeBody(body)
+	result = None
+	error = None
+	stats.Reset()
+	start = time.perf_counter()
+	try:
+		with _worker.activated():
+			with _worker.limited(sub):
+				result = _EncodeBody(engines.Reduce(sub, execute=False))
+			#
+		#
+	except DefunctError as e:
+		error = e
+	#
+	measurement = stats.Measurement()
+	measurement['time'] = time.perf_counter() - start
+	return (result, error, measurement)
+#
+
+#endregion
@@ -0,0 +1,201 @@
+#region imports
+
+import gc
+import time
+from contextlib import contextmanager
+
+from structs import *
+import stats
+
+#endregion
+#region Limits
+
+"""NOTE:
+A diverging expression such as ([x. x x][x. x x]) never finishes simplifying.
+Limits stop a statement once it has done too much work, by raising DefunctError_LimitExceeded
+from inside the reduction engine.
+
+The engines only compare stats.betaReductions with 'checkpoint' (and stats.copiedNodes with
+'nodeCheckpoint') and call Check when it is passed, so no limits cost almost nothing.
+The clock is only read by Check, every 'clockInterval' function applications.
+
+The memory limit is checked against the bytes allocated by the whole program, traced by tracemalloc
+(see stats.AllocatedBytes), which Check reads every 'memoryInterval' function applications or copied nodes,
+since copying a large definition can use a lot of memory without applying any function. Tracing starts
+with the first statement which has a memory limit, if the program did not start it sooner (see stats.TraceMemory).
+Expressions refer to themselves (an ArgRef refers to its Func), so those of earlier statements are only
+freed by the garbage collector: it is run before a statement is stopped, in case the memory in use was only garbage.
+While memory is measured (see stats.MeasureMemory), Check is called every 'sampleInterval' function applications
+or copied nodes, with or without limits, to sample the expression nodes alive (see stats.SampleMemory).
+"""
+
+class Limits:
+	"""The most work a single statement may do. Each limit is 'None' for no limit."""
+	__slots__ = ('steps', 'nodes', 'seconds', 'memory')
+
+	def __init__(this, steps=None, nodes=None, seconds=None, memory=None):
+		"""
+		Arguments:
+			steps	: int - how many functions may be applied (beta reductions)
+			nodes	: int - how many nodes may be created by copying expressions
+			seconds	: float - how long the statement may take
+			memory	: float - how many megabytes the program may have allocated (see the NOTE above)
+		Exceptions:
+			DefunctError - a limit is not a positive number
+		"""
+		for name, value in (('steps', steps), ('nodes', nodes), ('seconds', seconds), ('memory', memory)):
+			if value != None and (type(value) not in (int, float) or value <= 0):
+				raise DefunctError("Limit of {0} must be a positive number, got '{1}'.".format(name, value))
+		#
+		this.steps = steps
+		this.nodes = nodes
+		this.seconds = seconds
+		this.memory = memory
+	#
+
+	def __bool__(this):
+		return this.steps != None or this.nodes != None or this.seconds != None or this.memory != None
+	#
+#
+
+"""int - how many function applications happen between readings of the clock"""
+clockInterval = 256
+
+"""int - how many copied nodes happen between readings of the clock (copying can take long with few applications)"""
+clockNodeInterval = 1 << 14
+
+"""int - how many function applications or copied nodes happen between readings of the memory in use"""
+memoryInterval = 1 << 14
+
+"""int - how many function applications or copied nodes happen between samples of the nodes alive, while measuring memory"""
+sampleInterval = 1 << 6
+
+"""int - bytes in a megabyte"""
+megabyte = 1 << 20
+
+"""Limits - the limits of the statement being simplified ('None' for no limits)"""
+current = None
+
+"""int or float - the value of stats.betaReductions above which Check must be called"""
+checkpoint = float('inf')
+
+"""int or float - the value of stats.copiedNodes above which Check must be called"""
+nodeCheckpoint = float('inf')
+
+"""The values of stats.betaReductions, stats.copiedNodes and time.perf_counter() when the statement started"""
+_start = (0, 0, 0.0)
+
+def Counts():
+	"""Gets the work done by the current statement so far.
+	Returns:
+		dictionary of 'steps', 'nodes' and 'seconds'
+	"""
+	return {
+		'steps': stats.betaReductions - _start[0],
+		'nodes': stats.copiedNodes - _start[1],
+		'seconds': time.perf_counter() - _start[2],
+		}
+#
+
+def Check():
+	"""Stops the current statement if it has exceeded a limit. Called by the engines when a checkpoint is passed.
+	Changes:
+		checkpoint, nodeCheckpoint
+		stats (the nodes alive are sampled, while measuring memory)
+	Exceptions:
+		DefunctError_LimitExceeded - a limit was exceeded
+	"""
+	global checkpoint
+	global nodeCheckpoint
+
+	if stats.measuringMemory:
+		stats.SampleMemory()
+	if current == None:
+		checkpoint = stats.betaReductions + sampleInterval
+		nodeCheckpoint = stats.copiedNodes + sampleInterval
+		return
+	#
+
+	counts = Counts()
+	if current.steps != None and counts['steps'] > current.steps:
+		raise DefunctError_LimitExceeded(
+			'Step limit exceeded: more than {0} function applications.'.format(current.steps), 'steps', counts)
+	if current.nodes != None and counts['nodes'] > current.nodes:
+		raise DefunctError_LimitExceeded(
+			'Node limit exceeded: more than {0} nodes copied.'.format(current.nodes), 'nodes', counts)
+	if current.seconds != None and counts['seconds'] > current.seconds:
+		raise DefunctError_LimitExceeded(
+			'Time limit exceeded: more than {0} seconds.'.format(current.seconds), 'seconds', counts)
+	if current.memory != None and stats.AllocatedBytes() > current.memory * megabyte:
+		gc.collect()
+		allocated = stats.AllocatedBytes()
+		if allocated > current.memory * megabyte:
+			raise DefunctError_LimitExceeded(
+				'Memory limit exceeded: {0:.1f} MB allocated, more than {1} MB.'.format(
+					allocated / megabyte, current.memory), 'memory', counts)
+	#
+
+	checkpoint = _start[0] + current.steps if current.steps != None else float('inf')
+	nodeCheckpoint = _NodeLimitCheckpoint()
+	if current.seconds != None:
+		checkpoint = min(checkpoint, stats.betaReductions + clockInterval)
+		nodeCheckpoint = min(nodeCheckpoint, stats.copiedNodes + clockNodeInterval)
+	if current.memory != None:
+		checkpoint = min(checkpoint, stats.betaReductions + memoryInterval)
+		nodeCheckpoint = min(nodeCheckpoint, stats.copiedNodes + memoryInterval)
+	if stats.measuringMemory:
+		checkpoint = min(checkpoint, stats.betaReductions + sampleInterval)
+		nodeCheckpoint = min(nodeCheckpoint, stats.copiedNodes + sampleInterval)
+#
+
+def _NodeLimitCheckpoint():
+	"""The value of stats.copiedNodes above which the current statement exceeds its node limit ('inf' for no limit)."""
+	return _start[1] + current.nodes if current.nodes != None else float('inf')
+#
+
+@contextmanager
+def Enforced(limits):
+	"""Applies limits to the statement simplified inside the 'with' block.
+	A RecursionError (an expression nested too deeply for Python) is also turned into DefunctError_LimitExceeded.
+	A memory limit starts tracing memory (see stats.TraceMemory), which goes on after the block.
+	Arguments:
+		limits: Limits - 'None' for no limits
+	Changes:
+		current, checkpoint, nodeCheckpoint (the previous values are restored afterwards)
+	Exceptions:
+		DefunctError_LimitExceeded - a limit was exceeded
+	"""
+	global current
+	global checkpoint
+	global nodeCheckpoint
+	global _start
+
+	previous = (current, checkpoint, nodeCheckpoint, _start)
+	current = limits if limits else None
+	_start = (stats.betaReductions, stats.copiedNodes, time.perf_counter())
+	if current != None:
+		checkpoint = stats.betaReductions
+		nodeCheckpoint = _NodeLimitCheckpoint()
+		if current.seconds != None:
+			nodeCheckpoint = min(nodeCheckpoint, _start[1] + clockNodeInterval)
+		if current.memory != None:
+			stats.TraceMemory()
+			nodeCheckpoint = min(nodeCheckpoint, _start[1] + memoryInterval)
+		if stats.measuringMemory:
+			nodeCheckpoint = min(nodeCheckpoint, _start[1] + sampleInterval)
+	elif stats.measuringMemory:
+		checkpoint = _start[0] + sampleInterval
+		nodeCheckpoint = _start[1] + sampleInterval
+	else:
+		checkpoint = nodeCheckpoint = float('inf')
+	#
+
+	try:
+		yield
+	except RecursionError:
+		raise DefunctError_LimitExceeded('Expression nested too deeply to simplify.', 'depth', Counts()) from None
+	finally:
+		current, checkpoint, nodeCheckpoint, _start = previous
+#
+
+#endregion
@@ -0,0 +1,681 @@
+#region imports
+
+from structs import *
+import globalvars
+from packedSubs import *
+import arena
+from numerals import Expand
+import primitiveActions
+import reduction
+import stats
+import limits
+
+#endregion
+#region Code
+
+"""NOTE:
+The machine does not walk Bracket, Func and ArgRef nodes directly.
+An expression is first compiled into Code nodes, where a reference to a bound argument is
+a de Bruijn index into an environment (0 for the nearest enclosing function, 1 for its parent...).
+Arguments are never substituted; they are stored in the environment as Closures instead.
+"""
+
+"""Code tags"""
+code_Func = 0		# function (argname, recursive, body)
+code_Bracket = 1	# application (left, right)
+code_Bound = 2		# reference to an enclosing function's argument (index)
+code_Unbound = 3	# reference to a definition or primitive by name (argname)
+code_Foreign = 4	# ArgRef linked to a Func outside of the compiled expression (ref)
+code_None = 5		# missing expression node
+
+class Code:
+	"""Represents a compiled expression node.
+	(Internal)
+	"""
+	__slots__ = ('tag', 'argname', 'recursive', 'body', 'left', 'right', 'index', 'ref', 'containsRecursive', 'frees', 'names', 'compiled')
+
+	def __init__(this, tag, argname=None, recursive=False, body=None, left=None, right=None, index=0, ref=None):
+		"""
+		Arguments:
+			tag		  : int - one of the code_... tags
+			argname	  : str - the argument name (code_Func, code_Bound) or definition name (code_Unbound)
+			recursive : bool - whether the function is recursive (code_Func)
+			body	  : Code - the function body (code_Func)
+			left	  : Code - the applied expression (code_Bracket)
+			right	  : Code - the parameter expression (code_Bracket)
+			index	  : int - the de Bruijn index (code_Bound)
+			ref		  : ArgRef - the original reference (code_Foreign)
+		"""
+		this.tag = tag
+		this.argname = argname
+		this.recursive = recursive
+		this.body = body
+		this.left = left
+		this.right = right
+		this.index = index
+		this.ref = ref
+
+		"""bool - whether a recursive Func occurs anywhere inside this node"""
+		this.containsRecursive = False
+		"""frozenset of int - de Bruijn indices referenced from inside this node, relative to this node"""
+		this.frees = frozenset()
+		"""frozenset of str - names of definitions or primitives referenced from inside this node"""
+		this.names = frozenset()
+		"""function - this node compiled into a Python closure by nbe.Compiled ('None' if not yet compiled)"""
+		this.compiled = None
+	#
+#
+
+def FuncCode(argname, recursive, body):
+	"""Creates the Code of a function from its compiled body."""
+	code = Code(code_Func, argname=argname, recursive=recursive, body=body)
+	code.containsRecursive = recursive or body.containsRecursive
+	code.frees = frozenset(i - 1 for i in body.frees if i > 0)
+	code.names = body.names
+	return code
+#
+
+def BracketCode(left, right):
+	"""Creates the Code of an application from its compiled sides."""
+	code = Code(code_Bracket, left=left, right=right)
+	code.containsRecursive = left.containsRecursive or right.containsRecursive
+	code.frees = left.frees | right.frees
+	code.names = left.names | right.names
+	return code
+#
+
+def Compile(sub):
+	"""Compiles an expression into Code, without using the Python call stack.
+	Arguments:
+		sub: Sub, PackedSub or arena.ArenaTerm - the expression to compile
+	Returns:
+		Code
+	"""
+	if arena.IsArena(sub):
+		sub = arena.Load(sub, counted=False)
+
+	"""dictionary of
+	key		: Func - a function enclosing the current node
+	value	: int - how many functions enclose that function
+	"""
+	depths = {}
+
+	"""stack of (Sub, bool) - nodes to visit, and whether their children have already been compiled"""
+	todo = [(sub, False)]
+
+	"""stack of Code - compiled children waiting for their parent"""
+	done = []
+
+	while todo:
+		node, visited = todo.pop()
+		T = type(node)
+
+		if T == Func:
+			if not visited:
+				depths[node] = len(depths)
+				todo.append((node, True))
+				todo.append((node.body, False))
+			else:
+				del depths[node]
+				done.append(FuncCode(node.argname, node.recursive, done.pop()))
+		#
+		elif T == Bracket:
+			if not visited:
+				todo.append((node, True))
+				todo.append((node.right, False))
+				todo.append((node.left, False))
+			else:
+				right = done.pop()
+				done.append(BracketCode(done.pop(), right))
+		#
+		elif T == ArgRef:
+			if node.func == None:
+				code = Code(code_Unbound, argname=node.argname)
+				code.names = frozenset((node.argname,))
+			elif node.func in depths:
+				code = Code(code_Bound, argname=node.argname, index=len(depths) - 1 - depths[node.func])
+				code.frees = frozenset((code.index,))
+			else:
+				code = Code(code_Foreign, ref=node)
+				code.containsRecursive = node.func.recursive
+			done.append(code)
+		#
+		elif T == PackedFunc or T == PackedBracket:
+			if not visited:
+				todo.append((node, True))
+				if T == PackedFunc:
+					todo.append((node.body, False))
+				else:
+					todo.append((node.right, False))
+					todo.append((node.left, False))
+			#
+			elif T == PackedFunc:
+				done.append(FuncCode(node.argname, node.recursive, done.pop()))
+			else:
+				right = done.pop()
+				done.append(BracketCode(done.pop(), right))
+		#
+		elif T == PackedArgRef:
+			if node.index == None:
+				code = Code(code_Unbound, argname=node.argname)
+				code.names = frozenset((node.argname,))
+			else:
+				code = Code(code_Bound, argname=node.argname, index=node.index)
+				code.frees = frozenset((node.index,))
+			done.append(code)
+		#
+		elif T == PackedForeignRef:
+			code = Code(code_Foreign, ref=node.ref)
+			code.containsRecursive = node.ref.func.recursive
+			done.append(code)
+		#
+		elif T == Numeral:
+			todo.append((Expand(node), False))
+		#
+		else:
+			done.append(Code(code_None))
+	#
+	return done.pop()
+#
+
+"""dictionary of
+	key: str - name of the definition
+	value: (Def, Sub, Code) - the definition, the body that was compiled, and the compiled body
+"""
+_compiledDefinitions = {}
+
+def DefinitionCode(name):
+	"""Returns the compiled body of a definition, compiling it only if the definition has changed.
+	Arguments:
+		name: str - the name of the definition
+	Returns:
+		Code
+	"""
+	dfn = globalvars.definitions[name]
+	if dfn.lazy:
+		reduction.NormalizeDefinition(dfn)
+	try:
+		cachedDfn, cachedBody, code = _compiledDefinitions[name]
+		if cachedDfn is dfn and cachedBody is dfn.body:
+			return code
+	except KeyError:
+		pass
+
+	code = Compile(dfn.body)
+	_compiledDefinitions[name] = (dfn, dfn.body, code)
+	return code
+#
+
+#endregion
+#region Closures
+
+class Closure:
+	"""Represents an unevaluated expression paired with the environment it was found in.
+	(Internal)
+	"""
+	__slots__ = ('code', 'env', 'ground', 'normal', 'value')
+
+	def __init__(this, code, env):
+		"""
+		Arguments:
+			code : Code - the expression
+			env	 : tuple(value, env) - linked list of argument values, nearest first
+					value: Closure - the argument passed in to a function
+						   Func    - a function argument which has no value (during simplification of a function body)
+		"""
+		this.code = code
+		this.env = env
+
+		"""bool - cached result of IsGround ('None' if not yet known)"""
+		this.ground = None
+
+		"""Sub - the simplified expression, shared by every reference to this closure (sharing mode only, 'None' if not yet known)"""
+		this.normal = None
+
+		"""the value of the expression, once it has been evaluated by nbe.Force ('None' if not yet evaluated)"""
+		this.value = None
+	#
+#
+
+def Lookup(env, index):
+	"""Returns the value at a de Bruijn index in an environment."""
+	for _ in range(index):
+		env = env[1]
+	return env[0]
+#
+
+def DefinitionIsGround(name):
+	"""Whether a definition's body (and every definition it refers to) contains no recursive Func.
+	Arguments:
+		name: str - the name of the definition
+	Returns:
+		bool - True if the name is not a definition
+	"""
+	visited = set()
+	todo = [name]
+	while todo:
+		name = todo.pop()
+		if name in visited or name not in globalvars.definitions:
+			continue
+		visited.add(name)
+
+		code = DefinitionCode(name)
+		if code.containsRecursive:
+			return False
+		todo.extend(code.names)
+	#
+	return True
+#
+
+def IsGround(closure):
+	"""Whether a closure contains no recursive Func, and no reference to a function argument without a value.
+	This is the machine's equivalent of 'not sub.containsRecursive'.
+	Arguments:
+		closure: Closure
+	Returns:
+		bool
+	"""
+	todo = [closure]
+	waitingOn = set()
+	while todo:
+		c = todo[-1]
+		if c.ground != None:
+			todo.pop()
+			continue
+		#
+		waitingOn.add(c)
+
+		code = c.code
+		if code.containsRecursive or not all(DefinitionIsGround(name) for name in code.names):
+			c.ground = False
+			todo.pop()
+			continue
+		#
+
+		ground = True
+		waiting = False
+		for index in code.frees:
+			value = Lookup(c.env, index)
+			if type(value) != Closure or value.ground == False:
+				ground = False
+				break
+			elif value.ground == None and value not in waitingOn:
+				# (a closure which is already being checked counts as ground)
+				todo.append(value)
+				waiting = True
+		#
+		if not ground:
+			c.ground = False
+			todo.pop()
+		elif not waiting:
+			c.ground = True
+			todo.pop()
+	#
+	return closure.ground
+#
+
+def IsRecursive(closure):
+	"""Whether a closure can be considered recursive.
+	This is the machine's equivalent of 'sub.recursive'.
+	Arguments:
+		closure: Closure
+	Returns:
+		bool
+	"""
+	todo = [(closure.code, closure.env)]
+	while todo:
+		code, env = todo.pop()
+		T = code.tag
+
+		if T == code_Func:
+			if not code.recursive:
+				return False
+		#
+		elif T == code_Bracket:
+			todo.append((code.left, env))
+			todo.append((code.right, env))
+		#
+		elif T == code_Bound:
+			value = Lookup(env, code.index)
+			if type(value) == Closure:
+				todo.append((value.code, value.env))
+			elif not value.recursive:
+				return False
+		#
+		elif T == code_Unbound:
+			if code.argname not in globalvars.definitions:
+				return False
+			todo.append((DefinitionCode(code.argname), None))
+		#
+		elif T == code_Foreign:
+			if not code.ref.func.recursive:
+				return False
+	#
+	return True
+#
+
+def CanApplyRecursive(stack):
+	"""Whether a recursive function can be applied to the arguments on top of the stack.
+	Mirrors SimplifyBracket: the parameter must not contain anything recursive,
+	unless the parameter is itself recursive and the next parameter does not contain anything recursive.
+	Arguments:
+		stack: list(Closure) - argument stack, next argument last
+	Returns:
+		bool
+	"""
+	if IsGround(stack[-1]):
+		return True
+	return len(stack) > 1 and IsRecursive(stack[-1]) and IsGround(stack[-2])
+#
+
+#endregion
+#region Primitives
+
+"""NOTE:
+reduction.Simplify simplifies the function and the parameter of an application before applying it, so the
+primitives in a 'do' statement are executed from left to right, even in a parameter which is then discarded.
+The machine only simplifies what is needed, in normal order, so it would execute them in another order
+(or not at all). They are executed in the same order only while each primitive is at the head of
+the expression: its parameter is simplified first, then the identity it returns is applied to the rest.
+"""
+
+def Executes(names):
+	"""Whether any of some names, or a definition they refer to, is a primitive which would be executed.
+	Arguments:
+		names: iterable of str - names of definitions or primitives (like Code.names, or compareSubs.FreeNames)
+	Returns:
+		bool
+	"""
+	visited = set()
+	todo = list(names)
+	while todo:
+		name = todo.pop()
+		if name in visited:
+			continue
+		visited.add(name)
+
+		if name in globalvars.definitions:
+			todo.extend(DefinitionCode(name).names)
+		elif name in primitiveActions.names:
+			return True
+	#
+	return False
+#
+
+def ExecutesOutOfOrder(code):
+	"""Whether the machine could execute the primitives in an expression in another order than
+	reduction.Simplify (see the NOTE above): some primitive is not at the head of the expression,
+	of a primitive's parameter, or of what follows the identity returned by a primitive.
+	Arguments:
+		code: Code - the compiled expression
+	Returns:
+		bool
+	"""
+	todo = [code]
+	while todo:
+		code = todo.pop()
+		args = []
+		while code != None:
+			while code.tag == code_Bracket:
+				args.append(code.right)
+				code = code.left
+			#
+			if (args and code.tag == code_Unbound and code.argname not in globalvars.definitions
+				and code.argname in primitiveActions.names):
+				todo.append(args.pop())
+			elif not (args and code.tag == code_Func and not code.recursive
+				and code.body.tag == code_Bound and code.body.index == 0):
+				break
+			code = args.pop() if args else None
+		#
+		if code != None and (Executes(code.names) or any(Executes(arg.names) for arg in args)):
+			return True
+	#
+	return False
+#
+
+#endregion
+#region Machine
+
+"""Continuation frame tags"""
+frame_Func = 0			# (frame_Func, func) - the body of 'func' is being simplified
+frame_Series = 1		# [frame_Series, left, arguments] - simplifying the arguments of a stuck application
+frame_Primitive = 2		# (frame_Primitive, name, arguments) - simplifying the parameter of a primitive function
+frame_Share = 3			# (frame_Share, closure) - simplifying a closure whose result will be shared
+
+"""Placeholder for the left side of a stuck application whose head has not been simplified yet."""
+_headPending = object()
+
+"""Placeholder result, meaning the next argument of the innermost stuck application should be simplified."""
+_nextArgument = object()
+
+class Update:
+	"""Marker on the argument stack (sharing mode only).
+	When the closure below it reaches a function, the closure is overwritten with that function,
+	so the work is not repeated by other references to the same closure.
+	(Internal)
+	"""
+	__slots__ = ('closure',)
+
+	def __init__(this, closure):
+		this.closure = closure
+	#
+#
+
+def Arguments(stack):
+	"""Returns the arguments on a stack without any Update markers (which can no longer be used)."""
+	return [c for c in stack if type(c) != Update]
+#
+
+def Reduce(sub, execute=False, sharing=False):
+	"""Simplifies an expression using an explicit-stack environment machine.
+	Produces the same result as reduction.Simplify, but the Python call stack does not grow
+	with the depth of the expression or the number of reduction steps.
+	An expression which the machine would execute in a different order (see ExecutesOutOfOrder)
+	is simplified by reduction.Simplify instead, so that it prints the same.
+	Arguments:
+		sub: Sub - the expression to simplify
+		execute: bool - if true, will execute primitive functions like 'print'
+		sharing: bool - if true, arguments are evaluated at most once (call-by-need),
+			and every reference to an argument shares the result
+	Returns:
+		Sub - the expression which is as simplified as possible
+	"""
+	code = Compile(sub)
+	if execute and ExecutesOutOfOrder(code):
+		return reduction.Simplify(sub, execute)
+	return Run(code, None, execute, sharing)
+#
+
+def Run(code, env, execute=False, sharing=False):
+	"""Simplifies compiled code in an environment.
+	Arguments:
+		code: Code - the expression to simplify
+		env: tuple(value, env) - the environment of the expression
+		execute: bool - if true, will execute primitive functions like 'print'
+		sharing: bool - if true, update closures with their results (see Reduce)
+	Returns:
+		Sub - the simplified expression
+	"""
+	"""list - continuation frames, innermost last"""
+	frames = []
+
+	"""list(Closure or Update) - arguments waiting to be applied to the current expression, next argument last"""
+	stack = []
+
+	"""int - functions applied so far (added to stats.betaReductions at the end)"""
+	betas = 0
+
+	"""int or float - the value of 'betas' above which limits.Check must be called"""
+	checkpoint = limits.checkpoint - stats.betaReductions
+
+	while True:
+		#region find the head of the current expression
+		T = code.tag
+
+		if T == code_Bracket:
+			right = code.right
+			if right.tag == code_Bound:
+				# pass the argument's value on directly, instead of a closure which refers to it
+				value = Lookup(env, right.index)
+				if type(value) == Closure:
+					stack.append(value)
+					code = code.left
+					continue
+			#
+			stack.append(Closure(right, env))
+			code = code.left
+			continue
+		#
+		elif T == code_Bound:
+			value = Lookup(env, code.index)
+			if type(value) == Closure:
+				if sharing and value.code.tag != code_Func:
+					stack.append(Update(value))
+				code = value.code
+				env = value.env
+				continue
+			#
+			head = ArgRef(argname=code.argname, func=value)
+		#
+		elif T == code_Func:
+			while stack and type(stack[-1]) == Update:
+				closure = stack.pop().closure
+				closure.code = code
+				closure.env = env
+			#
+			if stack:
+				if code.recursive and len(stack) > 1 and type(stack[-2]) == Update:
+					# the next parameter is needed to decide, so the closures in between cannot be updated
+					stack[:-1] = Arguments(stack[:-1])
+				#
+				if not code.recursive or CanApplyRecursive(stack):
+					betas += 1
+					if betas > checkpoint:
+						stats.betaReductions += betas
+						betas = 0
+						limits.Check()
+						checkpoint = limits.checkpoint - stats.betaReductions
+					#
+					env = (stack.pop(), env)
+					code = code.body
+					continue
+				#
+				# stuck recursive application: simplify the function itself, then its arguments
+				frames.append([frame_Series, _headPending, Arguments(stack)])
+				stack = []
+				continue
+			#
+			func = Func(argname=code.argname, recursive=code.recursive)
+			frames.append((frame_Func, func))
+			env = (func, env)
+			code = code.body
+			continue
+		#
+		elif T == code_Unbound:
+			name = code.argname
+			if name in globalvars.definitions:
+				stats.definitionExpansions += 1
+				stats.expandedDefinitions[name] = stats.expandedDefinitions.get(name, 0) + 1
+				code = DefinitionCode(name)
+				env = None
+				continue
+			#
+			if sharing:
+				stack = Arguments(stack)
+			if execute and stack and name in primitiveActions.names:
+				argument = stack.pop()
+				frames.append((frame_Primitive, name, stack))
+				stack = []
+				code = argument.code
+				env = argument.env
+				continue
+			#
+			head = ArgRef(argname=name)
+		#
+		elif T == code_Foreign:
+			head = ArgRef(argname=code.ref.argname, func=code.ref.func)
+		#
+		else:
+			head = None
+		#endregion
+		#region stuck application: simplify the arguments one at a time
+
+		if sharing:
+			stack = Arguments(stack)
+		if stack:
+			frames.append([frame_Series, head, stack])
+			stack = []
+			value = _nextArgument
+		else:
+			value = head
+		#
+
+		#endregion
+		#region deliver the simplified expression to the enclosing frames
+
+		while True:
+			if value is _nextArgument:
+				# start simplifying the next argument of the innermost stuck application
+				argument = frames[-1][2].pop()
+				if argument.normal != None:
+					value = argument.normal
+				else:
+					if sharing:
+						frames.append((frame_Share, argument))
+					code = argument.code
+					env = argument.env
+					break
+			#
+
+			if not frames:
+				stats.betaReductions += betas
+				return value
+
+			frame = frames.pop()
+			kind = frame[0]
+
+			if kind == frame_Func:
+				func = frame[1]
+				func.body = value
+				func.Update()
+				value = func
+			#
+			elif kind == frame_Series:
+				if frame[1] is _headPending:
+					frame[1] = value
+				else:
+					frame[1] = Bracket(left=frame[1], right=value)
+
+				if frame[2]:
+					frames.append(frame)
+					value = _nextArgument
+				else:
+					value = frame[1]
+			#
+			elif kind == frame_Primitive:
+				value = primitiveActions.names[frame[1]](value)
+				stack = frame[2]
+				if stack and primitiveActions.DropsIdentity(value):
+					# continue with the next argument, as a reference to the identity's argument would
+					argument = stack.pop()
+					if sharing and argument.code.tag != code_Func:
+						stack.append(Update(argument))
+					code = argument.code
+					env = argument.env
+				else:
+					code = Compile(value)
+					env = None
+				break
+			#
+			elif kind == frame_Share:
+				# only a closure without free arguments has the same result everywhere it is referenced
+				if IsGround(frame[1]):
+					frame[1].normal = value
+		#
+
+		#endregion
+	#
+#
+
+#endregion
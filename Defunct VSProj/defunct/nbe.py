@@ -0,0 +1,406 @@
+#region imports
+
+from structs import *
+import globalvars
+import primitiveActions
+import numerals
+import stats
+import limits
+import reduction
+import machine
+from machine import Closure, Lookup, CanApplyRecursive, DefinitionCode
+from machine import code_Func, code_Bracket, code_Bound, code_Unbound, code_Foreign, code_None
+
+#endregion
+#region Values
+
+"""NOTE:
+Normalization by evaluation. Each Code node (see machine.Compile) is compiled once into a Python closure,
+which evaluates the node in an environment of machine.Closures. An argument is only evaluated when it is
+needed, and then only once (see Force). A function is applied by running the closure of its body in a new
+environment, so nothing is substituted or copied.
+
+The result of an evaluation is a value (Lam, Neutral or Stuck), which is only read back into Bracket, Func
+and ArgRef nodes when the statement is finished, or when a primitive like 'print' needs its parameter
+(see Readback).
+
+The compiled closures are kept on the Code nodes, and machine.DefinitionCode keeps the Code of each
+definition until it is redefined, so a definition is compiled once and reused by every statement.
+"""
+
+class Lam:
+	"""Represents a function: the Code of a Func paired with the environment it was found in.
+	(Internal)
+	"""
+	__slots__ = ('code', 'env')
+
+	def __init__(this, code, env):
+		"""
+		Arguments:
+			code : Code - the function (code_Func)
+			env	 : tuple(value, env) - the environment of the function (see machine.Closure)
+		"""
+		this.code = code
+		this.env = env
+	#
+#
+
+class Neutral:
+	"""Represents an application which cannot be evaluated any further, because its head is
+	a function argument with no value, an undefined name, or a primitive which is not executed.
+	(Internal)
+	"""
+	__slots__ = ('head', 'args')
+
+	def __init__(this, head, args):
+		"""
+		Arguments:
+			head : ArgRef - the head of the application ('None' for a missing expression node)
+			args : list(Closure) - the arguments applied to the head, first argument first
+		"""
+		this.head = head
+		this.args = args
+	#
+#
+
+class Stuck:
+	"""Represents a recursive function applied to arguments which it cannot be applied to yet
+	(see machine.CanApplyRecursive). It is tried again if more arguments are applied to it.
+	(Internal)
+	"""
+	__slots__ = ('lam', 'args')
+
+	def __init__(this, lam, args):
+		"""
+		Arguments:
+			lam	 : Lam - the recursive function
+			args : list(Closure) - the arguments applied to the function, next argument last
+		"""
+		this.lam = lam
+		this.args = args
+	#
+#
+
+#endregion
+#region Compiling
+
+"""NOTE:
+A compiled closure is called as closure(env, stack), where 'stack' holds the arguments applied to the node
+(next argument last, like machine.Run). It either returns the value of the node applied to the whole stack,
+or a (Code, env) pair to continue with, so that Eval can run a chain of applications in a loop
+instead of on the Python call stack.
+"""
+
+def CompileFunc(code):
+	"""Compiles a function. Applies it to the next argument, if it can be applied."""
+	body = code.body
+	if code.recursive:
+		def run(env, stack):
+			if not stack:
+				return Lam(code, env)
+			if not CanApplyRecursive(stack):
+				return Stuck(Lam(code, env), stack[:])
+
+			stats.betaReductions += 1
+			if stats.betaReductions > limits.checkpoint:
+				limits.Check()
+			return (body, (stack.pop(), env))
+		#
+	else:
+		def run(env, stack):
+			if not stack:
+				return Lam(code, env)
+
+			stats.betaReductions += 1
+			if stats.betaReductions > limits.checkpoint:
+				limits.Check()
+			return (body, (stack.pop(), env))
+		#
+	return run
+#
+
+def CompileBracket(code):
+	"""Compiles an application. Pushes its parameter onto the stack."""
+	left = code.left
+	right = code.right
+	if right.tag == code_Bound:
+		index = right.index
+		def run(env, stack):
+			# pass the argument's value on directly, instead of a closure which refers to it
+			value = Lookup(env, index)
+			stack.append(value if type(value) == Closure else Closure(right, env))
+			return (left, env)
+		#
+	else:
+		def run(env, stack):
+			stack.append(Closure(right, env))
+			return (left, env)
+		#
+	return run
+#
+
+def CompileBound(code):
+	"""Compiles a reference to an enclosing function's argument. Evaluates the argument."""
+	index = code.index
+	argname = code.argname
+	def run(env, stack):
+		value = Lookup(env, index)
+		if type(value) == Closure:
+			return Apply(Force(value), stack)
+		return Neutral(ArgRef(argname=argname, func=value), stack[::-1])
+	#
+	return run
+#
+
+def CompileUnbound(code):
+	"""Compiles a reference to a definition or primitive."""
+	name = code.argname
+	def run(env, stack):
+		if name in globalvars.definitions:
+			stats.definitionExpansions += 1
+			stats.expandedDefinitions[name] = stats.expandedDefinitions.get(name, 0) + 1
+			return (Compiled(DefinitionCode(name)), None)
+		#
+		return Apply(Neutral(ArgRef(argname=name), []), stack)
+	#
+	return run
+#
+
+def CompileForeign(code):
+	"""Compiles a reference to a Func outside of the compiled expression."""
+	ref = code.ref
+	def run(env, stack):
+		return Neutral(ArgRef(argname=ref.argname, func=ref.func), stack[::-1])
+	#
+	return run
+#
+
+def CompileNone(code):
+	"""Compiles a missing expression node."""
+	def run(env, stack):
+		return Neutral(None, stack[::-1])
+	#
+	return run
+#
+
+"""List of the function which compiles each Code tag.
+	function(code: Code) -> function(env, stack)
+"""
+compilers = {
+	code_Func: CompileFunc,
+	code_Bracket: CompileBracket,
+	code_Bound: CompileBound,
+	code_Unbound: CompileUnbound,
+	code_Foreign: CompileForeign,
+	code_None: CompileNone,
+}
+
+def Compiled(code):
+	"""Compiles every node of some Code which is not compiled yet, without using the Python call stack.
+	Arguments:
+		code: Code
+	Returns:
+		Code - the 'code' parameter
+	Changes:
+		the 'compiled' closure of each node
+	"""
+	todo = [code]
+	while todo:
+		node = todo.pop()
+		if node.compiled != None:
+			continue
+		node.compiled = compilers[node.tag](node)
+		if node.tag == code_Func:
+			todo.append(node.body)
+		elif node.tag == code_Bracket:
+			todo.append(node.left)
+			todo.append(node.right)
+	#
+	return code
+#
+
+#endregion
+#region Evaluation
+
+"""bool - whether primitive functions are executed by the current evaluation (see Reduce)"""
+_execute = False
+
+def Eval(code, env, stack):
+	"""Evaluates compiled code applied to some arguments, until it is a function or cannot be evaluated any further.
+	Arguments:
+		code: Code - the compiled expression
+		env: tuple(value, env) - the environment of the expression
+		stack: list(Closure) - the arguments applied to the expression, next argument last
+	Returns:
+		Lam, Neutral or Stuck
+	"""
+	while True:
+		result = code.compiled(env, stack)
+		if type(result) != tuple:
+			return result
+		code, env = result
+	#
+#
+
+def Force(closure):
+	"""Evaluates an argument, or returns its value if it has already been evaluated.
+	Arguments:
+		closure: Closure
+	Returns:
+		Lam, Neutral or Stuck
+	Changes:
+		closure.value
+	"""
+	if closure.value == None:
+		closure.value = Eval(closure.code, closure.env, [])
+	return closure.value
+#
+
+def Apply(value, stack):
+	"""Applies a value to the arguments on a stack.
+	Arguments:
+		value: Lam, Neutral or Stuck
+		stack: list(Closure) - the arguments, next argument last
+	Returns:
+		the result of the application, or a (Code, env) pair to continue with (see Eval)
+	"""
+	if not stack:
+		return value
+
+	T = type(value)
+	if T == Lam:
+		return value.code.compiled(value.env, stack)
+	#
+	elif T == Stuck:
+		stack.extend(value.args)
+		return value.lam.code.compiled(value.lam.env, stack)
+	#
+
+	head = value.head
+	if (_execute and not value.args and head != None and head.func == None
+	  and head.argname in primitiveActions.names):
+		result = primitiveActions.names[head.argname](Readback(Force(stack.pop())))
+		if stack and primitiveActions.DropsIdentity(result):
+			# continue with the next argument (in Eval, so that a series of 'print's does not use the Python stack)
+			closure = stack.pop()
+			if closure.value != None:
+				return Apply(closure.value, stack)
+			return (closure.code, closure.env)
+		#
+		return (Compiled(machine.Compile(result)), None)
+	#
+	return Neutral(head, value.args + stack[::-1])
+#
+
+#endregion
+#region Reading Back
+
+"""Readback frame tags"""
+frame_Func = 0			# (frame_Func, func) - the body of 'func' is being read back
+frame_Series = 1		# [frame_Series, left, arguments] - reading back the arguments of an application
+
+"""Placeholder for the left side of an application whose head has not been read back yet."""
+_headPending = object()
+
+def Readback(value):
+	"""Reads a value back into an expression, evaluating the body of each function and each argument.
+	Does not use the Python call stack.
+	Arguments:
+		value: Lam, Neutral or Stuck
+	Returns:
+		Sub - the simplified expression
+	"""
+	"""list - frames of the expressions being read back, innermost last"""
+	frames = []
+
+	"""int - references read back since limits.Check was last called. Reading back can build a large expression
+	without applying any function, so the memory limit is checked every limits.memoryInterval references.
+	"""
+	refs = 0
+
+	while True:
+		#region find the head of the value
+		T = type(value)
+
+		if T == Lam:
+			code = value.code
+			func = Func(argname=code.argname, recursive=code.recursive)
+			frames.append((frame_Func, func))
+			value = Eval(code.body, (func, value.env), [])
+			continue
+		#
+		elif T == Stuck:
+			frames.append([frame_Series, _headPending, value.args[:]])
+			value = value.lam
+			continue
+		#
+
+		head = value.head
+		sub = None if head == None else ArgRef(argname=head.argname, func=head.func)
+		refs += 1
+		if refs > limits.memoryInterval and limits.current != None:
+			refs = 0
+			limits.Check()
+		#
+		if value.args:
+			frames.append([frame_Series, sub, value.args[::-1]])
+			value = Force(frames[-1][2].pop())
+			continue
+		#
+		#endregion
+		#region deliver the expression to the enclosing frames
+
+		while frames:
+			frame = frames[-1]
+			if frame[0] == frame_Func:
+				frames.pop()
+				func = frame[1]
+				func.body = sub
+				func.Update()
+				sub = numerals.Recognize(func) or func
+			#
+			else:
+				frame[1] = sub if frame[1] is _headPending else Bracket(left=frame[1], right=sub)
+				if frame[2]:
+					value = Force(frame[2].pop())
+					break
+				frames.pop()
+				sub = frame[1]
+			#
+		#
+		else:
+			return sub
+		#endregion
+	#
+#
+
+#endregion
+#region Reduce
+
+def Reduce(sub, execute=False):
+	"""Simplifies an expression by evaluating it, then reading the result back.
+	Produces the same result as machine.Reduce, and likewise simplifies an expression which it would execute
+	in a different order with reduction.Simplify instead (see machine.ExecutesOutOfOrder).
+	Arguments:
+		sub: Sub - the expression to simplify
+		execute: bool - if true, will execute primitive functions like 'print'
+	Returns:
+		Sub - the expression which is as simplified as possible
+	Changes:
+		_execute (the previous value is restored afterwards)
+	"""
+	global _execute
+
+	code = machine.Compile(sub)
+	if execute and machine.ExecutesOutOfOrder(code):
+		return reduction.Simplify(sub, execute)
+
+	previous = _execute
+	_execute = execute
+	try:
+		return Readback(Eval(Compiled(code), None, []))
+	finally:
+		_execute = previous
+#
+
+#endregion
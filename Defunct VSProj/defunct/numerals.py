@@ -0,0 +1,231 @@
+#region imports
+
+from structs import *
+
+#endregion
+#region Numerals
+
+"""NOTE:
+A Church numeral n is the function [f x. f(f(...f(x)))] which applies 'f' to 'x' n times.
+Written out, it takes O(n) nodes, and adding or multiplying numerals takes many beta reductions.
+
+reduction.Simplify replaces every function with this shape by a Numeral node (see Recognize).
+A Numeral is never changed after it is created, so it can be shared instead of copied.
+Arithmetic is done directly on Numerals when a function which is identical to one of the
+known CN operators (successor, add, mul, eq0) is applied to them (see Apply and Operator).
+Anything else that applies a Numeral gets its expanded function instead (see Expand).
+"""
+
+def Expand(numeral):
+	"""Creates the function which a Numeral represents.
+	Arguments:
+		numeral: Numeral
+	Returns:
+		Func - [f x. f(f(...f(x)))]
+	"""
+	f = Func(argname=numeral.fname)
+	x = Func(argname=numeral.xname)
+	f.body = x
+
+	body = ArgRef(argname=x.argname, func=x)
+	for i in range(numeral.value):
+		body = Bracket(left=ArgRef(argname=f.argname, func=f), right=body)
+	x.body = body
+	x.Update()
+	f.Update()
+	return f
+#
+
+def Recognize(func):
+	"""Finds the Numeral which a function is identical to.
+	Arguments:
+		func: Sub - a simplified expression
+	Returns:
+		Numeral - func has the shape [f x. f(f(...f(x)))]
+		None    - func is not a Church numeral
+	"""
+	if type(func) != Func or func.recursive:
+		return None
+	inner = func.body
+	if type(inner) != Func or inner.recursive:
+		return None
+
+	value = 0
+	body = inner.body
+	while type(body) == Bracket and type(body.left) == ArgRef and body.left.func is func:
+		value += 1
+		body = body.right
+	#
+	if type(body) == ArgRef and body.func is inner:
+		return Numeral(value, func.argname, inner.argname)
+	return None
+#
+
+def true(yname='y', xname='x'):
+	"""Creates the function [y x. y]."""
+	f = Func(argname=yname, body=Func(argname=xname))
+	f.body.body = ArgRef(argname=yname, func=f)
+	f.body.Update()
+	f.Update()
+	return f
+#
+
+#endregion
+#region Known Operators
+
+"""NOTE:
+Operators are described by patterns of nested tuples, where a reference to an argument is
+a de Bruijn index (0 for the nearest enclosing function, 1 for its parent...):
+	(tag_Func, body)
+	(tag_Bracket, left, right)
+	(tag_ArgRef, index)
+	(tag_Numeral, value)
+The patterns are the simplified bodies of the definitions in examples/example02.txt.
+"""
+
+def _Func(body):
+	return (tag_Func, body)
+def _Bracket(left, *rights):
+	for right in rights:
+		left = (tag_Bracket, left, right)
+	return left
+def _Ref(index):
+	return (tag_ArgRef, index)
+def _Numeral(value):
+	return (tag_Numeral, value)
+
+""" ++  = [w y x. y(w y x)] """
+successor = _Func(_Func(_Func(_Bracket(_Ref(1), _Bracket(_Ref(2), _Ref(1), _Ref(0))))))
+
+""" add = [x y. y ++ x] """
+add = _Func(_Func(_Bracket(_Ref(0), successor, _Ref(1))))
+
+""" mul = [x y. [z. x(y z)]] """
+mul = _Func(_Func(_Func(_Bracket(_Ref(2), _Bracket(_Ref(1), _Ref(0))))))
+
+""" eq0 = [x. x false not false]  where  not = [x. x false true] """
+eq0 = _Func(_Bracket(_Ref(0), _Numeral(0), _Func(_Bracket(_Ref(0), _Numeral(0), _Func(_Func(_Ref(1))))), _Numeral(0)))
+
+def Matches(sub, pattern, funcs=None):
+	"""Compares an expression with an operator pattern. Argument names are ignored.
+	Arguments:
+		sub: Sub - a simplified expression
+		pattern: tuple - one of the operator patterns
+		funcs: list of Func - the functions enclosing 'sub' which were matched by the pattern, nearest last
+	Returns:
+		bool
+	"""
+	if funcs == None:
+		funcs = []
+	tag = pattern[0]
+	T = type(sub)
+
+	if tag == tag_Func:
+		if T != Func or sub.recursive:
+			return False
+		funcs.append(sub)
+		matches = Matches(sub.body, pattern[1], funcs)
+		funcs.pop()
+		return matches
+	#
+	elif tag == tag_Bracket:
+		return (T == Bracket
+		  and Matches(sub.left, pattern[1], funcs)
+		  and Matches(sub.right, pattern[2], funcs))
+	#
+	elif tag == tag_ArgRef:
+		return T == ArgRef and pattern[1] < len(funcs) and sub.func is funcs[-1 - pattern[1]]
+	#
+	elif tag == tag_Numeral:
+		if T == Func:
+			sub = Recognize(sub)
+		return type(sub) == Numeral and sub.value == pattern[1]
+	#
+	return False
+#
+
+#endregion
+#region Arithmetic
+
+def Apply(left, right):
+	"""Applies a function to a Numeral without expanding it, if the result is known.
+	Arguments:
+		left: Sub - the simplified function being applied
+		right: Sub - the simplified expression being passed in
+	Returns:
+		Sub  - the simplified result of the application
+		None - the application must be done by substitution
+	"""
+	if type(right) != Numeral:
+		return None
+
+	if type(left) == Numeral:
+		# m n = n^m  (for m > 0)
+		if left.value > 0:
+			return Numeral(right.value ** left.value, left.xname, right.xname)
+		return None
+	#
+	elif type(left) != Func:
+		return None
+	#
+	elif Matches(left, successor):
+		return Numeral(right.value + 1, left.body.argname, left.body.body.argname)
+	#
+	elif Matches(left, eq0):
+		if right.value == 0:
+			t = left.body.left.right.body.right
+			return true(t.argname, t.body.argname)
+		f = left.body.right
+		return f if type(f) == Numeral else Recognize(f)
+	#
+	return None
+#
+
+def IsOperator(sub):
+	"""Whether a simplified expression is a Numeral or one of the known operators, which only do arithmetic
+	if their arguments are simplified to Numerals first (see Apply and Operator).
+	Arguments:
+		sub: Sub - a simplified expression
+	Returns:
+		bool
+	"""
+	if type(sub) == Numeral:
+		return True
+	return type(sub) == Func and not sub.recursive and (
+		Matches(sub, successor) or Matches(sub, eq0) or Matches(sub, add) or Matches(sub, mul))
+#
+
+def Operator(left, right):
+	"""Finds the arithmetic done by an expression of the form (left right next) when 'next' is a Numeral.
+	Arguments:
+		left: Sub - the simplified function being applied
+		right: Sub - the simplified first argument
+	Returns:
+		function(next: Numeral) -> Numeral - (left right next) is known to be an arithmetic operation
+		None - it is not
+	"""
+	if type(left) == Numeral:
+		# n ++ m = m + n
+		if left.value > 0 and type(right) == Func and Matches(right, successor):
+			fname, xname = right.body.argname, right.body.body.argname
+			return lambda m: Numeral(left.value + m.value, fname, xname)
+		elif left.value == 0:
+			return lambda m: m
+		return None
+	#
+	if type(right) != Numeral or type(left) != Func:
+		return None
+
+	if Matches(left, add):
+		s = left.body.body.left.right
+		fname, xname = s.body.argname, s.body.body.argname
+		return lambda m: right if m.value == 0 else Numeral(right.value + m.value, fname, xname)
+	#
+	elif Matches(left, mul):
+		fname = left.body.body.argname
+		return lambda m: Numeral(right.value * m.value, fname, right.xname)
+	#
+	return None
+#
+
+#endregion
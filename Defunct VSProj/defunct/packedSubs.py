@@ -0,0 +1,260 @@
+#region imports
+
+from structs import *
+from numerals import Expand
+import stats
+import limits
+
+#endregion
+#region Packed Expressions
+
+"""NOTE:
+A packed expression is a compact, immutable form of a Sub.
+Instead of linking each ArgRef to its Func, a reference to a function argument stores a de Bruijn index
+(0 for the nearest enclosing function, 1 for its parent...).
+Because nothing points back to a Func, packed nodes can be shared freely:
+identical references are interned, and a packed expression never needs to be copied.
+Unpacking creates a fresh Sub, which is how a packed expression is copied into a Sub.
+A Numeral is never changed, so it is used as it is in both Subs and packed expressions.
+"""
+
+class PackedBracket:
+	"""Packed form of a Bracket.
+	(PackedSub)
+	"""
+	__slots__ = ('left', 'right', 'hash')
+	tag = tag_Bracket
+
+	def __init__(this, left, right):
+		this.left = left
+		this.right = right
+
+		"""int - cached compareSubs.StructuralHash ('None' if not yet known)"""
+		this.hash = None
+	#
+#
+class PackedFunc:
+	"""Packed form of a Func.
+	(PackedSub)
+	"""
+	__slots__ = ('argname', 'body', 'recursive', 'hash')
+	tag = tag_Func
+
+	def __init__(this, argname, body, recursive):
+		this.argname = argname
+		this.body = body
+		this.recursive = recursive
+
+		"""int - cached compareSubs.StructuralHash ('None' if not yet known)"""
+		this.hash = None
+	#
+#
+class PackedArgRef:
+	"""Packed form of an ArgRef.
+	(PackedSub)
+		index == None - references a definition or primitive by name
+		index >= 0    - references the argument of the function 'index' levels up
+	"""
+	__slots__ = ('argname', 'index')
+	tag = tag_ArgRef
+
+	def __init__(this, argname, index):
+		this.argname = argname
+		this.index = index
+	#
+#
+class PackedForeignRef:
+	"""Packed form of an ArgRef linked to a Func outside of the packed expression.
+	(PackedSub)
+	"""
+	__slots__ = ('ref',)
+	tag = tag_ArgRef
+
+	def __init__(this, ref):
+		this.ref = ref
+	#
+#
+
+"""Types which are PackedSubs"""
+packedTypes = (PackedBracket, PackedFunc, PackedArgRef, PackedForeignRef)
+
+def IsPacked(sub):
+	"""Whether an expression is a PackedSub."""
+	return type(sub) in packedTypes
+#
+
+"""dictionary of
+	key: (str, int) - argname and index
+	value: PackedArgRef - the interned reference
+"""
+_argRefs = {}
+
+def PackedRef(argname, index=None):
+	"""Returns the interned PackedArgRef with this argname and index."""
+	key = (argname, index)
+	try:
+		return _argRefs[key]
+	except KeyError:
+		ref = _argRefs[key] = PackedArgRef(argname, index)
+		return ref
+#
+
+#endregion
+#region Pack and Unpack
+
+def Pack(sub):
+	"""Creates the packed form of an expression.
+	Arguments:
+		sub: Sub - the expression to pack
+	Returns:
+		PackedSub
+	"""
+	if IsPacked(sub):
+		return sub
+
+	"""dictionary of
+	key		: Func - a function enclosing the current node
+	value	: int - how many functions enclose that function
+	"""
+	depths = {}
+	todo = [(sub, False)]
+	done = []
+
+	while todo:
+		node, visited = todo.pop()
+		T = type(node)
+
+		if T == Func:
+			if not visited:
+				depths[node] = len(depths)
+				todo.append((node, True))
+				todo.append((node.body, False))
+			else:
+				del depths[node]
+				done.append(PackedFunc(node.argname, done.pop(), node.recursive))
+		#
+		elif T == Bracket:
+			if not visited:
+				todo.append((node, True))
+				todo.append((node.right, False))
+				todo.append((node.left, False))
+			else:
+				right = done.pop()
+				done.append(PackedBracket(done.pop(), right))
+		#
+		elif T == ArgRef:
+			if node.func == None:
+				done.append(PackedRef(node.argname))
+			elif node.func in depths:
+				done.append(PackedRef(node.argname, len(depths) - 1 - depths[node.func]))
+			else:
+				done.append(PackedForeignRef(node))
+		#
+		else:
+			done.append(node)
+	#
+	return done.pop()
+#
+
+def Unpack(packed):
+	"""Creates a new Sub from a packed expression. Every call returns a separate copy.
+	Arguments:
+		packed: PackedSub - the expression to unpack
+	Returns:
+		Sub
+	"""
+	"""list of Func - the functions enclosing the current node, nearest last"""
+	funcs = []
+	todo = [(packed, False)]
+	done = []
+	"""int - how many nodes have been created (added to stats.copiedNodes at the end)"""
+	count = 0
+
+	while todo:
+		node, visited = todo.pop()
+		T = type(node)
+		if not visited:
+			count += 1
+
+		if T == PackedFunc:
+			if not visited:
+				funcs.append(Func(argname=node.argname, recursive=node.recursive))
+				todo.append((node, True))
+				todo.append((node.body, False))
+			else:
+				func = funcs.pop()
+				func.body = done.pop()
+				func.Update()
+				done.append(func)
+		#
+		elif T == PackedBracket:
+			if not visited:
+				todo.append((node, True))
+				todo.append((node.right, False))
+				todo.append((node.left, False))
+			else:
+				right = done.pop()
+				done.append(Bracket(left=done.pop(), right=right))
+		#
+		elif T == PackedArgRef:
+			if node.index == None:
+				done.append(ArgRef(argname=node.argname))
+			else:
+				done.append(ArgRef(argname=node.argname, func=funcs[-1 - node.index]))
+		#
+		elif T == PackedForeignRef:
+			done.append(ArgRef(argname=node.ref.argname, func=node.ref.func))
+		#
+		else:
+			done.append(node)
+	#
+	stats.copiedNodes += count
+	if stats.copiedNodes > limits.nodeCheckpoint:
+		limits.Check()
+	return done.pop()
+#
+
+def IdenticalPacked(packedA, packedB):
+	"""Compares two packed expressions to see if they are identical in value.
+	Like compareSubs.Identical, references to definitions (or to functions outside of the expressions)
+	are never considered identical.
+	Arguments:
+		packedA: PackedSub
+		packedB: PackedSub
+	Returns:
+		bool
+	"""
+	todo = [(packedA, packedB)]
+	while todo:
+		a, b = todo.pop()
+		T = type(a)
+		if T != type(b):
+			# a Numeral is identical to the function it represents
+			if T == Numeral:
+				todo.append((Pack(Expand(a)), b))
+				continue
+			elif type(b) == Numeral:
+				todo.append((a, Pack(Expand(b))))
+				continue
+			return False
+
+		if T == PackedFunc:
+			todo.append((a.body, b.body))
+		elif T == PackedBracket:
+			todo.append((a.right, b.right))
+			todo.append((a.left, b.left))
+		elif T == PackedArgRef:
+			if a.index == None or a.index != b.index:
+				return False
+		elif T == PackedForeignRef:
+			return False
+		elif T == Numeral:
+			if a.value != b.value:
+				return False
+		elif a != None or b != None:
+			return False
+	#
+	return True
+#
+
+#endregion
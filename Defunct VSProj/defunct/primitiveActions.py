@@ -1,8 +1,12 @@
 #region imports
 
+import sys
+
 from extensions import joinObjects
 from compareSubs import *
+import globalvars
 import primitiveExpressions
+import stats
 
 #endregion
 #region Constants
@@ -27,19 +31,48 @@ def Execute_Print(sub, flush=False):
 	"""Prints an expression to the console, along with any aliases (names of definitions with identical body).
 	Arguments:
 		sub: Sub - the expression to print
-		flush: bool - passed in to python 'print' function
+		flush: bool - whether the output is flushed afterwards, to display it immediately
+	Changes:
+		globalvars.output - the message is written to it (at most globalvars.printLength characters of the expression)
+		globalvars.printedHashes - the expression's structural hash is added, if they are being recorded
 	Returns:
 		Func - Identity primitive
 	"""
+	output = globalvars.output if globalvars.output != None else sys.stdout
+	if globalvars.printedHashes != None:
+		globalvars.printedHashes.append(StructuralHash(sub))
 	defs = FindIdenticalDefs(sub)
-	msg = ''
 	if len(defs) > 0:
-		msg += joinObjects(', ', lambda d: d.name, defs) + ' :  '
-	msg += SubToString(sub)
-	print (msg, flush=flush)
+		output.write(joinObjects(', ', lambda d: d.name, defs) + ' :  ')
+	WriteSub(sub, output, limit=globalvars.printLength)
+	output.write('\n')
+	if flush:
+		output.flush()
 	return primitiveExpressions.identity()
 #
 
 #endregion
+#region Results
+
+def DropsIdentity(func):
+	"""Whether an engine may replace an application of a function by its argument, without applying the function:
+	the function is the identity, like the result of 'print', and the rewrite pass is on (see rewrite.py).
+	Arguments:
+		func: Sub - the function being applied
+	Changes:
+		stats.rewrittenSteps - the step saved is counted under 'identity'
+	Returns:
+		bool
+	"""
+	if type(func) != Func or func.recursive or type(func.body) != ArgRef or func.body.func is not func:
+		return False
+	import engines # engines imports every reduction engine, which import this module
+	if not engines.rewriting:
+		return False
+	stats.rewrittenSteps['identity'] = stats.rewrittenSteps.get('identity', 0) + 1
+	return True
+#
+
+#endregion
 
 
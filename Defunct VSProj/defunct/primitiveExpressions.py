@@ -8,21 +8,26 @@ from structs import *
 """ identity = [x.x] """
 def identity():
 	f = Func('x', ArgRef('x'))
-	f.body.func = f
+	f.body.Link(f)
+	f.Update()
 	return f
 #
 
 """ false = [y x. x] """
 def false():
 	f = Func('y', Func('x', ArgRef('x')))
-	f.body.body.func = f.body.body
+	f.body.body.Link(f.body.body)
+	f.body.Update()
+	f.Update()
 	return f
 #
 
 """ true = [y x. y] """
 def true():
 	f = Func('y', Func('x', ArgRef('y')))
-	f.body.body.func = f.body
+	f.body.body.Link(f.body)
+	f.body.Update()
+	f.Update()
 	return f
 #
 
@@ -39,38 +44,25 @@ def successor():
 #endregion
 #region Church Numerals (cn)
 
+""" n = [y x. y(y(...y(x)))] """
+def cn(n):
+	return Numeral(n)
+#
+
 """ 0 = [y x. x] """
 def cn0():
-	return false()
+	return cn(0)
 #
 
-#region cn1
 """ 1 = [y x. y x] """
 def cn1():
-	f = Func('y', Func('x', Bracket(ArgRef('y'), ArgRef('x'))))
-	f.body.body.left.func = f
-	f.body.body.right.func = f.body
-	return f
-#
-_cn1 = cn1()
-def cn1():
-	return CopySub(_cn1)
+	return cn(1)
 #
-#endregion
 
-#region cn2
 """ 2 = [y x. y(y x)] """
 def cn2():
-	f = Func('y', Func('x', Bracket(ArgRef('y'), ArgRef('x'))))
-	f.body.body.left.func = f
-	f.body.body.right.func = f.body
-	return f
-#
-_cn2 = cn2()
-def cn2():
-	return CopySub(_cn2)
+	return cn(2)
 #
-#endregon
 
 #endregion
 
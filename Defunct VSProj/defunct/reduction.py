@@ -4,9 +4,12 @@ from enum import Enum, Flag
 
 from debugwrapper import dprint
 from structs import *
-from globalvars import *
+import globalvars
 import primitiveActions
 from compareSubs import *
+import numerals
+import stats
+import limits
 
 #endregion
 #region Simplifying and Substituting
@@ -72,7 +75,7 @@ def Simplify(sub, execute=False, simplifyMode=SimplifyMode.Normal):
 					referredSub : Sub  - the Sub to deep copy and replace the references
 					func		: Func - the function with the argument being checked
 				Returns:
-					Sub - the 'sub' parameter with all references replaced
+					Sub - the 'sub' parameter with all references replaced, and its stored flags updated
 				"""
 				if not sub:
 					return sub
@@ -90,11 +93,13 @@ def Simplify(sub, execute=False, simplifyMode=SimplifyMode.Normal):
 				#
 				elif type(sub) == Func:
 					sub.body = SubstituteArg(sub.body, referredSub, func)
+					sub.Update()
 					return sub
 				#
 				elif type(sub) == Bracket:
 					sub.left = SubstituteArg(sub.left, referredSub, func)
 					sub.right = SubstituteArg(sub.right, referredSub, func)
+					sub.Update()
 					return sub
 				#
 				else:
@@ -129,9 +134,23 @@ def Simplify(sub, execute=False, simplifyMode=SimplifyMode.Normal):
 				raise TypeError('sub not a Bracket')
 			if not sub.left:
 				return sub
+
+			# arithmetic on Numerals
+			new = numerals.Apply(sub.left, sub.right)
+			if new != None:
+				return new
+			if type(sub.left) == Numeral:
+				sub.left = numerals.Expand(sub.left)
+				sub.Update()
 	
 			if type(sub.left) == Func:
-				new = SubstituteArg(sub.left.body, sub.right, sub.left)
+				if primitiveActions.DropsIdentity(sub.left):
+					new = sub.right # it is not referred to anywhere else, so it needs no copy
+				else:
+					stats.betaReductions += 1
+					if stats.betaReductions > limits.checkpoint:
+						limits.Check()
+					new = SubstituteArg(sub.left.body, sub.right, sub.left)
 
 				if simplifyMode == SimplifyMode.ApplyRecursive:
 					new = Simplify(new, execute, SimplifyMode.DoneRecursive)
@@ -149,6 +168,55 @@ def Simplify(sub, execute=False, simplifyMode=SimplifyMode.Normal):
 			#endregion
 		#
 
+		#endregion
+		#region private Reduce
+
+		def SimplifyBracket_Reduce(sub, execute=False, simplifyMode=SimplifyMode.Normal):
+			"""Attempts to apply the function 'left' to the expression 'right', once both are simplified.
+			Arguments:
+				sub: Bracket - the expression to simplify
+				execute: bool - if true, will execute primitive functions like 'print'
+				simplifyMode: SimplifyMode
+			Returns:
+				Sub - the simplified expression
+			"""
+			# Apply left func to right expression
+			if simplifyMode == SimplifyMode.Normal:
+				if sub.left.recursive:
+
+					def check():
+						return (
+							type(sub) == Bracket
+							and sub.left.recursive
+							and (
+								type(sub.left) == Func
+								or (type(sub.left) == Bracket and type(sub.left.left) != ArgRef)
+							)
+						)
+					#
+					if not sub.right.containsRecursive and check():
+						while check():
+							if type(sub.left) == Bracket:
+								sub.left = SimplifyBracket_Apply(sub.left, execute, SimplifyMode.ApplyRecursive)
+								sub.Update()
+							elif type(sub.left) == Func:
+								sub = SimplifyBracket_Apply(sub, execute, SimplifyMode.ApplyRecursive)
+						#
+						sub = SimplifyBracket_Apply(sub, execute, SimplifyMode.DoneRecursive)
+						sub = Simplify(sub, execute, SimplifyMode.Normal)
+					#
+				#
+				elif not sub.left.recursive:
+					sub = SimplifyBracket_Apply(sub, execute, simplifyMode)
+			#
+			elif simplifyMode == SimplifyMode.DoneRecursive:
+				if not sub.left.recursive:
+					sub = SimplifyBracket_Apply(sub, execute, simplifyMode)
+			#
+
+			return sub
+		#
+
 		#endregion
 		#region body SimplifyBracket
 		if not sub:
@@ -158,68 +226,328 @@ def Simplify(sub, execute=False, simplifyMode=SimplifyMode.Normal):
 		if not sub.left:
 			return sub
 
+		# In normal order, the function is simplified first, and 'right' is only simplified if it is needed
+		lazy = normalOrder and simplifyMode != SimplifyMode.ApplyRecursive
+
 		# Simplify both sub-expressions
-		sub.left  = Simplify(sub.left,  execute, simplifyMode)
-		sub.right = Simplify(sub.right, execute, simplifyMode)
-	
-		# Apply left func to right expression
-		if simplifyMode == SimplifyMode.Normal:
-			if sub.left.recursive:
-
-				def check():
-					return (
-						type(sub) == Bracket
-						and sub.left.recursive
-						and (
-							type(sub.left) == Func
-							or (type(sub.left) == Bracket and type(sub.left.left) != ArgRef)
-						)
-					)
-				#
-				if not sub.right.containsRecursive and check():
-					while check():
-						if type(sub.left) == Bracket:
-							sub.left = SimplifyBracket_Apply(sub.left, execute, SimplifyMode.ApplyRecursive)
-						elif type(sub.left) == Func:
-							sub = SimplifyBracket_Apply(sub, execute, SimplifyMode.ApplyRecursive)
-					#
-					sub = SimplifyBracket_Apply(sub, execute, SimplifyMode.DoneRecursive)
-					sub = Simplify(sub, execute, SimplifyMode.Normal)
+		left = sub.left
+		if type(left) == Bracket and left.left and simplifyMode != SimplifyMode.ApplyRecursive:
+			left.left = Simplify(left.left, execute, simplifyMode)
+			# arithmetic is only looked ahead for when the operator needs its argument: (0 f x) is x, so in
+			# normal order 'f' is discarded without being simplified (nor its primitives executed)
+			if lazy and not (numerals.IsOperator(left.left) and IsStrict(left.left)):
+				globalvars.currentHierarchy.append(left)
+				if IsStrict(left.left):
+					left.right = Simplify(left.right, execute, simplifyMode)
+					left.Update()
+					sub.left = SimplifyBracket_Reduce(left, execute, simplifyMode)
+				else:
+					left.Update()
+					sub.left = SimplifyBracket_Apply(left, execute, simplifyMode)
+				globalvars.currentHierarchy.pop()
+			#
+			else:
+				# Look ahead for arithmetic (left.left left.right sub.right) on Numerals
+				# before 'left' is applied, which would expand them.
+				left.right = Simplify(left.right, execute, simplifyMode)
+
+				operator = numerals.Operator(left.left, left.right)
+				if operator != None:
+					sub.right = Simplify(sub.right, execute, simplifyMode)
+					if type(sub.right) == Numeral:
+						return operator(sub.right)
+					lazy = False
 				#
+				left.Update()
+				globalvars.currentHierarchy.append(left)
+				sub.left = SimplifyBracket_Reduce(left, execute, simplifyMode)
+				globalvars.currentHierarchy.pop()
+
+				if operator == None and not lazy:
+					sub.right = Simplify(sub.right, execute, simplifyMode)
 			#
-			elif not sub.left.recursive:
-				sub = SimplifyBracket_Apply(sub, execute, simplifyMode)
 		#
-		elif simplifyMode == SimplifyMode.DoneRecursive:
-			if not sub.left.recursive:
-				sub = SimplifyBracket_Apply(sub, execute, simplifyMode)
+		else:
+			sub.left = Simplify(sub.left, execute, simplifyMode)
+			if not lazy:
+				sub.right = Simplify(sub.right, execute, simplifyMode)
 		#
+		sub.Update()
 
-		return sub
+		if lazy:
+			if not IsStrict(sub.left):
+				return SimplifyBracket_Apply(sub, execute, simplifyMode)
+			sub.right = Simplify(sub.right, execute, simplifyMode)
+			sub.Update()
+		#
+		return SimplifyBracket_Reduce(sub, execute, simplifyMode)
 		#endregion
 	#
 
 	#endregion
 	#region body Simplify
-	currentHierarchy.append(sub)
+	hierarchy = globalvars.currentHierarchy
+	hierarchy.append(sub)
+	if len(hierarchy) > stats.maxHierarchyDepth:
+		stats.maxHierarchyDepth = len(hierarchy)
 
 	if type(sub) == Bracket:
 		sub = SimplifyBracket(sub, execute, simplifyMode)
 	#
 	elif type(sub) == Func:
+		sub.active += 1
 		sub.body = Simplify(sub.body, execute, simplifyMode)
+		sub.active -= 1
+		sub.Update()
+		sub = numerals.Recognize(sub) or sub
 	#
 	elif type(sub) == ArgRef:
-		if sub.func == None and sub.argname in definitions:
-			sub = CopySub(definitions[sub.argname].body)
-			sub = Simplify(sub, execute, simplifyMode)
+		if sub.func == None and sub.argname in globalvars.definitions:
+			sub = ExpandDefinition(sub.argname, execute, simplifyMode)
 		#
 	#
-	currentHierarchy.pop()
+	hierarchy.pop()
 	return sub
 	#endregion
 #
 
+"""bool - whether Simplify applies functions before simplifying their arguments (see SimplifyNormalOrder)"""
+normalOrder = False
+
+def SimplifyNormalOrder(sub, execute=False):
+	"""Simplifies an expression in normal order (leftmost-outermost): a function is simplified before its
+	argument, and an argument is only simplified once it is needed, so the branch discarded by a condition
+	such as (eq0 n a b) is never simplified. Gives the same result as Simplify for expressions which do not
+	execute primitives, and recursive functions ('$') are still only applied to simplified arguments.
+	Arguments:
+		sub: Sub - the expression to simplify
+		execute: bool - if true, will execute primitive functions like 'print'
+	Returns:
+		Sub - the expression which is as simplified as possible
+	Changes:
+		normalOrder (the previous value is restored afterwards)
+	"""
+	global normalOrder
+
+	previous = normalOrder
+	normalOrder = True
+	try:
+		return Simplify(sub, execute)
+	finally:
+		normalOrder = previous
+#
+
+def CountArgRefs(sub, func, limit):
+	"""Counts the references to a function's argument within an expression, without recursion.
+	Arguments:
+		sub: Sub - the expression to search
+		func: Func - the function with the argument being counted
+		limit: int - stop counting once this many are found
+	Returns:
+		int - the number of references found (at most 'limit')
+	"""
+	count = 0
+	todo = [sub]
+	while todo:
+		sub = todo.pop()
+		T = type(sub)
+		if T == Bracket:
+			todo.append(sub.right)
+			todo.append(sub.left)
+		elif T == Func:
+			todo.append(sub.body)
+		elif T == ArgRef and sub.func is func:
+			count += 1
+			if count >= limit:
+				break
+	#
+	return count
+#
+
+def IsStrict(func):
+	"""Whether the argument of a simplified function must be simplified before the function is applied to it in normal order.
+	An argument which the function discards is never simplified. An argument which it uses once is substituted as it is,
+	and simplified where it ends up (if it is not discarded there). An argument which is used more than once is simplified
+	first, so that the work is not repeated for each copy. Recursive functions, primitives and arithmetic operators
+	always get a simplified argument (see Simplify.SimplifyBracket_Reduce), except the Numeral 0, which discards it.
+	Arguments:
+		func: Sub - the simplified function being applied
+	Returns:
+		bool
+	"""
+	if type(func) == Numeral:
+		return func.value > 0
+	return (type(func) != Func or func.recursive
+		or numerals.IsOperator(func)
+		or CountArgRefs(func.body, func, 2) >= 2)
+#
+
+def UnwindHierarchy(depth=0):
+	"""Removes what a simplification which was stopped by an error left on currentHierarchy.
+	Arguments:
+		depth: int - the length of currentHierarchy before the simplification started
+	Changes:
+		globalvars.currentHierarchy, and the 'active' count of each Func removed from it
+	"""
+	hierarchy = globalvars.currentHierarchy
+	while len(hierarchy) > depth:
+		sub = hierarchy.pop()
+		if type(sub) == Func:
+			sub.active -= 1
+	#
+#
+
+#endregion
+#region Definition References
+
+"""int - how many simplified 'def_u' bodies are kept in simplifiedDefinitions"""
+simplifiedDefinitionsLimit = 256
+
+def DefinitionDependencies(dfn):
+	"""Finds every definition that a definition's body depends on, directly or through other definitions.
+	Arguments:
+		dfn: Def - an indexed definition
+	Returns:
+		tuple of (str, Def) - each referenced name, and its current definition ('None' if not defined)
+		None - the body depends on a primitive function, so its simplified form may depend on 'execute'
+	"""
+	dependencies = {}
+	todo = list(dfn.references)
+	while todo:
+		name = todo.pop()
+		if name in dependencies:
+			continue
+		if name in primitiveActions.names:
+			return None
+
+		d = globalvars.definitions.get(name)
+		dependencies[name] = d
+		if d != None:
+			if d.references == None:
+				return None
+			todo.extend(d.references)
+	#
+	return tuple(dependencies.items())
+#
+
+def NormalizeDefinition(dfn):
+	"""Simplifies the body of a lazy 'def', the first time it is referenced.
+	The names it refers to (directly, or through other definitions) mean what they meant when it was defined,
+	even if they have been redefined since, so the result is the same as if it had been simplified then.
+	Uses the selected engine (see engines.Reduce), so a deep body does not need a deep Python call stack
+	unless the recursive engine is selected.
+	Arguments:
+		dfn: Def - a lazy definition
+	Changes:
+		dfn (the body is simplified, and indexed again if dfn is still the current definition)
+		globalvars.definitions (during simplification only)
+	Exceptions:
+		DefunctError_LimitExceeded - simplifying took too much work (dfn stays lazy)
+	"""
+	import engines # engines imports this module
+	definitions = globalvars.definitions
+
+	"""dictionary of
+		key: str - a name the body depends on
+		value: Def - its definition when dfn was defined ('None' if it was not defined)
+	"""
+	then = {}
+	todo = list(dfn.references)
+	while todo:
+		name = todo.pop()
+		if name in then:
+			continue
+		d = definitions.get(name)
+		while d != None and d.order > dfn.order:
+			d = d.previous
+		then[name] = d
+		if d != None and d.references != None:
+			todo.extend(d.references)
+	#
+
+	now = {name: definitions.get(name) for name in then}
+	try:
+		for name, d in then.items():
+			if d == None:
+				definitions.pop(name, None)
+			else:
+				definitions[name] = d
+		#
+		sub = engines.Reduce(CopySub(dfn.body), execute=False)
+	finally:
+		for name, d in now.items():
+			if d == None:
+				definitions.pop(name, None)
+			else:
+				definitions[name] = d
+		#
+	#
+
+	if IsPacked(dfn.body):
+		sub = Pack(sub)
+	elif IsArena(dfn.body):
+		sub = dfn.body.arena.Store(sub)
+	dfn.body = sub
+	dfn.lazy = False
+	dfn.normalized = True
+	if definitions.get(dfn.name) is dfn:
+		IndexDefinition(dfn)
+	else:
+		dfn.references = FreeNames(dfn.body)
+#
+
+def ExpandDefinition(name, execute=False, simplifyMode=SimplifyMode.Normal):
+	"""Returns a simplified copy of a definition's body (used when an unbound ArgRef refers to a definition).
+	The body of a 'def' is already simplified, so it is only simplified again if it refers to names
+	which are now defined, or to primitives. The simplified bodies of 'def_u' definitions are cached
+	in simplifiedDefinitions until something they depend on is redefined.
+	Arguments:
+		name: str - the name of the definition
+		execute: bool - if true, will execute primitive functions like 'print'
+		simplifyMode: SimplifyMode - passed on to Simplify
+	Returns:
+		Sub - a new copy of the simplified body
+	Changes:
+		simplifiedDefinitions
+	"""
+	dfn = globalvars.definitions[name]
+	stats.definitionExpansions += 1
+	stats.expandedDefinitions[name] = stats.expandedDefinitions.get(name, 0) + 1
+
+	if dfn.lazy:
+		NormalizeDefinition(dfn)
+
+	if dfn.references == None:
+		return Simplify(CopySub(dfn.body), execute, simplifyMode)
+	#
+
+	if dfn.normalized:
+		if not any(n in globalvars.definitions or n in primitiveActions.names for n in dfn.references):
+			return CopySub(dfn.body)
+		return Simplify(CopySub(dfn.body), execute, simplifyMode)
+	#
+
+	key = (name, simplifyMode)
+	cached = globalvars.simplifiedDefinitions.get(key)
+	if cached != None:
+		cachedDfn, dependencies, packed = cached
+		if cachedDfn is dfn and all(globalvars.definitions.get(n) is d for n, d in dependencies):
+			globalvars.simplifiedDefinitions.move_to_end(key)
+			return CopySub(packed)
+		del globalvars.simplifiedDefinitions[key]
+	#
+
+	sub = Simplify(CopySub(dfn.body), execute, simplifyMode)
+
+	dependencies = DefinitionDependencies(dfn)
+	if dependencies != None:
+		globalvars.simplifiedDefinitions[key] = (dfn, dependencies, Pack(sub))
+		if len(globalvars.simplifiedDefinitions) > simplifiedDefinitionsLimit:
+			globalvars.simplifiedDefinitions.popitem(last=False)
+	#
+	return sub
+#
+
 #endregion
 
 
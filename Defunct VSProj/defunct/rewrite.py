@@ -0,0 +1,369 @@
+#region imports
+
+from structs import *
+import globalvars
+import stats
+from compareSubs import FreeNames
+from machine import DefinitionCode, Executes
+from machine import code_Func, code_Bracket, code_Bound, code_Unbound
+
+#endregion
+#region Rewrite Pass
+
+"""NOTE:
+The rewrite pass replaces a few patterns with what they reduce to, before an engine simplifies the expression,
+so that the engine does not have to do those beta reductions (or expand those definitions) one at a time:
+	eta			[x. M x]				-> M		where M does not refer to x, and M is a function applied to fewer
+												parameters than it takes (so M reduces to a function)
+	identity	([x. x] a)				-> a
+	select		([y x. y] a b)			-> a		and ([y x. x] a b) -> b
+	project		([a b z. z a b] a b s)	-> (s a b)
+				([z. z a b] s)			-> (s a b)	where z does not occur in a or b
+				([p. p s] q)			-> (q s)	where s is [y x. y] or [y x. x]
+The functions may be written in the expression, or be definitions whose bodies have these shapes
+(like 'identity', 'true', 'false', 'pair' and 'pair_first' in examples/example02.txt, and the numeral 0).
+The identity functions written by '()' are dropped by the 'identity' rule. Those which only appear while
+simplifying, like the one returned by 'print', are dropped by the engines (see primitiveActions.DropsIdentity):
+the recursive engines drop every identity which is applied, the others the results of primitives.
+
+Every rewrite is a step the engine would have taken, so the simplified result is the same,
+except that a function which was eta-reduced may be printed with different argument names.
+While executing, 'select' does not discard a parameter which could execute a primitive like 'print',
+and 'project' does not move one (which would change the order the primitives are executed in).
+How many beta reductions each rule saved is counted in stats.rewrittenSteps (eta counts the one it
+saves each time the function is applied as one).
+"""
+
+"""Shapes of the functions which the rules apply to (see _SubShape and _CodeShape)"""
+shape_Identity = 0	# [x. x]
+shape_Select = 1	# [y x. y] or [y x. x] (extra: int - the position of the parameter which is chosen)
+shape_Pair = 2		# [a b z. z a b]
+shape_Value = 3		# [z. z a b] (extra: (Sub, Sub) - a and b; only written in the expression)
+shape_Project = 4	# [p. p s] where s has shape_Select (extra: Sub - s, or a new copy of it for a definition)
+
+"""dictionary of
+	key: int - a shape
+	value: (str, int, int) - the rule which applies to a function of that shape, how many parameters it needs,
+		and how many beta reductions it saves
+"""
+_rules = {
+	shape_Identity: ('identity', 1, 1),
+	shape_Select: ('select', 2, 2),
+	shape_Pair: ('project', 3, 3),
+	shape_Value: ('project', 1, 1),
+	shape_Project: ('project', 1, 1),
+}
+
+def Rewrite(sub, execute=False):
+	"""Applies the rewrite rules to an expression (see the NOTE above), without using the Python call stack.
+	Changes the expression in place.
+	Arguments:
+		sub: Sub - the expression, before it is simplified
+		execute: bool - whether the expression will be executed (see engines.Reduce)
+	Returns:
+		Sub - the rewritten expression
+	Changes:
+		stats.rewrittenSteps
+	"""
+	if type(sub) != Bracket and type(sub) != Func:
+		return sub # packed expressions and arena terms are already simplified
+
+	saved = {}
+	holder = Bracket(left=sub)
+
+	"""stack of (Bracket or Func, str, bool) - where each node is found (its parent and the parent's attribute),
+	and whether its children have already been rewritten
+	"""
+	todo = [(holder, 'left', False)]
+	while todo:
+		parent, attr, visited = todo.pop()
+		node = getattr(parent, attr)
+		T = type(node)
+
+		if not visited:
+			if T == Bracket:
+				todo.append((parent, attr, True))
+				todo.append((node, 'right', False))
+				todo.append((node, 'left', False))
+			elif T == Func:
+				todo.append((parent, attr, True))
+				todo.append((node, 'body', False))
+			continue
+		#
+		if T == Bracket or T == Func:
+			node.Update() # its children may have been rewritten
+
+		while True:
+			T = type(node)
+			if T == Func:
+				rewritten = _Eta(node, saved)
+			elif T == Bracket:
+				rewritten = _Fold(node, execute, saved)
+			else:
+				rewritten = None
+			if rewritten == None:
+				break
+			node = rewritten
+		#
+		setattr(parent, attr, node)
+	#
+
+	for rule, steps in saved.items():
+		stats.rewrittenSteps[rule] = stats.rewrittenSteps.get(rule, 0) + steps
+	return holder.left
+#
+
+def _Eta(func, saved):
+	"""Applies the 'eta' rule to a function.
+	Returns:
+		Sub - the function's body without its last parameter
+		None - the rule does not apply
+	"""
+	body = func.body
+	if func.recursive or type(body) != Bracket or type(body.right) != ArgRef or body.right.func is not func:
+		return None
+	inner = body.left
+	if _Refers(inner, func) or ContainsRecursive(inner):
+		return None
+
+	applied = 0
+	head = inner
+	while type(head) == Bracket:
+		applied += 1
+		head = head.left
+	#
+	if _Arity(head) <= applied:
+		return None
+	saved['eta'] = saved.get('eta', 0) + 1
+	return inner
+#
+
+def _Fold(sub, execute, saved):
+	"""Applies the 'identity', 'select' or 'project' rule to an application.
+	Returns:
+		Sub - what the application reduces to
+		None - no rule applies
+	"""
+	args = []
+	head = sub
+	while type(head) == Bracket:
+		args.append(head.right)
+		head = head.left
+	#
+	shape = _SubShape(head)
+	if shape == None:
+		return None
+	kind, extra = shape
+	rule, needed, steps = _rules[kind]
+	if len(args) < needed:
+		return None
+	args.reverse()
+
+	if kind == shape_Identity:
+		result = args[0]
+	elif kind == shape_Select:
+		if execute and _Executes(args[1 - extra]):
+			return None
+		result = args[extra]
+	elif kind == shape_Pair:
+		if execute and any(_Executes(arg) for arg in args[:3]):
+			return None
+		result = Bracket(Bracket(args[2], args[0]), args[1])
+	elif kind == shape_Value:
+		if execute and (_Executes(args[0]) or _Executes(extra[0]) or _Executes(extra[1])):
+			return None
+		result = Bracket(Bracket(args[0], extra[0]), extra[1])
+	else:
+		result = Bracket(args[0], extra)
+
+	for arg in args[needed:]:
+		result = Bracket(result, arg)
+	saved[rule] = saved.get(rule, 0) + steps
+	return result
+#
+
+#endregion
+#region Shapes
+
+def _SubShape(sub):
+	"""Finds the shape of a function in the expression, or of the definition it refers to.
+	Returns:
+		(int, extra) - the shape and its extra value (see shape_...)
+		None - it has none of the shapes
+	"""
+	T = type(sub)
+	if T == ArgRef:
+		return _DefinitionShape(sub.argname) if sub.func == None else None
+	if T == Numeral:
+		return (shape_Select, 1) if sub.value == 0 else None
+	if T != Func or sub.recursive:
+		return None
+
+	body = sub.body
+	T = type(body)
+	if T == ArgRef:
+		return (shape_Identity, None) if body.func is sub else None
+	#
+	if T == Func and not body.recursive:
+		inner = body.body
+		if type(inner) == ArgRef:
+			if inner.func is sub:
+				return (shape_Select, 0)
+			if inner.func is body:
+				return (shape_Select, 1)
+		#
+		elif type(inner) == Func and not inner.recursive:
+			apply = inner.body
+			if (type(apply) == Bracket and type(apply.left) == Bracket
+				and _IsRef(apply.left.left, inner) and _IsRef(apply.left.right, sub) and _IsRef(apply.right, body)):
+				return (shape_Pair, None)
+		#
+		return None
+	#
+	if T == Bracket:
+		left = body.left
+		if _IsRef(left, sub):
+			shape = _SubShape(body.right)
+			if shape != None and shape[0] == shape_Select:
+				return (shape_Project, body.right)
+		#
+		elif (type(left) == Bracket and _IsRef(left.left, sub)
+			and not _Refers(left.right, sub) and not _Refers(body.right, sub)):
+			return (shape_Value, (left.right, body.right))
+	#
+	return None
+#
+
+def _DefinitionShape(name):
+	"""Finds the shape of a definition's body.
+	Returns:
+		(int, extra) - the shape and its extra value (shape_Value is never found)
+		None - it is not a definition, or its body has none of the shapes
+	"""
+	code = _DefinitionCode(name)
+	return _CodeShape(code) if code != None else None
+#
+
+def _CodeShape(code):
+	"""Finds the shape of a compiled function (see _SubShape)."""
+	if code.tag != code_Func or code.recursive:
+		return None
+
+	body = code.body
+	if body.tag == code_Bound:
+		return (shape_Identity, None) if body.index == 0 else None
+	#
+	if body.tag == code_Func and not body.recursive:
+		inner = body.body
+		if inner.tag == code_Bound:
+			return (shape_Select, 1 - inner.index)
+		#
+		if inner.tag == code_Func and not inner.recursive:
+			apply = inner.body
+			if (apply.tag == code_Bracket and apply.left.tag == code_Bracket
+				and _IsIndex(apply.left.left, 0) and _IsIndex(apply.left.right, 2) and _IsIndex(apply.right, 1)):
+				return (shape_Pair, None)
+		#
+		return None
+	#
+	if body.tag == code_Bracket and _IsIndex(body.left, 0):
+		selector = _CodeSelector(body.right)
+		if selector != None:
+			return (shape_Project, selector)
+	#
+	return None
+#
+
+def _CodeSelector(code):
+	"""Creates the expression of a compiled [y x. y] or [y x. x], or of a reference to a definition with that body.
+	Returns:
+		Sub - a new Func, or a new ArgRef to the definition
+		None - it has neither shape
+	"""
+	selector = code
+	if code.tag == code_Unbound:
+		code = _DefinitionCode(code.argname)
+		if code == None:
+			return None
+	#
+	if code.tag != code_Func or code.recursive or code.body.tag != code_Func or code.body.recursive:
+		return None
+	inner = code.body.body
+	if inner.tag != code_Bound or inner.index > 1:
+		return None
+	if selector.tag == code_Unbound:
+		return ArgRef(selector.argname)
+
+	f = Func(code.argname, Func(code.body.argname, ArgRef(inner.argname)))
+	f.body.body.Link(f if inner.index == 1 else f.body)
+	f.body.Update()
+	f.Update()
+	return f
+#
+
+def _DefinitionCode(name):
+	"""Returns the compiled body of a definition, following definitions whose body is only another definition's name.
+	Returns:
+		Code
+		None - it is not a definition, or the body is still to be simplified (see reduction.NormalizeDefinition)
+	"""
+	visited = set()
+	while name not in visited:
+		visited.add(name)
+		dfn = globalvars.definitions.get(name)
+		if dfn == None or dfn.lazy:
+			return None
+		code = DefinitionCode(name)
+		if code.tag != code_Unbound:
+			return code
+		name = code.argname
+	#
+	return None
+#
+
+def _Arity(sub):
+	"""How many parameters a function in the expression, or the definition it refers to, takes before its body
+	(how many non-recursive functions it starts with).
+	Returns:
+		int - 0 if it is not a function
+	"""
+	T = type(sub)
+	if T == Numeral:
+		return 2
+	count = 0
+	if T == ArgRef:
+		if sub.func != None:
+			return 0
+		code = _DefinitionCode(sub.argname)
+		while code != None and code.tag == code_Func and not code.recursive:
+			count += 1
+			code = code.body
+		return count
+	#
+	while type(sub) == Func and not sub.recursive:
+		count += 1
+		sub = sub.body
+	return count
+#
+
+def _IsRef(sub, func):
+	"""Whether an expression is a reference to the argument of 'func'."""
+	return type(sub) == ArgRef and sub.func is func
+#
+
+def _IsIndex(code, index):
+	"""Whether compiled code is a reference to an enclosing function's argument, by de Bruijn index."""
+	return code.tag == code_Bound and code.index == index
+#
+
+def _Refers(sub, func):
+	"""Whether an expression refers to the argument of 'func' anywhere inside it."""
+	return func in sub.frees
+#
+
+def _Executes(sub):
+	"""Whether an expression, or a definition it refers to, refers to a primitive which would be executed (see machine.Executes)."""
+	return Executes(FreeNames(sub))
+#
+
+#endregion
@@ -0,0 +1,317 @@
+#region imports
+
+import gc
+import json
+import tracemalloc
+
+from structs import Bracket, Func, ArgRef, Numeral
+
+#endregion
+#region Counters
+
+"""NOTE:
+Counters of the work done while simplifying, for measuring the interpreter (see benchmark.py and -profile).
+They count for the whole process, whichever Interpreter is running.
+Hot loops should add to a local variable and add it to the counter once at the end.
+"""
+
+"""int - functions applied to an argument (beta reductions)"""
+betaReductions = 0
+
+"""int - nodes created by copying an expression (see compareSubs.CopySub)"""
+copiedNodes = 0
+
+"""int - references to definitions replaced by the definition's body"""
+definitionExpansions = 0
+
+"""int - definition bodies compared with an expression by compareSubs.FindIdenticalDefs"""
+identicalComparisons = 0
+
+"""int - the greatest length of globalvars.currentHierarchy (only measured by reduction.Simplify)"""
+maxHierarchyDepth = 0
+
+"""dictionary of
+	key: str - name of a definition
+	value: int - how many times it was expanded
+"""
+expandedDefinitions = {}
+
+"""dictionary of
+	key: str - name of a rule of the rewrite pass (see rewrite.py)
+	value: int - how many beta reductions it saved
+"""
+rewrittenSteps = {}
+
+"""Names of all the int counters"""
+names = ('betaReductions', 'copiedNodes', 'definitionExpansions', 'identicalComparisons', 'maxHierarchyDepth')
+
+"""Names of the counters which are combined by taking the greatest value, instead of the total (see Combine)"""
+maximums = ('maxHierarchyDepth',)
+
+def Reset():
+	"""Sets every counter to zero."""
+	global betaReductions
+	global copiedNodes
+	global definitionExpansions
+	global identicalComparisons
+	global maxHierarchyDepth
+	global expandedDefinitions
+	global rewrittenSteps
+
+	betaReductions = 0
+	copiedNodes = 0
+	definitionExpansions = 0
+	identicalComparisons = 0
+	maxHierarchyDepth = 0
+	expandedDefinitions = {}
+	rewrittenSteps = {}
+	_ResetMemory()
+#
+
+def Snapshot():
+	"""Gets the current value of every int counter.
+	Returns:
+		dictionary of
+			key: str - name of the counter
+			value: int - its value
+	"""
+	return { name: globals()[name] for name in names }
+#
+
+def Measurement():
+	"""Gets the current value of every counter, including which definitions were expanded.
+	Returns:
+		dictionary - the values of Snapshot, and
+			'expandedDefinitions': dictionary - a copy of 'expandedDefinitions'
+			'rewrittenSteps': dictionary - a copy of 'rewrittenSteps'
+			'peakMemory': int - the most bytes allocated by Python since Reset, above how many there were then
+			'peakNodes': int - the most expression nodes alive at once since Reset, above how many there were then
+				(both only while measuring memory, see MeasureMemory)
+	"""
+	measurement = Snapshot()
+	measurement['expandedDefinitions'] = dict(expandedDefinitions)
+	measurement['rewrittenSteps'] = dict(rewrittenSteps)
+	if measuringMemory:
+		SampleMemory()
+		measurement['peakMemory'] = max(_peakBytes, tracemalloc.get_traced_memory()[1]) - _startBytes
+		measurement['peakNodes'] = _peakNodes - _startNodes
+	return measurement
+#
+
+def Combine(records):
+	"""Combines the counters of several measurements, e.g. of each statement in a file.
+	Arguments:
+		records: list of dictionary - each with a value for every name in 'names'
+	Returns:
+		dictionary of
+			key: str - name of the counter
+			value: int - the total (or the greatest value, for the counters in 'maximums')
+	"""
+	combined = {}
+	for name in names:
+		values = [record[name] for record in records]
+		if name in maximums:
+			combined[name] = max(values, default=0)
+		else:
+			combined[name] = sum(values)
+	#
+	return combined
+#
+
+#endregion
+#region Memory
+
+"""NOTE:
+Memory is measured with tracemalloc, which counts the bytes of every block Python allocates, from when tracing
+starts: expression nodes, but also the engines' stacks, caches and anything else alive at the time.
+tracemalloc keeps the peak itself, so it is exact, but tracing makes every allocation slower (often
+taking twice as long), so it is only started when memory is measured (-profileMemory) or limited (see limits.Limits).
+
+Counting the expression nodes alive means looking at every object the garbage collector knows of, which takes
+about as long as copying them, so they are only counted when a checkpoint is passed (see limits.Check), or the
+statement ends, with a quarter more memory allocated than at the last count. The peak node count is the greatest
+of these counts, so it is the number of nodes alive close to when the most memory was allocated.
+"""
+
+"""bool - whether the peak memory of each statement is measured (see MeasureMemory)"""
+measuringMemory = False
+
+"""int - the bytes allocated when the counters were last reset"""
+_startBytes = 0
+
+"""int - the expression nodes alive when the counters were last reset"""
+_startNodes = 0
+
+"""int - the most bytes allocated before a count of the nodes (which allocates memory of its own, see SampleMemory)"""
+_peakBytes = 0
+
+"""int - the most expression nodes counted since the counters were last reset"""
+_peakNodes = 0
+
+"""int - how many bytes must be allocated before the nodes are counted again"""
+_nextSample = 0
+
+"""int - the fewest bytes allocated between two counts of the nodes"""
+sampleBytes = 1 << 14
+
+def MeasureMemory():
+	"""Starts measuring the peak memory of each statement. From then on, Measurement includes 'peakMemory'."""
+	global measuringMemory
+
+	TraceMemory()
+	measuringMemory = True
+	_ResetMemory()
+#
+
+def TraceMemory():
+	"""Starts tracing memory with tracemalloc, if it is not already (see the NOTE above)."""
+	if not tracemalloc.is_tracing():
+		tracemalloc.start()
+#
+
+def AllocatedBytes():
+	"""Counts the bytes allocated by Python since tracing started (see TraceMemory).
+	Returns:
+		int
+	"""
+	return tracemalloc.get_traced_memory()[0]
+#
+
+"""frozenset of type - the classes of expression nodes"""
+_nodeTypes = frozenset((Bracket, Func, ArgRef, Numeral))
+
+def LiveNodes():
+	"""Counts the expression nodes which are alive, by looking at every object the garbage collector knows of.
+	Returns:
+		int
+	"""
+	return sum(map(_nodeTypes.__contains__, map(type, gc.get_objects())))
+#
+
+def SampleMemory():
+	"""Counts the expression nodes alive now, if a quarter more memory is allocated than at the last count
+	(see the NOTE above). Called by limits.Check while measuring memory.
+	Changes:
+		_peakBytes, _peakNodes, _nextSample
+	"""
+	global _peakBytes
+	global _peakNodes
+	global _nextSample
+
+	allocated, peak = tracemalloc.get_traced_memory()
+	if allocated < _nextSample:
+		return
+	_peakBytes = max(_peakBytes, peak)
+	_peakNodes = max(_peakNodes, LiveNodes())
+	tracemalloc.reset_peak() # forget the memory used to count the nodes
+	_nextSample = allocated + max((allocated - _startBytes) // 4, sampleBytes)
+#
+
+def _ResetMemory():
+	"""Starts measuring the peak memory and nodes again from how many are allocated now."""
+	global _startBytes
+	global _startNodes
+	global _peakBytes
+	global _peakNodes
+	global _nextSample
+
+	if measuringMemory:
+		_startNodes = _peakNodes = LiveNodes()
+		tracemalloc.reset_peak()
+		_startBytes = _peakBytes = tracemalloc.get_traced_memory()[0]
+		_nextSample = _startBytes + sampleBytes
+#
+
+#endregion
+#region Profile Report
+
+"""int - how many of the most expanded definitions are listed by PrintProfile"""
+profileDefinitionsShown = 10
+
+def PrintProfile(records, file=None):
+	"""Prints a table of the counters of each statement, followed by the most expanded definitions
+	and the steps saved by the rewrite pass.
+	Arguments:
+		records: list of dictionary - each statement's profile (see interpreter.Interpreter.profile)
+		file: file object - where to print ('None' for sys.stdout)
+	"""
+	row = '{0:<6} {1:<40} {2:>10} {3:>10} {4:>10} {5:>10} {6:>10} {7:>6}'
+	print(row.format('line', 'statement', 'time (ms)', 'beta', 'copied', 'expanded', 'compared', 'depth'), file=file)
+	for record in records:
+		if 'time' not in record:
+			continue # the statement did not run
+		statement = record['statement']
+		if len(statement) > 40:
+			statement = statement[:37] + '...'
+		print(row.format(
+			record['line'], statement, '{0:.2f}'.format(record['time'] * 1000),
+			*(record[name] for name in names)), file=file)
+	#
+
+	ran = [record for record in records if 'time' in record]
+	totals = Combine(ran)
+	print(row.format(
+		'', 'total', '{0:.2f}'.format(sum(record['time'] for record in ran) * 1000),
+		*(totals[name] for name in names)), file=file)
+
+	expanded = {}
+	for record in ran:
+		for name, count in record['expandedDefinitions'].items():
+			expanded[name] = expanded.get(name, 0) + count
+	#
+	if expanded:
+		print('\nMost expanded definitions:', file=file)
+		for name, count in sorted(expanded.items(), key=lambda item: -item[1])[:profileDefinitionsShown]:
+			print('{0:>10}  {1}'.format(count, name), file=file)
+		#
+	#
+
+	rewritten = {}
+	for record in ran:
+		for rule, steps in record.get('rewrittenSteps', {}).items():
+			rewritten[rule] = rewritten.get(rule, 0) + steps
+	#
+	if rewritten:
+		print('\nSteps saved by rewrite rules:', file=file)
+		for rule, steps in sorted(rewritten.items(), key=lambda item: -item[1]):
+			print('{0:>10}  {1}'.format(steps, rule), file=file)
+		#
+		print('{0:>10}  {1}'.format(sum(rewritten.values()), 'total'), file=file)
+	#
+#
+
+def PrintMemory(records, file=None):
+	"""Prints a table of the peak memory and nodes of each statement, and how many nodes its result has.
+	Arguments:
+		records: list of dictionary - each statement's profile (see interpreter.Interpreter.profile)
+		file: file object - where to print ('None' for sys.stdout)
+	"""
+	row = '{0:<6} {1:<40} {2:>12} {3:>12} {4:>12}'
+	print(row.format('line', 'statement', 'peak (KB)', 'peak nodes', 'result nodes'), file=file)
+	ran = [record for record in records if 'peakMemory' in record]
+	for record in ran:
+		statement = record['statement']
+		if len(statement) > 40:
+			statement = statement[:37] + '...'
+		print(row.format(
+			record['line'], statement, '{0:.1f}'.format(record['peakMemory'] / 1024),
+			record['peakNodes'], record.get('nodes', '-')), file=file)
+	#
+	print(row.format(
+		'', 'most', '{0:.1f}'.format(max((record['peakMemory'] for record in ran), default=0) / 1024),
+		max((record['peakNodes'] for record in ran), default=0),
+		max((record['nodes'] for record in ran if 'nodes' in record), default='-')), file=file)
+#
+
+def WriteProfile(records, filepath):
+	"""Writes the profile of each statement to a JSON file.
+	Arguments:
+		records: list of dictionary - each statement's profile (see interpreter.Interpreter.profile)
+		filepath: str
+	"""
+	with open(filepath, 'w') as file:
+		json.dump(records, file, indent='\t')
+	#
+#
+
+#endregion
@@ -1,7 +1,8 @@
 #region imports
 
+import itertools
+
 from debugwrapper import dprint
-from globalvars import currentHierarchy
 
 #endregion
 #region Exceptions
@@ -28,18 +29,65 @@ class DefunctError_InputError(DefunctError):
 		this.location = location
 #
 
+class DefunctError_LimitExceeded(DefunctError):
+	"""A statement did more work than it was allowed to (see limits.py)."""
+	def __init__(this, message, limit, counts, term=None, location=None):
+		"""
+		Arguments:
+			message	 : str
+			limit	 : str - which limit was exceeded ('steps', 'nodes', 'seconds', 'memory' or 'depth')
+			counts	 : dictionary of 'steps', 'nodes' and 'seconds' - the work done by the statement so far
+			term	 : str - the partially reduced expression ('None' if not yet known)
+			location : (int, int) - where the statement starts in the file ('None' if not known)
+		"""
+		super().__init__(message)
+		this.limit = limit
+		this.counts = counts
+		this.term = term
+		this.location = location
+	#
+
+	def __reduce__(this):
+		# so that the error can be sent back from a worker process (see interpreter._RunWorker)
+		return (type(this), (str(this), this.limit, this.counts, this.term, this.location))
+	#
+#
+
 #endregion
 #region Defunct Expressions
 
 """NOTE:
-Sub is a nonexistent base class of Bracket, Func, and ArgRef.
+Sub is a nonexistent base class of Bracket, Func, ArgRef, and Numeral.
 It represents what I call an expression node of Lambda Calculus.
+
+Each Sub class declares __slots__ so that nodes do not carry a __dict__,
+and a class-level 'tag' so that node kinds can be compared as small integers.
+
+Every Sub also stores flags about the expression below it, so that Simplify does not have to walk it:
+	recursive		: bool - whether it can be considered recursive
+	hasRecursive	: bool - whether it contains a recursive Func, or an ArgRef to one
+	frees			: frozenset of Func - the functions outside it whose arguments it refers to
+They are computed when a node is created, from the nodes already below it. A Bracket or Func must be told
+with Update whenever anything below it is changed, after the nodes below it have been updated
+(Simplify and SubstituteArg update each node they change on the way back up).
 """
 
+"""frozenset - the 'frees' of an expression which refers to no function's argument"""
+noFrees = frozenset()
+
+"""Node tags (int) - the value of the 'tag' class attribute of each Sub class"""
+tag_Bracket = 0
+tag_Func = 1
+tag_ArgRef = 2
+tag_Numeral = 3
+
 class Bracket:
 	"""Represents an expression node where a Lambda Calculus Function (left) is being applied to another Sub (right).
 	(Sub)
 	"""
+	__slots__ = ('left', 'right', 'recursive', 'hasRecursive', 'frees')
+	tag = tag_Bracket
+
 	def __init__(this, left=None, right=None):
 		"""
 		Arguments:
@@ -48,54 +96,92 @@ class Bracket:
 		"""
 		this.left = left
 		this.right = right
+		this.Update()
 	#
-		
-	@property
-	def recursive(this):
-		"""Whether this Bracket can be considered recursive.
-		Returns:
-			bool
+
+	def Update(this):
+		"""Computes the stored flags again from 'left' and 'right' (see the NOTE above).
+		'recursive' is whether this Bracket can be considered recursive.
 		"""
-		return this.left == None or this.right == None or (this.left.recursive and this.right.recursive)
+		left = this.left
+		right = this.right
+		if left is None or right is None:
+			this.recursive = True
+			this.hasRecursive = (left is not None and left.hasRecursive) or (right is not None and right.hasRecursive)
+			this.frees = left.frees if left is not None else right.frees if right is not None else noFrees
+			return
+		#
+		this.recursive = left.recursive and right.recursive
+		this.hasRecursive = left.hasRecursive or right.hasRecursive
+		frees = left.frees
+		other = right.frees
+		if other and other is not frees:
+			frees = frees | other if frees else other
+		this.frees = frees
 	#
 
 	@property
 	def containsRecursive(this):
-		"""Whether this Bracket contains a recursive Sub.
+		"""Whether this Bracket contains a recursive Sub (see ContainsRecursive).
 		Returns:
 			bool
 		"""
-		return this.left.containsRecursive or this.right.containsRecursive
+		return ContainsRecursive(this)
 	#
 #
 class Func:
 	"""Represents a Lambda Calculus Function which can be applied to another Sub.
 	(Sub)
 	"""
+	__slots__ = ('argname', 'body', 'recursive', 'active', 'hasRecursive', 'frees')
+	tag = tag_Func
+
 	def __init__(this, argname='', body=None, recursive=False):
 		"""Arguments:
 			argname		: str - this function's argument name
 			body		: Sub ref - the top expression node contained within this function
 			recursive	: bool - whether this function can be considered recursive.
+				(Must not change once an ArgRef refers to this function, see ArgRef.recursive)
 		"""
 		this.argname = argname
 		this.body = body
 		this.recursive = recursive
+
+		"""int - how many times this function is in globalvars.currentHierarchy (see reduction.Simplify)"""
+		this.active = 0
+
+		this.Update()
+	#
+
+	def Update(this):
+		"""Computes the stored flags again from 'body' and 'recursive' (see the NOTE above)."""
+		body = this.body
+		if body is None:
+			this.hasRecursive = this.recursive
+			this.frees = noFrees
+			return
+		#
+		this.hasRecursive = this.recursive or body.hasRecursive
+		frees = body.frees
+		this.frees = frees - {this} if this in frees else frees
 	#
 	
 	@property
 	def containsRecursive(this):
-		"""Whether this Func contains a recursive Sub.
+		"""Whether this Func contains a recursive Sub (see ContainsRecursive).
 		Returns:
 			bool
 		"""
-		return this.recursive or this.body.containsRecursive
+		return ContainsRecursive(this)
 	#
 #
 class ArgRef:
 	"""Represents a reference to either a function argument or a definition.
 	(Sub)
 	"""
+	__slots__ = ('argname', 'func', 'recursive', 'hasRecursive', 'frees')
+	tag = tag_ArgRef
+
 	def __init__(this, argname='', func=None):
 		"""
 		Arguments:
@@ -104,38 +190,119 @@ class ArgRef:
 		"""
 		this.argname = argname
 		this.func = func
+
+		"""bool - whether this ArgRef can be considered recursive (whether 'func' is recursive).
+		Must be set again whenever 'func' is changed (see Link), like 'hasRecursive' and 'frees'.
+		"""
+		this.recursive = func != None and func.recursive
+		this.hasRecursive = this.recursive
+		this.frees = frozenset((func,)) if func != None else noFrees
 	#
-	
-	@property
-	def recursive(this):
-		"""Whether this ArgRef can be considered recursive.
-		Returns:
-			bool
+
+	def Link(this, func):
+		"""Makes this ArgRef refer to a function.
+		The nodes above it must be updated afterwards (see the NOTE above).
+		Arguments:
+			func: Func - the referenced Func
 		"""
-		return this.func != None and this.func.recursive
+		this.func = func
+		this.recursive = func.recursive
+		this.hasRecursive = this.recursive
+		this.frees = frozenset((func,))
 	#
 	
 	@property
 	def containsRecursive(this):
-		"""Whether this ArgRef contains a recursive Sub.
+		"""Whether this ArgRef contains a recursive Sub, or refers to a function which is being simplified.
 		Returns:
 			bool
 		"""
-		return this.recursive or this.func in currentHierarchy
+		return this.recursive or (this.func != None and this.func.active > 0)
 	#
 #
+def ContainsRecursive(sub):
+	"""Whether an expression contains a recursive Sub, or refers to the argument of a function which
+	is being simplified (a function in globalvars.currentHierarchy).
+	Uses the flags stored on the node (see the NOTE above), so only the functions in its 'frees' are checked.
+	Arguments:
+		sub: Sub
+	Returns:
+		bool
+	"""
+	if sub is None:
+		return False
+	if sub.hasRecursive:
+		return True
+	for func in sub.frees:
+		if func.active > 0:
+			return True
+	#
+	return False
+#
 
+class Numeral:
+	"""Represents a Church numeral [f x. f(f(...f(x)))] by how many times 'f' is applied (see numerals.py).
+	A Numeral is never changed after it is created, so it does not need to be copied.
+	(Sub)
+	"""
+	__slots__ = ('value', 'fname', 'xname')
+	tag = tag_Numeral
+
+	"""A Numeral never contains a recursive function, nor refers to a function's argument."""
+	recursive = False
+	hasRecursive = False
+	containsRecursive = False
+	frees = noFrees
+
+	def __init__(this, value=0, fname='y', xname='x'):
+		"""
+		Arguments:
+			value : int - how many times 'f' is applied to 'x'
+			fname : str - the argument name of the outer function
+			xname : str - the argument name of the inner function
+		"""
+		this.value = value
+		this.fname = fname
+		this.xname = xname
+	#
+#
+
+
+"""iterator of int - gives each Def its 'order'"""
+_defOrder = itertools.count()
 
 class Def:
 	"""Represents a Definition, binding an expression to a name which can be referenced."""
-	def __init__(this, name='', body=None):
+	__slots__ = ('name', 'body', 'hash', 'normalized', 'references', 'lazy', 'order', 'previous')
+
+	def __init__(this, name='', body=None, previous=None):
 		"""
 		Arguments:
-			name : str - the name which represents this expression
-			body : Sub ref - the top expression node contained within this definition
+			name	 : str - the name which represents this expression
+			body	 : Sub ref - the top expression node contained within this definition
+			previous : Def - the definition with the same name which this one replaces ('None' if there was none,
+				or no lazy definition can look it up, see interpreter.Interpreter._TrimPrevious)
 		"""
 		this.name = name
 		this.body = body
+		this.previous = previous
+
+		"""int - when this definition was created, compared with the 'order' of other definitions"""
+		this.order = next(_defOrder)
+
+		"""bool - whether the body is still to be simplified the first time it is referenced
+		(a lazy 'def', see reduction.NormalizeDefinition)
+		"""
+		this.lazy = False
+
+		"""int - structural hash of the body when it was indexed ('None' if not indexed)"""
+		this.hash = None
+
+		"""bool - whether the body was simplified when it was defined ('def', not 'def_u')"""
+		this.normalized = False
+
+		"""frozenset of str - names of definitions and primitives referenced by the body ('None' if not indexed)"""
+		this.references = None
 	#
 
 	def __contains__(this, item):
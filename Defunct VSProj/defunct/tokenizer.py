@@ -0,0 +1,111 @@
+#region imports
+
+import re
+
+#endregion
+#region Tokens
+
+"""Token kinds"""
+token_Identifier = 0	# a name, which may start with '$' (see DoFuncArg)
+token_Symbol = 1		# one of the characters in chars_Symbol
+token_Comment = 2		# the content of a //comment or /*comment*/
+token_End = 3			# the end of the input
+
+chars_Whitespace = ' \t\r\n'
+chars_Symbol = '()[].'
+
+class Token:
+	"""Represents a piece of the input file."""
+	__slots__ = ('kind', 'text', 'location')
+
+	def __init__(this, kind, text, location):
+		"""
+		Arguments:
+			kind	 : int - one of the token_... kinds
+			text	 : str - the characters of the token ('' for token_End, the content for token_Comment)
+			location : (int, int) - where the token starts in the file (line number and column number)
+		"""
+		this.kind = kind
+		this.text = text
+		this.location = location
+	#
+
+	@property
+	def char(this):
+		"""The first character of the token ('' for comments and the end of the input).
+		Returns:
+			str
+		"""
+		if this.kind == token_Comment:
+			return ''
+		return this.text[:1]
+	#
+#
+
+#endregion
+#region Tokenize
+
+"""NOTE:
+A comment may start anywhere whitespace could, including directly after an identifier.
+A '/' which does not start a comment is part of an identifier, but only as its first character,
+so 'a/b' is the two identifiers 'a' and '/b'.
+
+Each match of _tokenPattern is any whitespace followed by one token.
+The number of the group which matched the token is its kind.
+"""
+_tokenPattern = re.compile(r"""
+	[ \t\r\n]*
+	(?:
+		  (//[^\n]*)
+		| (/\*.*?(?:\*/|\Z))
+		| ([()\[\].])
+		| ([^ \t\r\n()\[\].][^ \t\r\n()\[\]./]*)
+	)
+	""", re.VERBOSE | re.DOTALL)
+
+_groupKinds = (None, token_Comment, token_Comment, token_Symbol, token_Identifier)
+
+def Tokenize(text):
+	"""Splits the whole input into tokens. Takes time proportional to the length of the input.
+	Arguments:
+		text: str - the content of the input file
+	Returns:
+		generator of Token - every token except whitespace, ending with a token_End
+	Note:
+		The column of a location is one past the first character of the token,
+		which is where DefunctError_InputError has always reported it.
+	"""
+	"""list of int - the index of every newline in the text"""
+	newlines = [m.start() for m in re.finditer('\n', text)]
+
+	"""int - how many newlines come before the current token"""
+	line = 0
+	"""int - the index where the current token's line starts"""
+	lineStart = 0
+
+	for m in _tokenPattern.finditer(text):
+		group = m.lastindex
+		start = m.start(group)
+		while line < len(newlines) and newlines[line] < start:
+			lineStart = newlines[line] + 1
+			line += 1
+		#
+
+		kind = _groupKinds[group]
+		value = m.group(group)
+		if group == 2:
+			# multiline comment (may be missing its end at the end of the file)
+			value = value[2:-2] if len(value) >= 4 and value.endswith('*/') else value[2:]
+		elif group == 1:
+			value = value[2:]
+		yield Token(kind, value, (line + 1, start - lineStart + 2))
+	#
+
+	end = len(text)
+	if newlines:
+		line = len(newlines)
+		lineStart = newlines[-1] + 1
+	yield Token(token_End, '', (line + 1, end - lineStart + 2))
+#
+
+#endregion
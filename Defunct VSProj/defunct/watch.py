@@ -0,0 +1,210 @@
+#region imports
+
+import io
+import os
+import time
+import hashlib
+
+from structs import *
+from interpreter import Interpreter, Parser, keyword_Execute
+import defcache
+import globalvars
+
+#endregion
+#region Watcher
+
+"""NOTE:
+In watch mode a program is run again whenever its file changes, but only the statements affected by
+the change do any work.
+
+Every run uses a new Interpreter, which shares one defcache.DefinitionCache with the runs before it
+(kept in memory, and in a file as well with '-cache'). A 'def' is only simplified again if its text,
+or the definitions it refers to through the names of its unbound ArgRefs, have changed (see DefinitionCache.Key).
+
+Each 'do' statement gets a key in the same way, and the output it wrote is kept with the key.
+A 'do' statement whose key has not changed is not run again: its output from the previous run is written instead.
+The names which 'print' shows in front of a result (the definitions with an identical body) can change even when
+the key has not, so the structural hash of each printed result is kept with the output as well. The output is only
+reused if the definitions indexed under those hashes are still the same ones (see AliasKey).
+"""
+
+"""float - how many seconds Wait sleeps between checks of the file"""
+pollInterval = 0.5
+
+class Watcher:
+	"""Runs a program file again whenever it changes, reusing the work of earlier runs (see the NOTE above)."""
+
+	def __init__(this, filepath, cache=None, output=None, **options):
+		"""
+		Arguments:
+			filepath: str - the program file
+			cache: defcache.DefinitionCache - where simplified definitions are kept ('None' for a new cache in memory)
+			output: file object - where the output of 'do' statements is written ('None' for sys.stdout)
+			options: the arguments of each Interpreter (see interpreter.Interpreter), except 'cache' and 'output'
+				('jobs' is ignored, statements always run in this process)
+		"""
+		"""str - the program file"""
+		this.filepath = filepath
+
+		"""defcache.DefinitionCache - shared by every run"""
+		this.cache = cache if cache != None else defcache.DefinitionCache(None)
+
+		"""file object - where the output of 'do' statements is written ('None' for sys.stdout)"""
+		this.output = output
+
+		"""dictionary - the arguments of each Interpreter"""
+		this.options = dict(options, jobs=1)
+
+		"""dictionary of
+			key: bytes - the key of a 'do' statement (see DoKey)
+			value: (str, list of int, bytes) - the output it wrote when it last ran, the structural hashes of the
+				expressions it printed, and their AliasKey then
+		"""
+		this.results = {}
+
+		"""Interpreter - the interpreter of the latest run ('None' before the first run)"""
+		this.interpreter = None
+
+		"""int - how many runs have started"""
+		this.runs = 0
+
+		"""int - how many 'do' statements the latest run ran, and how many it reused"""
+		this.ran = 0
+		this.reused = 0
+
+		"""(int, int) - the modification time and size of the file when it was last read ('None' before then)"""
+		this.signature = None
+	#
+
+	def Signature(this):
+		"""Gets the modification time and size of the file.
+		Returns:
+			(int, int)
+			None - the file cannot be found (e.g. while an editor replaces it)
+		"""
+		try:
+			info = os.stat(this.filepath)
+		except OSError:
+			return None
+		return (info.st_mtime_ns, info.st_size)
+	#
+
+	def Wait(this):
+		"""Waits until the file has changed since it was last read.
+		Exceptions:
+			KeyboardInterrupt - the user stopped the program
+		"""
+		while True:
+			signature = this.Signature()
+			if signature != None and signature != this.signature:
+				return
+			time.sleep(pollInterval)
+		#
+	#
+
+	def DoKey(this, sub):
+		"""Computes the key of a 'do' statement from its expression and the definitions it refers to.
+		Must be called while the run's Interpreter is activated, after the definitions before the statement.
+		Arguments:
+			sub: Sub - the expression, before it is simplified
+		Returns:
+			bytes
+			None - the statement's output cannot be reused
+		"""
+		key = this.cache.Key(sub, True, this.interpreter.engine, this.interpreter.rewrite)
+		if key == None:
+			return None
+		return hashlib.blake2b(b'do' + key, digest_size=defcache.keySize).digest()
+	#
+
+	def AliasKey(this, hashes):
+		"""Computes a key of the definitions which 'print' could show in front of its results: those indexed under
+		the structural hashes of the results (see compareSubs.FindIdenticalDefs).
+		Must be called while the run's Interpreter is activated.
+		Arguments:
+			hashes: list of int - the structural hash of each printed expression
+		Returns:
+			bytes
+			None - one of the definitions cannot be cached, so it cannot be told whether it has changed
+		"""
+		h = hashlib.blake2b(b'alias', digest_size=defcache.keySize)
+		for printed in hashes:
+			h.update(str(printed).encode('utf-8') + b'\0')
+			for name in globalvars.definitionsByHash.get(printed, ()):
+				key = this.cache.keys.get(name, b'')
+				if key == None:
+					return None
+				h.update(name.encode('utf-8') + b'\0' + key)
+			#
+		#
+		return h.digest()
+	#
+
+	def Run(this):
+		"""Reads the file and runs it, reusing the definitions and the output of 'do' statements which have not changed.
+		Changes:
+			interpreter, results, runs, ran, reused, signature
+		Exceptions:
+			FileNotFoundError - the file could not be opened
+			DefunctError - a statement could not be read or run (the output of earlier statements has been written)
+		"""
+		if this.runs > 0:
+			this.cache.Reset()
+		this.runs += 1
+		this.ran = 0
+		this.reused = 0
+
+		this.signature = this.Signature()
+		with open(this.filepath, 'r') as file:
+			text = file.read()
+		#
+
+		buffer = io.StringIO()
+		this.interpreter = Interpreter(cache=this.cache, output=buffer, **this.options)
+		results = {}
+		finished = False
+		try:
+			with this.interpreter.activated():
+				parser = Parser(text)
+				for key, name, sub in parser.DoEntry():
+					doKey = this.DoKey(sub) if key == keyword_Execute else None
+					result = this.results.get(doKey)
+					if result != None and result[2] != None and this.AliasKey(result[1]) == result[2]:
+						buffer.write(result[0])
+						this.reused += 1
+					else:
+						if doKey != None:
+							globalvars.printedHashes = []
+						try:
+							this.interpreter.RunStatement(key, name, sub, parser.statementLocation)
+						except DefunctError_LimitExceeded as e:
+							e.location = parser.statementLocation
+							this.interpreter.ReportLimit(e)
+						finally:
+							hashes = globalvars.printedHashes
+							globalvars.printedHashes = None
+						#
+						if key == keyword_Execute:
+							this.ran += 1
+						if doKey != None:
+							result = (buffer.getvalue(), hashes, this.AliasKey(hashes))
+					#
+					if doKey != None:
+						results[doKey] = result
+					print (buffer.getvalue(), end='', file=this.output, flush=True)
+					buffer.seek(0)
+					buffer.truncate()
+				#
+			#
+			finished = True
+		finally:
+			if finished:
+				this.results = results
+			else:
+				# keep the statements which were not reached for the next run
+				this.results.update(results)
+		#
+	#
+#
+
+#endregion